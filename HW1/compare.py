@@ -1,37 +1,29 @@
 #!/usr/bin/env python3
-import argparse
+import os
 import json
+import struct
+import hashlib
+import argparse
+
+from tracefile import IndexedTrace
 
 RED = '\x1b[31m'
 GREEN = '\x1b[36m'
 RESET = '\x1b[0m'
 
+# Cycle digests, stored next to a reference trace (<reference>.digests):
+#   magic (8 bytes), trace size, trace mtime (ns), cycle count as little-endian
+#   uint64, then the DIGEST_SIZE-byte digest of every cycle.
+DIGEST_MAGIC = b"HW1TRDIG"
+DIGEST_HEADER = struct.Struct("<8sQQQ")
+DIGEST_SIZE = 16
+CANONICAL_ENCODER = json.JSONEncoder(separators=(",", ":"), check_circular=False)
 
-parser = argparse.ArgumentParser()
-
-parser.add_argument("input", help="The input JSON for comparison.", type=argparse.FileType("r"))
-parser.add_argument("--reference", "-r", required=True, help="The reference JSON.", type=argparse.FileType("r"))
-
-args = parser.parse_args()
-
-INPUT = json.load(args.input)
-REFERENCE = json.load(args.reference)
 
 # INPUT is [{"ActiveList": [], "BusyBitTable": [bool], "DecodedPCs": int, "Exception": bool, "ExceptionPC": int, "FreeList": [int], "IntegerQueue": [{}], "PC": int, "PhysicalRegisterFile": [int], "RegisterMapTable": [int], }]
 # ActiveList: [{"Done": bool, "Exception": bool, "LogicalDestination": int, "OldDestination": int, "PC": int}]
 # IntegerQueue: set' [{"DestRegister": int, "OpAIsReady": bool, "OpARegTag": int, "OpAValue": int, "OpBIsReady": bool, "OpBRegTag": int, "OpBValue": int, "OpCode": str, "PC": int}]
 
-# INPUT must be a list
-if type(INPUT) != list:
-    print(f"[{RED}Error{RESET}] The input JSON must be a list structure")
-    exit(1)
-
-# Reference should be always a list
-if type(REFERENCE) != list:
-    print("The reference JSON should be a list. Please check if you pick a wrong reference file.")
-    print("If the reference fils is not wrong, please contact TA for more information.")
-    exit(2)
-
 
 def compareIntegerQueueEntry(i: dict, r:dict) -> bool:
     '''
@@ -194,22 +186,23 @@ def compareActiveList(i: list[dict], r:list[dict]) -> bool:
     return True
 
 
-def compareCycleData(i: dict, r: dict) -> bool:
-    types = {
-        "ActiveList": list, 
-        "BusyBitTable": list, 
-        "DecodedPCs": list, 
-        "Exception": bool, 
-        "ExceptionPC": int, 
-        "FreeList": list,
-        "IntegerQueue": list,
-        "PC": int,
-        "PhysicalRegisterFile": list,
-        "RegisterMapTable": list
-    }
+CYCLE_TYPES = {
+    "ActiveList": list, 
+    "BusyBitTable": list, 
+    "DecodedPCs": list, 
+    "Exception": bool, 
+    "ExceptionPC": int, 
+    "FreeList": list,
+    "IntegerQueue": list,
+    "PC": int,
+    "PhysicalRegisterFile": list,
+    "RegisterMapTable": list
+}
 
-    # First, make sure the reference has the correct entry and type.
-    for n, t in types.items():
+
+def checkReferenceCycle(r: dict):
+    # Make sure the reference has the correct entry and type, exit otherwise.
+    for n, t in CYCLE_TYPES.items():
         if not n in r:
             print(f"Missing property in the cycle data in the reference input: {n}")
             print("Please check if the reference file is correct.")
@@ -220,6 +213,13 @@ def compareCycleData(i: dict, r: dict) -> bool:
             print("Please check if the reference file is correct.")
             exit(2)
 
+
+def compareCycleData(i: dict, r: dict) -> bool:
+    types = CYCLE_TYPES.copy()
+
+    # First, make sure the reference has the correct entry and type.
+    checkReferenceCycle(r)
+
     types.pop("ExceptionPC")
 
     # Second, check user's input to make sure they have the correct type.
@@ -266,15 +266,374 @@ def compareCycleData(i: dict, r: dict) -> bool:
 
     return True
 
-# Now it is the final comparison
-if len(INPUT) != len(REFERENCE):
-    print(f"[{RED}Error{RESET}][CycleData] Cycle count mismatched!")
-    exit(1)
+def canonicalIntegerQueueEntry(e: dict) -> list:
+    # Only the operand value or tag that compareIntegerQueueEntry() looks at.
+    return [
+        e["PC"], e["OpCode"], e["DestRegister"], e["OpAIsReady"], e["OpBIsReady"],
+        e["OpAValue"] if e["OpAIsReady"] else e["OpARegTag"],
+        e["OpBValue"] if e["OpBIsReady"] else e["OpBRegTag"],
+    ]
+
+
+def cycleDigest(c: dict) -> bytes:
+    '''
+        Digest of what compareCycleData() compares: the integer queue sorted by
+        PC, the free list as a set and ExceptionPC only with an exception.
+        @return None if the cycle does not have the expected structure
+    '''
+    try:
+        canonical = [
+            [[e["Done"], e["Exception"], e["LogicalDestination"], e["OldDestination"], e["PC"]] for e in c["ActiveList"]],
+            c["BusyBitTable"],
+            c["DecodedPCs"],
+            c["Exception"],
+            c["ExceptionPC"] if c["Exception"] == True else None,
+            sorted(set(c["FreeList"])),
+            sorted((canonicalIntegerQueueEntry(e) for e in c["IntegerQueue"]), key=lambda e: e[0]),
+            c["PC"],
+            c["PhysicalRegisterFile"],
+            c["RegisterMapTable"],
+        ]
+        text = CANONICAL_ENCODER.encode(canonical)
+    except (KeyError, TypeError, ValueError):
+        return None
+    return hashlib.blake2b(text.encode(), digest_size=DIGEST_SIZE).digest()
+
+
+def digestsPath(path: str) -> str:
+    return path + ".digests"
+
+
+def loadDigests(path: str):
+    '''
+        @return the digests stored next to the trace at path, or None if there
+        are none or they are out of date
+    '''
+    try:
+        with open(digestsPath(path), "rb") as f:
+            magic, size, mtime, count = DIGEST_HEADER.unpack(f.read(DIGEST_HEADER.size))
+            data = f.read()
+        stat = os.stat(path)
+    except (OSError, struct.error):
+        return None
+
+    if magic != DIGEST_MAGIC or size != stat.st_size or mtime != stat.st_mtime_ns or len(data) != count * DIGEST_SIZE:
+        return None
+    return [data[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE] for i in range(count)]
+
+
+def writeDigests(path: str) -> int:
+    '''
+        Check every cycle of the reference trace at path (it exits if one is
+        malformed), then store their digests next to it.
+        @return the number of cycles
+    '''
+    digests = []
+    with IndexedTrace(path) as REFERENCE:
+        if not REFERENCE.isList:
+            print("The reference JSON should be a list. Please check if you pick a wrong reference file.")
+            exit(2)
+        for r in REFERENCE:
+            compareCycleData(json.loads(json.dumps(r)), r)
+            digests.append(cycleDigest(r))
+
+    stat = os.stat(path)
+    with open(digestsPath(path), "wb") as f:
+        f.write(DIGEST_HEADER.pack(DIGEST_MAGIC, stat.st_size, stat.st_mtime_ns, len(digests)))
+        f.write(b"".join(digests))
+    return len(digests)
+
+
+def compareTraces(INPUT: IndexedTrace, REFERENCE: IndexedTrace, digests: list[bytes] = None) -> bool:
+    '''
+        @return true if the input trace matches the reference trace
+    '''
+
+    # INPUT must be a list
+    if not INPUT.isList:
+        print(f"[{RED}Error{RESET}] The input JSON must be a list structure")
+        return False
+
+    # Reference should be always a list
+    if not REFERENCE.isList:
+        print("The reference JSON should be a list. Please check if you pick a wrong reference file.")
+        print("If the reference fils is not wrong, please contact TA for more information.")
+        exit(2)
+
+    # Now it is the final comparison
+    # When both cycle counts are known up front, check them first. Otherwise the
+    # mismatch shows up when one of the traces ends before the other.
+    referenceLength = len(digests) if digests is not None else REFERENCE.knownLength()
+    if INPUT.knownLength() is not None and referenceLength is not None:
+        if INPUT.knownLength() != referenceLength:
+            print(f"[{RED}Error{RESET}][CycleData] Cycle count mismatched!")
+            return False
+
+    i = 0
+    while True:
+        try:
+            inp = INPUT[i]
+        except IndexError:
+            inp = None
+
+        # Fast path with the stored digests of the reference: the cycles are the
+        # same when their digests are, and the reference cycle is not even parsed.
+        # (Hashing both cycles here would cost as much as comparing them.)
+        if digests is not None:
+            if i < len(digests) and inp is not None and cycleDigest(inp) == digests[i]:
+                i = i + 1
+                continue
+            r = REFERENCE[i] if i < len(digests) else None
+        else:
+            try:
+                r = REFERENCE[i]
+            except IndexError:
+                r = None
+
+        if r is None and inp is None:
+            break
 
-for i in range(len(INPUT)):
-    if compareCycleData(INPUT[i], REFERENCE[i]) == False:
-        print(f"[{RED}Error{RESET}][CycleData] Cycle {i} data mismatched. Exit.")
+        if r is None or inp is None:
+            print(f"[{RED}Error{RESET}][CycleData] Cycle count mismatched!")
+            return False
+
+        # Field-by-field check, which explains the difference.
+        if compareCycleData(inp, r) == False:
+            print(f"[{RED}Error{RESET}][CycleData] Cycle {i} data mismatched. Exit.")
+            return False
+
+        i = i + 1
+
+    return True
+
+
+def compareFiles(inputPath: str, referencePath: str, useDigests: bool = True) -> bool:
+    # Both traces are memory-mapped and parsed one cycle at a time, only as far as needed.
+    # A sidecar index (see tracefile.py) gives the cycle count without parsing anything,
+    # and stored digests (see writeDigests) avoid parsing the reference cycles.
+    digests = loadDigests(referencePath) if useDigests else None
+    with IndexedTrace(inputPath) as INPUT, IndexedTrace(referencePath) as REFERENCE:
+        return compareTraces(INPUT, REFERENCE, digests)
+
+
+## Diff-all mode: every divergence instead of the first one.
+
+ACTIVE_LIST_FIELDS = ["Done", "Exception", "LogicalDestination", "OldDestination", "PC"]
+
+
+def divergence(cycle: int, structure: str, index, field, expected, actual) -> dict:
+    return {
+        "cycle": cycle,
+        "structure": structure,
+        "index": index,
+        "field": field,
+        "expected": expected,
+        "actual": actual,
+    }
+
+
+def same(a, e) -> bool:
+    # Values are only the same with the same type (true is not 1).
+    return type(a) == type(e) and a == e
+
+
+def diffLists(cycle: int, structure: str, i: list, r: list) -> list[dict]:
+    found = []
+    if len(i) != len(r):
+        found.append(divergence(cycle, structure, None, "length", len(r), len(i)))
+    for idx in range(min(len(i), len(r))):
+        if i[idx] != r[idx]:
+            found.append(divergence(cycle, structure, idx, None, r[idx], i[idx]))
+    return found
+
+
+def diffActiveList(cycle: int, i: list, r: list) -> list[dict]:
+    found = []
+    if len(i) != len(r):
+        found.append(divergence(cycle, "ActiveList", None, "length", len(r), len(i)))
+    for idx in range(min(len(i), len(r))):
+        for field in ACTIVE_LIST_FIELDS:
+            actual = i[idx].get(field) if isinstance(i[idx], dict) else None
+            if not same(actual, r[idx][field]):
+                found.append(divergence(cycle, "ActiveList", idx, field, r[idx][field], actual))
+    return found
+
+
+def diffIntegerQueue(cycle: int, i: list, r: list) -> list[dict]:
+    # Entries are matched by PC, the index of a divergence is that PC.
+    found = []
+    if len(i) != len(r):
+        found.append(divergence(cycle, "IntegerQueue", None, "length", len(r), len(i)))
+    entries = {}
+    for e in i:
+        if not isinstance(e, dict) or "PC" not in e:
+            found.append(divergence(cycle, "IntegerQueue", None, "PC", "an entry with a PC", e))
+        elif e["PC"] in entries:
+            # Only the first one is compared, the others are extra entries.
+            found.append(divergence(cycle, "IntegerQueue", e["PC"], "duplicate", None, e))
+        else:
+            entries[e["PC"]] = e
+
+    for e in sorted(r, key=lambda x: x["PC"]):
+        actual = entries.pop(e["PC"], None)
+        if actual is None:
+            found.append(divergence(cycle, "IntegerQueue", e["PC"], None, e, None))
+            continue
+
+        for field in ["OpCode", "DestRegister", "OpAIsReady", "OpBIsReady"]:
+            if not same(actual.get(field), e[field]):
+                found.append(divergence(cycle, "IntegerQueue", e["PC"], field, e[field], actual.get(field)))
+        for op in ["A", "B"]:
+            field = f"Op{op}Value" if actual.get(f"Op{op}IsReady") else f"Op{op}RegTag"
+            if field not in actual or actual[field] != e[field]:
+                found.append(divergence(cycle, "IntegerQueue", e["PC"], field, e[field], actual.get(field)))
+
+    for pc, e in sorted(entries.items(), key=lambda x: str(x[0])):
+        found.append(divergence(cycle, "IntegerQueue", pc, None, None, e))
+    return found
+
+
+def diffCycle(cycle: int, i: dict, r: dict) -> list[dict]:
+    '''
+        @return every divergence of the input cycle i from the reference cycle r
+    '''
+    checkReferenceCycle(r)
+    if not isinstance(i, dict):
+        return [divergence(cycle, "Cycle", None, None, "an object", i)]
+
+    found = []
+    for n, t in CYCLE_TYPES.items():
+        if n == "ExceptionPC" and r["Exception"] != True:
+            continue
+        if n not in i or type(i[n]) != t:
+            found.append(divergence(cycle, n, None, "type", t.__name__, type(i[n]).__name__ if n in i else None))
+            continue
+
+        if n == "ActiveList":
+            found.extend(diffActiveList(cycle, i[n], r[n]))
+        elif n == "IntegerQueue":
+            found.extend(diffIntegerQueue(cycle, i[n], r[n]))
+        elif n == "FreeList":
+            if set(i[n]) != set(r[n]):
+                found.append(divergence(cycle, n, None, None, sorted(set(r[n])), sorted(set(i[n]), key=str)))
+        elif t == list:
+            found.extend(diffLists(cycle, n, i[n], r[n]))
+        elif i[n] != r[n]:
+            found.append(divergence(cycle, n, None, None, r[n], i[n]))
+    return found
+
+
+def diffTraces(INPUT: IndexedTrace, REFERENCE: IndexedTrace, digests: list[bytes] = None) -> list[dict]:
+    '''
+        Compare the whole traces in one pass.
+        @return every divergence, by cycle
+    '''
+    if not INPUT.isList:
+        return [divergence(0, "Trace", None, None, "a list", "not a list")]
+    if not REFERENCE.isList:
+        print("The reference JSON should be a list. Please check if you pick a wrong reference file.")
+        exit(2)
+
+    found = []
+    referenceLength = len(digests) if digests is not None else len(REFERENCE)
+    for cycle, inp in enumerate(INPUT):
+        if cycle >= referenceLength:
+            break
+        if digests is not None and cycleDigest(inp) == digests[cycle]:
+            continue
+        found.extend(diffCycle(cycle, inp, REFERENCE[cycle]))
+
+    if len(INPUT) != referenceLength:
+        found.append(divergence(min(len(INPUT), referenceLength), "Trace", None, "length", referenceLength, len(INPUT)))
+    return found
+
+
+def summarize(divergences: list[dict]) -> dict:
+    structures = {}
+    cycles = set()
+    for d in divergences:
+        cycles.add(d["cycle"])
+        s = structures.setdefault(d["structure"], {"divergences": 0, "cycles": 0, "firstCycle": d["cycle"], "lastCycle": None})
+        s["divergences"] = s["divergences"] + 1
+        if s["lastCycle"] != d["cycle"]:
+            s["cycles"] = s["cycles"] + 1
+            s["lastCycle"] = d["cycle"]
+
+    return {
+        "divergences": len(divergences),
+        "divergentCycles": len(cycles),
+        "first": divergences[0] if divergences else None,
+        "firstCycle": min(cycles) if cycles else None,
+        "lastCycle": max(cycles) if cycles else None,
+        "byStructure": dict(sorted(structures.items(), key=lambda s: s[1]["firstCycle"])),
+    }
+
+
+def diffFiles(inputPath: str, referencePath: str, useDigests: bool = True) -> dict:
+    '''
+        @return the report of every divergence of the input trace
+    '''
+    digests = loadDigests(referencePath) if useDigests else None
+    with IndexedTrace(inputPath) as INPUT, IndexedTrace(referencePath) as REFERENCE:
+        divergences = diffTraces(INPUT, REFERENCE, digests)
+
+    return {
+        "input": inputPath,
+        "reference": referencePath,
+        "passed": not divergences,
+        "summary": summarize(divergences),
+        "divergences": divergences,
+    }
+
+
+def printSummary(summary: dict):
+    first = summary["first"]
+    where = first["structure"] + (f"[{first['index']}]" if first["index"] is not None else "") + \
+        (f".{first['field']}" if first["field"] is not None else "")
+    print(f"[{RED}Error{RESET}] {summary['divergences']} divergences in {summary['divergentCycles']} cycles "
+          f"(cycles {summary['firstCycle']} to {summary['lastCycle']}).")
+    print(f"[{RED}Error{RESET}] First divergence at cycle {first['cycle']}: {where} is {first['actual']}, expected {first['expected']}.")
+    for structure, s in summary["byStructure"].items():
+        print(f"    {structure:<22} from cycle {s['firstCycle']:>6}: {s['divergences']:>6} divergences in {s['cycles']:>6} cycles")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("input", nargs="?", help="The input JSON for comparison.")
+    parser.add_argument("--reference", "-r", required=True, help="The reference JSON.")
+    parser.add_argument("--write-digests", dest="writeDigests", action="store_true",
+        help="Check the reference and store its cycle digests next to it (<reference>.digests), then exit.")
+    parser.add_argument("--no-digests", dest="useDigests", action="store_false",
+        help="Ignore the stored cycle digests of the reference.")
+    parser.add_argument("--diff-all", dest="diffAll", action="store_true",
+        help="Do not stop at the first mismatch: collect every divergence of the whole trace.")
+    parser.add_argument("--report", help="With --diff-all, write every divergence and their summary to this JSON file.")
+
+    args = parser.parse_args()
+
+    if args.writeDigests:
+        print(f"{args.reference}: {writeDigests(args.reference)} cycle digests written.")
+        return
+    if args.input is None:
+        parser.error("the input JSON is required")
+
+    if args.diffAll:
+        report = diffFiles(args.input, args.reference, args.useDigests)
+        if args.report:
+            with open(args.report, "w") as f:
+                json.dump(report, f, indent=4)
+        if not report["passed"]:
+            printSummary(report["summary"])
+            exit(1)
+        print(f"{GREEN}PASSED!{RESET}")
+        return
+
+    if not compareFiles(args.input, args.reference, args.useDigests):
         exit(1)
 
-print(f"{GREEN}PASSED!{RESET}")
+    print(f"{GREEN}PASSED!{RESET}")
+
 
+if __name__ == "__main__":
+    main()
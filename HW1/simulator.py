@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+import json
+import argparse
+from array import array
+from collections import deque
+
+from compare import compareTraces, RED, GREEN, RESET
+from tracefile import IndexedTrace
+
+# Reference cycle-by-cycle simulator of the homework 1 out-of-order processor,
+# producing the states compare.py checks. Every cycle first computes the whole
+# next state from the current one (commit or rollback, forwarding, issue,
+# rename and dispatch, fetch and decode, in this order so the queue updates of
+# a cycle are seen by the later stages of the same cycle), then serializes it.
+#
+# The structures are kept compact and only expanded to JSON when serialized:
+#   active list: a ring buffer of ACTIVE_LIST_SIZE entries in parallel arrays
+#   free list: a deque of physical registers
+#   busy bit table: the bits of an int
+#   integer queue: a dict from PC to [DestRegister, OpAIsReady, OpARegTag,
+#   OpAValue, OpBIsReady, OpBRegTag, OpBValue, OpCode, active list slot]
+
+PHYSICAL_REGISTERS = 64
+LOGICAL_REGISTERS = 32
+ACTIVE_LIST_SIZE = 32
+INTEGER_QUEUE_SIZE = 32
+WIDTH = 4
+EXCEPTION_HANDLER = 0x10000
+MASK = (1 << 64) - 1
+
+OPCODES = {
+    "add": "add",
+    "addi": "add",
+    "sub": "sub",
+    "mulu": "mulu",
+    "divu": "divu",
+    "remu": "remu",
+}
+
+# Integer queue entry fields.
+DEST, A_READY, A_TAG, A_VALUE, B_READY, B_TAG, B_VALUE, OPCODE, SLOT = range(9)
+
+
+def parseRegister(text: str) -> int:
+    text = text.strip()
+    if not text.startswith("x") or not 0 <= int(text[1:]) < LOGICAL_REGISTERS:
+        raise ValueError("Invalid register: {}".format(text))
+    return int(text[1:])
+
+
+def parseInstruction(text: str) -> tuple[str, int, int, int, bool]:
+    '''
+        @return (OpCode, rd, rs1, rs2 or the immediate, whether it is an immediate)
+    '''
+    mnemonic, _, operands = text.strip().partition(" ")
+    operands = operands.split(",")
+    if mnemonic not in OPCODES or len(operands) != 3:
+        raise ValueError("Invalid instruction: {}".format(text))
+
+    if mnemonic == "addi":
+        # The immediate is sign-extended to 64 bits.
+        return OPCODES[mnemonic], parseRegister(operands[0]), parseRegister(operands[1]), int(operands[2], 0) & MASK, True
+    return OPCODES[mnemonic], parseRegister(operands[0]), parseRegister(operands[1]), parseRegister(operands[2]), False
+
+
+def execute(opcode: str, a: int, b: int) -> tuple[int, bool]:
+    '''
+        @return (result, whether the operation raises an exception)
+    '''
+    if opcode == "add":
+        return (a + b) & MASK, False
+    if opcode == "sub":
+        return (a - b) & MASK, False
+    if opcode == "mulu":
+        return (a * b) & MASK, False
+    if b == 0:
+        return 0, True
+    if opcode == "divu":
+        return a // b, False
+    return a % b, False
+
+
+class OoO470:
+    def __init__(self, program: list[str]):
+        self.program = [parseInstruction(instruction) for instruction in program]
+
+        self.PC = 0
+        self.DecodedPCs = []
+        self.Exception = False
+        self.ExceptionPC = 0
+        self.PhysicalRegisterFile = array("Q", [0] * PHYSICAL_REGISTERS)
+        self.RegisterMapTable = array("B", range(LOGICAL_REGISTERS))
+        self.FreeList = deque(range(LOGICAL_REGISTERS, PHYSICAL_REGISTERS))
+        self.BusyBits = 0
+
+        self.activeHead = 0
+        self.activeCount = 0
+        self.activePC = array("q", [0] * ACTIVE_LIST_SIZE)
+        self.activeLogical = array("B", [0] * ACTIVE_LIST_SIZE)
+        self.activeOld = array("B", [0] * ACTIVE_LIST_SIZE)
+        self.activeDone = bytearray(ACTIVE_LIST_SIZE)
+        self.activeException = bytearray(ACTIVE_LIST_SIZE)
+
+        self.IntegerQueue = {}
+
+        # Pipeline registers of the two ALU cycles: (pc, slot, dest, opcode, a, b).
+        self.ALU1 = []
+        self.ALU2 = []
+
+        self.cycle = 0
+
+    def isDone(self) -> bool:
+        return self.PC >= len(self.program) and not self.DecodedPCs and self.activeCount == 0 and not self.Exception
+
+    def commit(self) -> bool:
+        '''
+            Retire up to WIDTH done instructions from the head of the active list.
+            @return true if it stopped at an instruction raising an exception
+        '''
+        for _ in range(min(WIDTH, self.activeCount)):
+            slot = self.activeHead
+            if not self.activeDone[slot]:
+                return False
+            if self.activeException[slot]:
+                self.ExceptionPC = self.activePC[slot]
+                return True
+            self.FreeList.append(self.activeOld[slot])
+            self.activeHead = (slot + 1) % ACTIVE_LIST_SIZE
+            self.activeCount = self.activeCount - 1
+        return False
+
+    def rollback(self):
+        # Newest first: the register an instruction renamed its destination to
+        # is the one currently mapped, as the later instructions are undone.
+        for _ in range(min(WIDTH, self.activeCount)):
+            slot = (self.activeHead + self.activeCount - 1) % ACTIVE_LIST_SIZE
+            logical = self.activeLogical[slot]
+            physical = self.RegisterMapTable[logical]
+            self.FreeList.append(physical)
+            self.BusyBits = self.BusyBits & ~(1 << physical)
+            self.RegisterMapTable[logical] = self.activeOld[slot]
+            self.activeCount = self.activeCount - 1
+
+    def forward(self, results: list[tuple]):
+        # Results of the second ALU cycle: register file, busy bits, active list
+        # and the operands waiting for them in the integer queue.
+        for slot, dest, value, exception in results:
+            self.activeDone[slot] = 1
+            if exception:
+                self.activeException[slot] = 1
+                continue
+            self.PhysicalRegisterFile[dest] = value
+            self.BusyBits = self.BusyBits & ~(1 << dest)
+            for entry in self.IntegerQueue.values():
+                if not entry[A_READY] and entry[A_TAG] == dest:
+                    entry[A_READY], entry[A_TAG], entry[A_VALUE] = True, 0, value
+                if not entry[B_READY] and entry[B_TAG] == dest:
+                    entry[B_READY], entry[B_TAG], entry[B_VALUE] = True, 0, value
+
+    def issue(self) -> list[tuple]:
+        ready = sorted(pc for pc, entry in self.IntegerQueue.items() if entry[A_READY] and entry[B_READY])
+        issued = []
+        for pc in ready[:WIDTH]:
+            entry = self.IntegerQueue.pop(pc)
+            issued.append((pc, entry[SLOT], entry[DEST], entry[OPCODE], entry[A_VALUE], entry[B_VALUE]))
+        return issued
+
+    def operand(self, register: int) -> tuple[bool, int, int]:
+        '''
+            @return (IsReady, RegTag, Value) of a renamed source register
+        '''
+        physical = self.RegisterMapTable[register]
+        if self.BusyBits >> physical & 1:
+            return False, physical, 0
+        return True, 0, self.PhysicalRegisterFile[physical]
+
+    def dispatch(self) -> bool:
+        '''
+            Rename and dispatch all the decoded instructions, or none of them.
+            @return false if there are not enough resources (backpressure)
+        '''
+        count = len(self.DecodedPCs)
+        if count > len(self.FreeList) or count > ACTIVE_LIST_SIZE - self.activeCount or \
+                count > INTEGER_QUEUE_SIZE - len(self.IntegerQueue):
+            return False
+
+        for pc in self.DecodedPCs:
+            opcode, rd, rs1, rs2, immediate = self.program[pc]
+            aReady, aTag, aValue = self.operand(rs1)
+            if immediate:
+                bReady, bTag, bValue = True, 0, rs2
+            else:
+                bReady, bTag, bValue = self.operand(rs2)
+
+            dest = self.FreeList.popleft()
+            slot = (self.activeHead + self.activeCount) % ACTIVE_LIST_SIZE
+            self.activeCount = self.activeCount + 1
+            self.activePC[slot] = pc
+            self.activeLogical[slot] = rd
+            self.activeOld[slot] = self.RegisterMapTable[rd]
+            self.activeDone[slot] = 0
+            self.activeException[slot] = 0
+            self.RegisterMapTable[rd] = dest
+            self.BusyBits = self.BusyBits | (1 << dest)
+
+            self.IntegerQueue[pc] = [dest, aReady, aTag, aValue, bReady, bTag, bValue, opcode, slot]
+
+        self.DecodedPCs = []
+        return True
+
+    def fetch(self):
+        count = min(WIDTH, len(self.program) - self.PC)
+        if count > 0:
+            self.DecodedPCs = list(range(self.PC, self.PC + count))
+            self.PC = self.PC + count
+
+    def tick(self):
+        self.cycle = self.cycle + 1
+
+        if self.Exception:
+            # Exception mode: no fetch, only the rollback of the active list.
+            if self.activeCount == 0:
+                self.Exception = False
+            else:
+                self.rollback()
+            return
+
+        results = []
+        for pc, slot, dest, opcode, a, b in self.ALU2:
+            value, exception = execute(opcode, a, b)
+            results.append((slot, dest, value, exception))
+
+        if self.commit():
+            self.Exception = True
+            self.PC = EXCEPTION_HANDLER
+            self.DecodedPCs = []
+            self.IntegerQueue = {}
+            self.ALU1 = []
+            self.ALU2 = []
+            return
+
+        self.forward(results)
+        self.ALU2 = self.ALU1
+        self.ALU1 = self.issue()
+
+        if self.dispatch():
+            self.fetch()
+
+    def serialize(self) -> dict:
+        activeList = []
+        for i in range(self.activeCount):
+            slot = (self.activeHead + i) % ACTIVE_LIST_SIZE
+            activeList.append({
+                "Done": bool(self.activeDone[slot]),
+                "Exception": bool(self.activeException[slot]),
+                "LogicalDestination": self.activeLogical[slot],
+                "OldDestination": self.activeOld[slot],
+                "PC": self.activePC[slot],
+            })
+
+        integerQueue = []
+        for pc, entry in self.IntegerQueue.items():
+            integerQueue.append({
+                "DestRegister": entry[DEST],
+                "OpAIsReady": entry[A_READY],
+                "OpARegTag": entry[A_TAG],
+                "OpAValue": entry[A_VALUE],
+                "OpBIsReady": entry[B_READY],
+                "OpBRegTag": entry[B_TAG],
+                "OpBValue": entry[B_VALUE],
+                "OpCode": entry[OPCODE],
+                "PC": pc,
+            })
+
+        busy = self.BusyBits
+        return {
+            "ActiveList": activeList,
+            "BusyBitTable": [bool(busy >> i & 1) for i in range(PHYSICAL_REGISTERS)],
+            "DecodedPCs": list(self.DecodedPCs),
+            "Exception": self.Exception,
+            "ExceptionPC": self.ExceptionPC,
+            "FreeList": list(self.FreeList),
+            "IntegerQueue": integerQueue,
+            "PC": self.PC,
+            "PhysicalRegisterFile": list(self.PhysicalRegisterFile),
+            "RegisterMapTable": list(self.RegisterMapTable),
+        }
+
+
+def simulate(program: list[str]):
+    '''
+        Simulate the program, one state at a time.
+        @return a generator of the state after reset, then after every cycle
+    '''
+    processor = OoO470(program)
+    yield processor.serialize()
+    while not processor.isDone():
+        processor.tick()
+        yield processor.serialize()
+
+
+class SimulatedTrace:
+    '''
+        The trace of a simulation, with the interface of IndexedTrace that
+        compareTraces() uses. The cycles are simulated as they are asked for,
+        in order, and never stored.
+    '''
+    isList = True
+
+    def __init__(self, program: list[str]):
+        self.states = simulate(program)
+        self.position = 0
+
+    def knownLength(self):
+        return None
+
+    def __getitem__(self, i: int) -> dict:
+        if i != self.position:
+            raise IndexError("SimulatedTrace is only read in order.")
+        state = next(self.states, None)
+        if state is None:
+            raise IndexError(i)
+        self.position = self.position + 1
+        return state
+
+
+def writeTrace(program: list[str], path: str) -> int:
+    '''
+        Write the trace of the program, one cycle at a time, as json.dump(trace,
+        indent=2) would: byte for byte like the given outputs.
+        @return the number of cycles
+    '''
+    cycles = 0
+    with open(path, "w") as f:
+        f.write("[")
+        for state in simulate(program):
+            f.write(",\n  " if cycles else "\n  ")
+            f.write(json.dumps(state, indent=2).replace("\n", "\n  "))
+            cycles = cycles + 1
+        f.write("\n]")
+    return cycles
+
+
+def checkFile(inputPath: str, program: list[str]) -> bool:
+    '''
+        Compare a trace against the simulation of its program, without any
+        stored reference.
+        @return true if the trace matches
+    '''
+    with IndexedTrace(inputPath) as INPUT:
+        return compareTraces(INPUT, SimulatedTrace(program))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reference simulator of the homework 1 out-of-order processor.")
+    parser.add_argument("program", help="The program JSON (input.json).")
+    parser.add_argument("--output", "-o", help="Write the trace to this JSON file.")
+    parser.add_argument("--check", help="Compare this trace against the simulation, without writing it.")
+    args = parser.parse_args()
+
+    with open(args.program) as f:
+        program = json.load(f)
+
+    try:
+        if args.output:
+            print(f"{args.output}: {writeTrace(program, args.output)} cycles written.")
+        if args.check:
+            if not checkFile(args.check, program):
+                exit(1)
+            print(f"{GREEN}PASSED!{RESET}")
+    except ValueError as e:
+        print(f"[{RED}Error{RESET}] {e}")
+        exit(2)
+
+
+if __name__ == "__main__":
+    main()
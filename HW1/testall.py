@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+import io
+import os
+import re
+import json
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+from compare import compareFiles, RED, GREEN, RESET
+
+# Python counterpart of testall.sh: runs every comparison in one pool of worker
+# processes instead of starting an interpreter per test, then prints a summary
+# table and optionally writes the results as JSON.
+
+ANSI = re.compile(r"\x1b\[[0-9;]*m")
+
+
+def findTests(roots: list[str]) -> list[str]:
+    tests = []
+    for root in roots:
+        for name in sorted(os.listdir(root)):
+            if os.path.isdir(os.path.join(root, name)):
+                tests.append(os.path.join(root, name))
+    return tests
+
+
+def readDescription(test: str) -> str:
+    try:
+        with open(os.path.join(test, "desc.txt")) as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def runTest(job: tuple[str, str]) -> dict:
+    test, userOutput = job
+
+    out = io.StringIO()
+    passed = False
+    with contextlib.redirect_stdout(out):
+        try:
+            passed = compareFiles(os.path.join(test, userOutput), os.path.join(test, "output.json"))
+        except SystemExit:
+            # compare.py exits when the reference itself is malformed.
+            passed = False
+        except (OSError, ValueError) as e:
+            print(f"[{RED}Error{RESET}] {e}")
+
+    return {
+        "test": test,
+        "description": readDescription(test),
+        "passed": passed,
+        "messages": ANSI.sub("", out.getvalue()).splitlines(),
+    }
+
+
+def printSummary(results: list[dict]):
+    width = max([len("Test")] + [len(r["test"]) for r in results])
+    print(f"{'Test':<{width}}  Result  Detail")
+    for r in results:
+        if r["passed"]:
+            status = f"{GREEN}PASSED{RESET}"
+            detail = ""
+        else:
+            status = f"{RED}FAILED{RESET}"
+            detail = r["messages"][0] if r["messages"] else ""
+        print(f"{r['test']:<{width}}  {status}  {detail}")
+
+    passed = sum(1 for r in results if r["passed"])
+    print(f"\n{passed}/{len(results)} tests passed.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the outputs of all the given tests in parallel.")
+    parser.add_argument("roots", nargs="*", default=["given_tests"], help="Directories holding one folder per test.")
+    parser.add_argument("--output", "-o", default="user_output.json", help="Name of the produced trace in each test folder.")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count(), help="Number of worker processes.")
+    parser.add_argument("--json", help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    jobs = [(test, args.output) for test in findTests(args.roots)]
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        results = list(pool.map(runTest, jobs, chunksize=max(1, len(jobs) // (4 * args.jobs))))
+
+    printSummary(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "passed": sum(1 for r in results if r["passed"]),
+                "total": len(results),
+                "tests": results
+            }, f, indent=4)
+
+    if not all(r["passed"] for r in results):
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import mmap
+import struct
+import argparse
+from array import array
+
+# A trace is a JSON array with one object per cycle. IndexedTrace memory-maps
+# the file and only parses the cycles that are asked for, in order, so a
+# comparison can stop at the first mismatch without reading the rest.
+#
+# The cycle offsets can be saved in a sidecar index (<trace>.idx), which gives
+# the cycle count and random access without parsing anything:
+#   magic (8 bytes), trace size, trace mtime (ns), cycle count, then one
+#   (start, end) byte offset pair per cycle, all as little-endian uint64.
+
+INDEX_MAGIC = b"HW1TRIDX"
+INDEX_HEADER = struct.Struct("<8sQQQ")
+
+WHITESPACE = b" \t\r\n"
+
+
+def indexPath(path: str) -> str:
+    return path + ".idx"
+
+
+class IndexedTrace:
+    def __init__(self, path: str, useIndex: bool = True):
+        self.path = path
+        self.decoder = json.JSONDecoder()
+        # offsets[2 * c], offsets[2 * c + 1] are the byte range of cycle c.
+        self.offsets = array("Q")
+        self.complete = False
+        self.pos = 0
+        self.window = 1 << 16
+        self._last = (-1, None)
+
+        self.file = open(path, "rb")
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size > 0 else b""
+
+        self.pos = self._skip(0, WHITESPACE)
+        self.isList = self.pos < self.size and self.data[self.pos:self.pos + 1] == b"["
+        self.pos = self.pos + 1
+
+        if useIndex:
+            self._loadIndex()
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _skip(self, pos: int, chars: bytes) -> int:
+        while pos < self.size and self.data[pos] in chars:
+            pos = pos + 1
+        return pos
+
+    def _loadIndex(self):
+        try:
+            with open(indexPath(self.path), "rb") as f:
+                magic, size, mtime, count = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+                if magic != INDEX_MAGIC or size != self.size or mtime != os.stat(self.path).st_mtime_ns:
+                    return
+                offsets = array("Q")
+                offsets.frombytes(f.read(16 * count))
+        except (OSError, struct.error, ValueError):
+            return
+
+        if len(offsets) != 2 * count:
+            return
+        if sys.byteorder != "little":
+            offsets.byteswap()
+
+        # The closing bracket is not part of any cycle.
+        end = self._skip(offsets[-1] if offsets else self.pos, WHITESPACE)
+        if self.data[end:end + 1] != b"]":
+            return
+        self._checkEnd(end + 1)
+
+        self.offsets = offsets
+        self.complete = True
+
+    def _checkEnd(self, pos: int):
+        # Like json.load, nothing but whitespace after the array.
+        pos = self._skip(pos, WHITESPACE)
+        if pos < self.size:
+            raise json.JSONDecodeError("Extra data", "", pos)
+
+    def writeIndex(self):
+        while self._scanNext():
+            pass
+
+        offsets = self.offsets
+        if sys.byteorder != "little":
+            offsets = array("Q", offsets)
+            offsets.byteswap()
+
+        with open(indexPath(self.path), "wb") as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, self.size, os.stat(self.path).st_mtime_ns, len(self.offsets) // 2))
+            f.write(offsets.tobytes())
+
+    def _scanNext(self) -> bool:
+        '''
+            Parse the element after the last indexed one.
+            @return false when the end of the array has been reached
+        '''
+        if self.complete:
+            return False
+
+        pos = self._skip(self.pos, WHITESPACE + b",")
+        if pos >= self.size:
+            raise json.JSONDecodeError("Expecting ',' delimiter or ']'", "", pos)
+        if self.data[pos:pos + 1] == b"]":
+            self._checkEnd(pos + 1)
+            self.complete = True
+            return False
+
+        while True:
+            text = self.data[pos:pos + self.window].decode("latin-1")
+            try:
+                record, end = self.decoder.raw_decode(text)
+                break
+            except json.JSONDecodeError:
+                if pos + self.window >= self.size:
+                    raise
+                self.window = self.window * 2
+
+        self.offsets.append(pos)
+        self.offsets.append(pos + end)
+        self.pos = pos + end
+        self._last = (len(self.offsets) // 2 - 1, record)
+        return True
+
+    def __len__(self) -> int:
+        while self._scanNext():
+            pass
+        return len(self.offsets) // 2
+
+    def __getitem__(self, cycle: int) -> dict:
+        while cycle >= len(self.offsets) // 2 and self._scanNext():
+            pass
+        if cycle < 0 or cycle >= len(self.offsets) // 2:
+            raise IndexError(f"Cycle {cycle} is out of the trace range.")
+
+        if self._last[0] == cycle:
+            return self._last[1]
+
+        start, end = self.offsets[2 * cycle], self.offsets[2 * cycle + 1]
+        record = json.loads(self.data[start:end].decode("latin-1"))
+        self._last = (cycle, record)
+        return record
+
+    def knownLength(self):
+        '''
+            @return the cycle count if it is known without parsing, None otherwise
+        '''
+        if self.complete:
+            return len(self.offsets) // 2
+        return None
+
+    def __iter__(self):
+        cycle = 0
+        while True:
+            try:
+                yield self[cycle]
+            except IndexError:
+                return
+            cycle = cycle + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write the sidecar cycle index (<trace>.idx) of trace files.")
+    parser.add_argument("traces", nargs="+", help="The JSON traces to index.")
+    args = parser.parse_args()
+
+    for path in args.traces:
+        with IndexedTrace(path, useIndex=False) as trace:
+            if not trace.isList:
+                print(f"{path} is not a JSON list, skipped.")
+                continue
+            trace.writeIndex()
+            print(f"{path}: {len(trace)} cycles indexed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,12 @@
+import io
 import os
 import re
+import sys
 import json
+import hashlib
 import itertools
 import argparse
-
-parser = argparse.ArgumentParser()
-
-parser.add_argument("--loop", required=False, help="The reference JSON using the loop instruction.", type=argparse.FileType("r"))
-parser.add_argument("--pip", required=False, help="The reference JSON using the loop.pip instruction.", type=argparse.FileType("r"))
-parser.add_argument("--refLoop", required=False, help="The reference loop JSON.", type=argparse.FileType("r"))
-parser.add_argument("--refPip", required=False, help="The reference pip JSON.", type=argparse.FileType("r"))
+import contextlib
 
 RED = '\x1b[31m'
 GREEN = '\x1b[36m'
@@ -23,6 +20,16 @@ Branch = 4
 
 slotToStr = ["ALU0", "ALU1", "Mult", "Mem", "Branch"]
 
+WHITESPACE = re.compile(r"\s+")
+
+SIMULATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "simulator")
+# What the semantic mode compares, besides the cycle count.
+SEMANTIC_STATE = ["PhysicalRegisterFile", "PredicateRegisters", "MemoryData"]
+DEFAULT_MAX_CYCLES = 100000
+
+# Simulation results of the references, by content hash of (schedule, memory, maxCycles).
+simulatedReferences = {}
+
 def swapALUs(bundle):
     alu0 = bundle[ALU0]
     bundle[ALU0] = bundle[ALU1]
@@ -31,8 +38,7 @@ def swapALUs(bundle):
     return bundle
 
 def rawInst(inst):
-    p = re.compile(r"\s+")
-    return re.sub(p, "", inst).lower()
+    return WHITESPACE.sub("", inst).lower()
 
 def compareInstructions(resI, refI):
     rawResI = rawInst(resI)
@@ -60,24 +66,190 @@ def compare(resF, refF):
             return "[" + RED + "Error" + RESET + "] Schedule length does not match."
 
         bOks = compareBundles(resB, refB, bLoc)
-        bSwapOk = compareBundles(swapALUs(resB), refB, bLoc)
+        bSwapOk = compareBundles(swapALUs(resB.copy()), refB, bLoc)
 
         if((bOks != "") and (bSwapOk != "")):
             return bOks
 
     return GREEN + "PASSED!" + RESET
 
-args = parser.parse_args()
+def bundleSignature(bundle):
+    # Two bundles match, directly or with their ALUs swapped, exactly when
+    # their signatures are the same: the two ALU slots are sorted.
+    raw = [rawInst(inst) for inst in bundle]
+    if len(raw) >= 2:
+        raw[ALU0:ALU1 + 1] = sorted(raw[ALU0:ALU1 + 1])
+    return hashlib.blake2b("\0".join(raw).encode(), digest_size=16).digest()
+
+class ReferenceIndex:
+    '''
+        All the reference alternatives of a schedule, canonicalized once into a
+        trie of bundle signatures, so a schedule is matched against all of them
+        in a single pass over its bundles.
+    '''
+    def __init__(self):
+        self.root = {}
+        self.references = {}
+
+    def add(self, name, schedule):
+        self.references[name] = schedule
+        node = self.root
+        for bundle in schedule:
+            node = node.setdefault(bundleSignature(bundle), {})
+        # The end of a schedule is marked by a None key.
+        node.setdefault(None, []).append(name)
+
+    def match(self, schedule):
+        '''
+            @return (name of a matching reference or None, compare() message
+            against the reference sharing the longest prefix with schedule)
+        '''
+        if not self.references:
+            return None, "[" + RED + "Error" + RESET + "] No reference schedule."
+
+        node = self.root
+        for bundle in schedule:
+            child = node.get(bundleSignature(bundle))
+            if child is None:
+                break
+            node = child
+        else:
+            if None in node:
+                return node[None][0], GREEN + "PASSED!" + RESET
+
+        # Explain the mismatch with any reference under the last matched bundle.
+        while None not in node:
+            node = next(iter(node.values()))
+        return None, compare(schedule, self.references[node[None][0]])
+
+    def matchSemantics(self, schedule, memories=[{}], maxCycles=DEFAULT_MAX_CYCLES):
+        '''
+            Like match(), but a schedule that matches no reference word for word
+            still passes if it simulates like one of them with every memory
+            initialization. The schedule is simulated once per memory, the
+            references once per memory for all the schedules.
+            @return (name of a matching reference or None, message)
+        '''
+        name, message = self.match(schedule)
+        if name is not None or not self.references:
+            return name, message
+
+        results = [simulateSchedule(schedule, memory, maxCycles) for memory in memories]
+        first = ""
+        for name, reference in self.references.items():
+            message = compareResults(results, reference, memories, maxCycles)
+            if message == "":
+                return name, GREEN + "PASSED!" + RESET
+            first = first or message
+        return None, first
+
+def contentHash(*content):
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+def simulateSchedule(schedule, memory, maxCycles):
+    '''
+        @return the cycle count, whether the schedule ran to its end and the
+        final SEMANTIC_STATE, or an "error"
+    '''
+    if SIMULATOR not in sys.path:
+        sys.path.insert(0, SIMULATOR)
+    from vliw470 import run
+
+    try:
+        # The simulator warnings are not part of the comparison.
+        with contextlib.redirect_stdout(io.StringIO()):
+            trace = run(schedule, memory, maxCycles, finalOnly=True)
+    except (ValueError, AssertionError, KeyError, IndexError, TypeError) as e:
+        return {"error": "{}: {}".format(type(e).__name__, e)}
+
+    result = {
+        "cycles": trace.simulatedCycles,
+        "finished": trace.final["PC"] >= len(schedule),
+    }
+    for name in SEMANTIC_STATE:
+        result[name] = trace.final[name]
+    return result
+
+def simulateReference(schedule, memory, maxCycles):
+    key = contentHash(schedule, memory, maxCycles)
+    if key not in simulatedReferences:
+        simulatedReferences[key] = simulateSchedule(schedule, memory, maxCycles)
+    return simulatedReferences[key]
+
+def firstDifference(res, ref):
+    for name in SEMANTIC_STATE:
+        if res[name] == ref[name]:
+            continue
+        if name == "MemoryData":
+            for addr in sorted(set(res[name]) | set(ref[name])):
+                if res[name].get(addr) != ref[name].get(addr):
+                    return "{}[{}]: {} != {}".format(name, addr, res[name].get(addr), ref[name].get(addr))
+        for idx, (resV, refV) in enumerate(zip(res[name], ref[name])):
+            if resV != refV:
+                return "{}[{}]: {} != {}".format(name, idx, resV, refV)
+    return ""
 
-if(args.loop is not None):
-    LOOP = json.load(args.loop)
-    REFLOOP = json.load(args.refLoop)
-    simpleFull = compare(LOOP, REFLOOP)
-    print("loop schedule: " + simpleFull)
+def compareResults(results, refF, memories, maxCycles):
+    '''
+        results: the simulation of the schedule with every memory initialization
+        @return "" if the reference simulates the same, the mismatch otherwise
+    '''
+    error = "[" + RED + "Error" + RESET + "] "
+    for m, (res, memory) in enumerate(zip(results, memories)):
+        ref = simulateReference(refF, memory, maxCycles)
+        if "error" in ref or not ref["finished"]:
+            return error + "The reference does not run to its end: " + ref.get("error", "too many cycles.")
+        if "error" in res:
+            return error + "The schedule cannot be simulated: " + res["error"]
+        if not res["finished"]:
+            return error + "The schedule does not end within " + str(maxCycles) + " cycles."
+
+        if res["cycles"] != ref["cycles"]:
+            return error + RED + "Cycle count does not match with memory initialization " + str(m) + ": " + \
+                str(res["cycles"]) + " != " + str(ref["cycles"]) + RESET
+        diff = firstDifference(res, ref)
+        if diff != "":
+            return error + RED + "Final state does not match with memory initialization " + str(m) + ": " + \
+                diff + RESET
+    return ""
 
-if(args.pip is not None):
-    PIP = json.load(args.pip)
-    REFPIP = json.load(args.refPip)
-    pipFull = compare(PIP, REFPIP)
-    print("loop.pip schedule: " + pipFull)
+def loadReferences(files):
+    index = ReferenceIndex()
+    for f in files:
+        index.add(f.name, json.load(f))
+    return index
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--loop", required=False, help="The reference JSON using the loop instruction.", type=argparse.FileType("r"))
+    parser.add_argument("--pip", required=False, help="The reference JSON using the loop.pip instruction.", type=argparse.FileType("r"))
+    parser.add_argument("--refLoop", required=False, nargs="+", help="The reference loop JSON, or all its alternatives.", type=argparse.FileType("r"))
+    parser.add_argument("--refPip", required=False, nargs="+", help="The reference pip JSON, or all its alternatives.", type=argparse.FileType("r"))
+    parser.add_argument("--semantic", action="store_true", help="Also accept schedules that simulate like a reference: same cycle count and final registers, predicates and memory.")
+    parser.add_argument("--memory", nargs="+", default=[], help="Data memory initializations of the semantic mode (an empty memory by default).", type=argparse.FileType("r"))
+    parser.add_argument("--max-cycles", dest="maxCycles", type=int, default=DEFAULT_MAX_CYCLES, help="Cycle limit of every simulation in the semantic mode.")
+
+    args = parser.parse_args()
+
+    memories = [json.load(f) for f in args.memory] or [{}]
+
+    def check(schedule, references):
+        index = loadReferences(references)
+        if args.semantic:
+            return index.matchSemantics(schedule, memories, args.maxCycles)[1]
+        return index.match(schedule)[1]
+
+    if(args.loop is not None):
+        LOOP = json.load(args.loop)
+        simpleFull = check(LOOP, args.refLoop)
+        print("loop schedule: " + simpleFull)
+
+    if(args.pip is not None):
+        PIP = json.load(args.pip)
+        pipFull = check(PIP, args.refPip)
+        print("loop.pip schedule: " + pipFull)
+
+if __name__ == "__main__":
+    main()
 
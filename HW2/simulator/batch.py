@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from cache import ResultCache, DEFAULT_MAX_BYTES, cachedRun
+
+# Simulates many (program, memory) pairs in a pool of worker processes and
+# gathers, for each of them, the cycle count, the final architectural state,
+# the performance counters and a checksum of the whole trace. No trace is
+# written to disk. With a cache directory, the results of the (program, memory)
+# pairs simulated before are read from it instead (see cache.py).
+
+ARCHITECTURAL_STATE = ["PC", "RBB", "LC", "EC", "PhysicalRegisterFile", "PredicateRegisters", "MemoryData"]
+
+# (directory, size cap) -> the ResultCache of this worker process, kept across
+# its jobs so that its size estimate spares a scan of the cache at every put.
+_caches = {}
+
+
+def simulateOne(job: tuple[str, str, int, bool, str, int]) -> dict:
+    program, memory, maxCycles, checksum, cacheDir, cacheBytes = job
+    result = {
+        "program": program,
+        "memory": memory,
+    }
+
+    try:
+        with open(program) as f:
+            instructions = json.load(f)
+        init = {}
+        if memory is not None:
+            with open(memory) as f:
+                init = json.load(f)
+
+        cache = None
+        if cacheDir is not None:
+            if (cacheDir, cacheBytes) not in _caches:
+                _caches[(cacheDir, cacheBytes)] = ResultCache(cacheDir, cacheBytes)
+            cache = _caches[(cacheDir, cacheBytes)]
+        simulated = cachedRun(instructions, init, maxCycles, cache, checksum=checksum)
+    except (OSError, ValueError, AssertionError, KeyError, IndexError, TypeError) as e:
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+        return result
+
+    result["cycles"] = simulated["cycles"]
+    result["counters"] = simulated["counters"]
+    if checksum:
+        result["checksum"] = simulated["checksum"]
+    result["final"] = {name: simulated["final"][name] for name in ARCHITECTURAL_STATE}
+    result["cached"] = simulated["cached"]
+    return result
+
+
+def simulateBatch(jobs: list[tuple[str, str]], workers: int = None, maxCycles: int = None, checksum: bool = True,
+        cacheDir: str = None, cacheBytes: int = DEFAULT_MAX_BYTES) -> list[dict]:
+    '''
+        jobs: (program.json, memory.json or None) pairs
+        checksum: whether to hash the trace; without it, no cycle is serialized.
+        cacheDir: the result cache shared by the workers, if any.
+        @return one result per job, in the same order
+    '''
+    workers = workers or os.cpu_count()
+    jobs = [(program, memory, maxCycles, checksum, cacheDir, cacheBytes) for program, memory in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(simulateOne, jobs, chunksize=max(1, len(jobs) // (4 * workers))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate many programs in parallel.")
+    parser.add_argument("programs", nargs="*", help="Program JSON files, all simulated with --memory.")
+    parser.add_argument("--memory", help="Data memory JSON initialization shared by the programs.")
+    parser.add_argument("--jobs-file", help="JSON list of [program, memory] pairs to simulate as well.")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count(), help="Number of worker processes.")
+    parser.add_argument("--max-cycles", dest="maxCycles", type=int, help="Stop every simulation after this many cycles.")
+    parser.add_argument("--no-checksum", dest="checksum", action="store_false", help="Do not compute the trace checksums, only the final states.")
+    parser.add_argument("--json", help="Write the results to this JSON file.")
+    parser.add_argument("--cache", help="Reuse and store the results in this cache directory.")
+    parser.add_argument("--cache-size", dest="cacheSize", type=int, default=DEFAULT_MAX_BYTES >> 20, help="Size cap of the cache, in MiB.")
+    args = parser.parse_args()
+
+    jobs = [(program, args.memory) for program in args.programs]
+    if args.jobs_file:
+        with open(args.jobs_file) as f:
+            jobs = jobs + [tuple(job) for job in json.load(f)]
+
+    results = simulateBatch(jobs, args.jobs, args.maxCycles, args.checksum, args.cache, args.cacheSize << 20)
+
+    width = max([len("Program")] + [len(r["program"]) for r in results])
+    print(f"{'Program':<{width}}  {'Cycles':>8}  {'IPC':>5}  Checksum")
+    for r in results:
+        if "error" in r:
+            print(f"{r['program']:<{width}}  {'-':>8}  {'-':>5}  {r['error']}")
+        else:
+            print(f"{r['program']:<{width}}  {r['cycles']:>8}  {r['counters']['IPC']:>5.2f}  {r.get('checksum', '-')[:16]}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+
+    if any("error" in r for r in results):
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
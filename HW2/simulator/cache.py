@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+import os
+import gzip
+import json
+import hashlib
+import argparse
+import tempfile
+
+from vliw470 import run, decodeProgram, DataMemory
+from tracefile import ChecksumTrace, openTraceWriter
+from checkpoint import programDigest
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# On-disk cache of simulation results, shared by the processes (and the runs)
+# using the same directory. An entry is keyed by the SHA-256 of the simulator
+# sources, the decoded program, the normalized memory initialization and the
+# options of the run, and holds:
+#   <key[:2]>/<key>.json.gz   cycles, final state, counters (and checksum)
+#   <key[:2]>/<key>.trace.gz  optionally, the whole trace as a JSON array
+# Files are written under a temporary name then renamed, so a reader never
+# sees a partial entry. A hit touches the entry; when the cache grows over its
+# size cap, the least recently used entries are evicted, under a lock. The
+# size is only scanned again (under the lock) once the size at the last scan
+# plus what this instance wrote since could exceed the cap, and an eviction
+# leaves some room below it.
+
+DEFAULT_MAX_BYTES = 1 << 30
+# An eviction goes down to this fraction of the cap, so that the next scans
+# are some puts away.
+EVICT_TO = 0.9
+# Every source the cached results depend on: the simulation, the checksum of
+# the trace (tracefile.py) and the program digest of the key (checkpoint.py).
+SIMULATOR_SOURCES = ["vliw470.py", "counters.py", "tracefile.py", "checkpoint.py"]
+RESULT_SUFFIX = ".json.gz"
+TRACE_SUFFIX = ".trace.gz"
+
+_simulatorVersion = None
+
+
+def simulatorVersion() -> str:
+    # Results of another version of the simulator are never reused.
+    global _simulatorVersion
+    if _simulatorVersion is None:
+        digest = hashlib.sha256()
+        for name in SIMULATOR_SOURCES:
+            with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name), "rb") as f:
+                digest.update(f.read())
+        _simulatorVersion = digest.hexdigest()
+    return _simulatorVersion
+
+
+def resultKey(program: list, memory: dict, **options) -> str:
+    '''
+        Programs that decode the same (whatever their spelling) and memories
+        with the same words share their key.
+    '''
+    words = sorted(DataMemory(memory).dump().items())
+    digest = hashlib.sha256()
+    digest.update(simulatorVersion().encode())
+    digest.update(programDigest(decodeProgram(program)))
+    digest.update(json.dumps([words, sorted(options.items())]).encode())
+    return digest.hexdigest()
+
+
+def temporaryPath(directory: str = None, suffix: str = "") -> str:
+    # A new empty file, closed: only its name is used.
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=suffix)
+    os.close(fd)
+    return tmp
+
+
+class ResultCache:
+    def __init__(self, directory: str, maxBytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        # Size of the cache at the last scan (None before the first one), and
+        # bytes written by this instance since.
+        self.scanned = None
+        self.written = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.directory, key[:2], key + suffix)
+
+    def get(self, key: str, withTrace: bool = False) -> dict:
+        '''
+            @return the cached result, with the path of its trace in "trace" if
+            withTrace, or None on a miss
+        '''
+        paths = [self.path(key, RESULT_SUFFIX)]
+        if withTrace:
+            paths.append(self.path(key, TRACE_SUFFIX))
+        try:
+            # Touched first: an entry being read is the last one to be evicted.
+            for path in paths:
+                os.utime(path)
+            with gzip.open(paths[0], "rt", encoding="utf-8") as f:
+                result = json.load(f)
+        except (OSError, EOFError, ValueError):
+            return None
+
+        if withTrace:
+            result["trace"] = paths[1]
+        return result
+
+    def put(self, key: str, result: dict, tracePath: str = None):
+        '''
+            Store the result, and move the gzip-compressed trace at tracePath
+            (a temporary file of tmpPath()) into the cache.
+        '''
+        os.makedirs(os.path.dirname(self.path(key, RESULT_SUFFIX)), exist_ok=True)
+        if tracePath is not None:
+            self.written = self.written + os.path.getsize(tracePath)
+            os.replace(tracePath, self.path(key, TRACE_SUFFIX))
+
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with gzip.open(os.fdopen(fd, "wb"), "wt", encoding="utf-8") as f:
+            json.dump(result, f)
+        self.written = self.written + os.path.getsize(tmp)
+        os.replace(tmp, self.path(key, RESULT_SUFFIX))
+
+        self.evict()
+
+    def tmpPath(self) -> str:
+        return temporaryPath(self.directory, ".tmp")
+
+    def entries(self) -> dict:
+        '''
+            @return key -> [size in bytes, last use, paths]
+        '''
+        entries = {}
+        for sub in os.scandir(self.directory):
+            if not sub.is_dir():
+                continue
+            for f in os.scandir(sub.path):
+                key = f.name.split(".")[0]
+                try:
+                    stat = f.stat()
+                except OSError:
+                    continue
+                entry = entries.setdefault(key, [0, 0, []])
+                entry[0] = entry[0] + stat.st_size
+                entry[1] = max(entry[1], stat.st_mtime_ns)
+                entry[2].append(f.path)
+        return entries
+
+    def size(self) -> int:
+        return sum(entry[0] for entry in self.entries().values())
+
+    def evict(self, force: bool = False):
+        # The estimate misses what the other processes wrote since the last
+        # scan, which their own estimates account for.
+        if not force and self.scanned is not None and self.scanned + self.written <= self.maxBytes:
+            return
+
+        with open(os.path.join(self.directory, ".lock"), "w") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = self.entries()
+            total = sum(entry[0] for entry in entries.values())
+            target = self.maxBytes * EVICT_TO if total > self.maxBytes else total
+            for size, _, paths in sorted(entries.values(), key=lambda entry: entry[1]):
+                if total <= target:
+                    break
+                for path in paths:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                total = total - size
+            self.scanned = total
+            self.written = 0
+
+    def clear(self):
+        self.maxBytes, maxBytes = 0, self.maxBytes
+        self.evict(force=True)
+        self.maxBytes = maxBytes
+
+
+def cachedRun(program: list[list[str]], memory: dict = {}, maxCycles: int = None, cache: ResultCache = None,
+        withTrace: bool = False, checksum: bool = False) -> dict:
+    '''
+        Simulate the program, unless the cache already holds the result.
+        withTrace: also keep the whole trace, in the file named by "trace".
+        checksum: also compute the SHA-256 checksum of the trace (without withTrace).
+        @return {"cycles", "final", "counters"} (and "checksum", "trace"), with
+        "cached" telling whether it came from the cache
+    '''
+    key = None
+    if cache is not None:
+        key = resultKey(program, memory, maxCycles=maxCycles, checksum=checksum)
+        result = cache.get(key, withTrace)
+        if result is not None:
+            result["cached"] = True
+            return result
+
+    tracePath = None
+    if withTrace:
+        tracePath = cache.tmpPath() if cache is not None else temporaryPath(suffix=TRACE_SUFFIX)
+        with openTraceWriter(tracePath, "json", compress=True) as writer:
+            trace = run(program, memory, maxCycles, writer, counters=True)
+    elif checksum:
+        trace = run(program, memory, maxCycles, ChecksumTrace(), counters=True)
+    else:
+        trace = run(program, memory, maxCycles, finalOnly=True, counters=True)
+
+    result = {
+        "cycles": trace.simulatedCycles,
+        "final": trace.final,
+        "counters": trace.counters,
+    }
+    if checksum and not withTrace:
+        result["checksum"] = trace.hexdigest()
+    # The same (JSON) types as a cached result, such as string memory addresses.
+    result = json.loads(json.dumps(result))
+    if cache is not None:
+        cache.put(key, result, tracePath)
+        if withTrace:
+            tracePath = cache.path(key, TRACE_SUFFIX)
+
+    result["cached"] = False
+    if withTrace:
+        result["trace"] = tracePath
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clear a simulation result cache.")
+    parser.add_argument("directory", help="The cache directory.")
+    parser.add_argument("--clear", action="store_true", help="Remove every entry.")
+    args = parser.parse_args()
+
+    cache = ResultCache(args.directory)
+    if args.clear:
+        cache.clear()
+    entries = cache.entries()
+    print("{}: {} entries, {} bytes".format(args.directory, len(entries), sum(entry[0] for entry in entries.values())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+import io
+import sys
+import gzip
+import json
+import struct
+import hashlib
+import argparse
+from array import array
+
+# Binary checkpoint of the whole state of a VLIW470 at the beginning of a cycle,
+# from which the simulation can be resumed. All the numbers are little-endian:
+#   header: magic, version, SHA-256 of the decoded program, then the cycle, PC,
+#   RBB, LC and EC (uint64)
+#   the 96 predicate bits (12 bytes)
+#   the 96 physical registers (uint64)
+#   the pipeline latches, as a length-prefixed JSON object
+#   the number of memory pages, then for every page: its number (int64), the
+#   mask of its initialized words (PAGE_SIZE bits) and its PAGE_SIZE words.
+# The file is gzip-compressed when its name ends with .gz.
+#
+# takeSnapshot()/restoreSnapshot() do the same in memory, without the program
+# check, sharing the data memory pages until they are written.
+
+CHECKPOINT_MAGIC = b"VLIW470C"
+CHECKPOINT_VERSION = 1
+HEADER = struct.Struct("<8sI32sQQQQQ")
+LENGTH = struct.Struct("<I")
+PAGE_NUMBER = struct.Struct("<q")
+PAGE_COUNT = struct.Struct("<Q")
+
+LATCHES = {
+    "ALU0": "ALU0Pipe",
+    "ALU1": "ALU1Pipe",
+    "Branch": "BranchPipe",
+    "Memory": "MemoryPipe",
+    "Multiply": "MultiplierPipe",
+}
+
+
+def programDigest(program: list) -> bytes:
+    return hashlib.sha256(repr(list(program)).encode()).digest()
+
+
+def checkpointPath(directory: str, cycle: int) -> str:
+    return "{}/cycle-{:010d}.ckpt".format(directory, cycle)
+
+
+def words(buffer: array) -> bytes:
+    if sys.byteorder != "little":
+        buffer = array("Q", buffer)
+        buffer.byteswap()
+    return buffer.tobytes()
+
+
+def saveCheckpoint(processor, path: str):
+    memory = processor.dataMemory
+    maskBytes = memory.PAGE_SIZE // 8
+
+    counters = [processor.cycle, processor.PC, processor.RBB, processor.LC, processor.EC]
+    if not all(0 <= value < 1 << 64 for value in counters):
+        raise ValueError("The cycle, PC, RBB, LC and EC ({}) do not fit in a checkpoint.".format(counters))
+
+    out = io.BytesIO()
+    out.write(HEADER.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION, programDigest(processor.program), *counters))
+    out.write(processor.PredicateBits.to_bytes(12, "little"))
+    out.write(words(processor.PhysicalRegisterFile))
+
+    latches = json.dumps({name: getattr(processor, attribute) for name, attribute in LATCHES.items()}).encode()
+    out.write(LENGTH.pack(len(latches)))
+    out.write(latches)
+
+    out.write(PAGE_COUNT.pack(len(memory.pages)))
+    for number in sorted(memory.pages):
+        out.write(PAGE_NUMBER.pack(number))
+        out.write(memory.present[number].to_bytes(maskBytes, "little"))
+        out.write(words(memory.pages[number]))
+
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "wb") as f:
+        f.write(out.getvalue())
+
+
+def readCheckpoint(path: str) -> bytes:
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:2] == b"\x1f\x8b":
+        data = gzip.decompress(data)
+    return data
+
+
+def readHeader(data: bytes) -> dict:
+    magic, version, digest, cycle, pc, rbb, lc, ec = HEADER.unpack_from(data)
+    if magic != CHECKPOINT_MAGIC or version != CHECKPOINT_VERSION:
+        raise ValueError("Not a version {} VLIW470 checkpoint.".format(CHECKPOINT_VERSION))
+    return {"digest": digest, "cycle": cycle, "PC": pc, "RBB": rbb, "LC": lc, "EC": ec}
+
+
+def restoreCheckpoint(processor, path: str):
+    '''
+        Replace the whole state of processor, which must simulate the same
+        program, by the one saved in the checkpoint.
+    '''
+    data = readCheckpoint(path)
+    header = readHeader(data)
+    if header["digest"] != programDigest(processor.program):
+        raise ValueError("The checkpoint {} was taken with another program.".format(path))
+
+    processor.cycle = header["cycle"]
+    processor.PC = header["PC"]
+    processor.RBB = header["RBB"]
+    processor.LC = header["LC"]
+    processor.EC = header["EC"]
+
+    pos = HEADER.size
+    processor.PredicateBits = int.from_bytes(data[pos:pos + 12], "little")
+    pos = pos + 12
+
+    registers = array("Q")
+    registers.frombytes(data[pos:pos + 8 * 96])
+    if sys.byteorder != "little":
+        registers.byteswap()
+    processor.PhysicalRegisterFile = registers
+    pos = pos + 8 * 96
+
+    (length,) = LENGTH.unpack_from(data, pos)
+    pos = pos + LENGTH.size
+    latches = json.loads(data[pos:pos + length])
+    for name, attribute in LATCHES.items():
+        setattr(processor, attribute, latches[name])
+    pos = pos + length
+
+    memory = type(processor.dataMemory)()
+    maskBytes = memory.PAGE_SIZE // 8
+    (count,) = PAGE_COUNT.unpack_from(data, pos)
+    pos = pos + PAGE_COUNT.size
+    for _ in range(count):
+        (number,) = PAGE_NUMBER.unpack_from(data, pos)
+        pos = pos + PAGE_NUMBER.size
+        memory.present[number] = int.from_bytes(data[pos:pos + maskBytes], "little")
+        pos = pos + maskBytes
+        page = array("Q")
+        page.frombytes(data[pos:pos + 8 * memory.PAGE_SIZE])
+        if sys.byteorder != "little":
+            page.byteswap()
+        memory.pages[number] = page
+        pos = pos + 8 * memory.PAGE_SIZE
+    processor.dataMemory = memory
+
+
+def copyLatch(latch):
+    if isinstance(latch, list):
+        return [stage.copy() for stage in latch]
+    return latch.copy()
+
+
+def takeSnapshot(processor) -> dict:
+    return {
+        "cycle": processor.cycle,
+        "PC": processor.PC,
+        "RBB": processor.RBB,
+        "LC": processor.LC,
+        "EC": processor.EC,
+        "PredicateBits": processor.PredicateBits,
+        "PhysicalRegisterFile": array("Q", processor.PhysicalRegisterFile),
+        "latches": {attribute: copyLatch(getattr(processor, attribute)) for attribute in LATCHES.values()},
+        "memory": processor.dataMemory.snapshot(),
+    }
+
+
+def restoreSnapshot(processor, snapshot: dict):
+    '''
+        Replace the whole state of processor by the one of takeSnapshot(). The
+        snapshot is left untouched, so it can be restored again.
+    '''
+    for name in ["cycle", "PC", "RBB", "LC", "EC", "PredicateBits"]:
+        setattr(processor, name, snapshot[name])
+    processor.PhysicalRegisterFile = array("Q", snapshot["PhysicalRegisterFile"])
+    for attribute, latch in snapshot["latches"].items():
+        setattr(processor, attribute, copyLatch(latch))
+    processor.dataMemory = snapshot["memory"].snapshot()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the architectural registers saved in checkpoints.")
+    parser.add_argument("checkpoints", nargs="+", help="Checkpoint files written by vliw470.py --save-every.")
+    args = parser.parse_args()
+
+    for path in args.checkpoints:
+        header = readHeader(readCheckpoint(path))
+        print("{}: cycle {cycle}, PC {PC}, RBB {RBB}, LC {LC}, EC {EC}".format(path, **header))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+from vliw470 import Opcode
+from hooks import Tracer
+
+# Performance counters of a simulation. Only three counters are updated while
+# simulating, per bundle: how many times it was fetched, how many times each of
+# its predicated operations was enabled (its predicate was true), and how many
+# times its loop branch was taken. Everything else is derived from them and the
+# program by report().
+
+SLOTS = ["ALU0", "ALU1", "Mult", "Mem", "Branch"]
+
+
+class Counters(Tracer):
+    def __init__(self, program: list[tuple]):
+        self.program = program
+        self.cycles = 0
+        self.fetched = [0] * len(program)
+        # enabled[5 * pc + slot], only meaningful for the predicated operations.
+        self.enabled = [0] * (5 * len(program))
+        self.taken = [0] * len(program)
+
+    def decoded(self, processor):
+        pc = processor.PC
+        if pc >= len(self.program):
+            return
+        self.fetched[pc] += 1
+
+        base = 5 * pc
+        enabled = self.enabled
+        if processor.ALU0Pipe["predicate"]:
+            enabled[base] += 1
+        if processor.ALU1Pipe["predicate"]:
+            enabled[base + 1] += 1
+        if processor.MultiplierPipe[0]["predicate"]:
+            enabled[base + 2] += 1
+        if processor.MemoryPipe["predicate"]:
+            enabled[base + 3] += 1
+
+        branch = processor.BranchPipe
+        if branch["predicate"]:
+            enabled[base + 4] += 1
+            # The branch unit sees LC and EC after the ALU writes of the same bundle.
+            lc, ec = processor.LC, processor.EC
+            for alu in [processor.ALU0Pipe, processor.ALU1Pipe]:
+                if alu["predicate"] and alu["opcode"] == "updateLC":
+                    lc = alu["value"]
+                elif alu["predicate"] and alu["opcode"] == "updateEC":
+                    ec = alu["value"]
+            if lc > 0 or (branch["opcode"] == "hw" and ec > 0):
+                self.taken[pc] += 1
+
+    def report(self) -> dict:
+        slots = {name: {"useful": 0, "nop": 0, "predicatedOff": 0} for name in SLOTS}
+        loads = stores = loopIterations = loopPipIterations = 0
+
+        for pc, bundle in enumerate(self.program):
+            enabled = [self.enabled[5 * pc + slot] if op.predicate >= 0 else self.fetched[pc] for slot, op in enumerate(bundle)]
+            for slot, op in enumerate(bundle):
+                stats = slots[SLOTS[slot]]
+                if op.opcode == Opcode.NOP:
+                    stats["nop"] += self.fetched[pc]
+                    continue
+                stats["useful"] += enabled[slot]
+                stats["predicatedOff"] += self.fetched[pc] - enabled[slot]
+
+            if bundle[3].opcode == Opcode.LD:
+                loads += enabled[3]
+            elif bundle[3].opcode == Opcode.ST:
+                stores += enabled[3]
+            if bundle[4].opcode == Opcode.LOOP:
+                loopIterations += self.taken[pc]
+            elif bundle[4].opcode == Opcode.LOOPPIP:
+                loopPipIterations += self.taken[pc]
+
+        for stats in slots.values():
+            stats["utilization"] = stats["useful"] / self.cycles if self.cycles else 0.0
+
+        operations = sum(stats["useful"] for stats in slots.values())
+        return {
+            "cycles": self.cycles,
+            "bundles": sum(self.fetched),
+            "operations": operations,
+            "IPC": operations / self.cycles if self.cycles else 0.0,
+            "slots": slots,
+            "predicatedOff": sum(stats["predicatedOff"] for stats in slots.values()),
+            "loads": loads,
+            "stores": stores,
+            "loopIterations": loopIterations,
+            "loopPipIterations": loopPipIterations,
+        }
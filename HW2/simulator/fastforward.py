@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+from jit import JITVLIW470
+
+# Fast-forward through the steady state of loops.
+#
+# Every cycle is simulated and recorded in detail, except in the steady state
+# of a loop: once two consecutive iterations of a loop (loop or loop.pip) have
+# enabled exactly the same operations, and while LC shows that the following
+# iterations are going to do the same, those iterations run as compiled code
+# and only their first cycle is recorded, as an iteration-boundary checkpoint
+# (or that of every checkpointEvery-th iteration, for the very short bodies).
+# The last iterations with LC > 0 and the epilogue (EC countdown) are back in
+# full detail, and so are the cycles in the keep ranges.
+#
+# As the records are no longer consecutive cycles, each one holds its cycle
+# number in the "Cycle" field.
+
+
+class FastForwardVLIW470(JITVLIW470):
+    def __init__(self, program: list[list[str]], memory=None, keep: list[tuple[int, int]] = [],
+            checkpointEvery: int = 1):
+        super().__init__(program, memory)
+        self.checkpointEvery = checkpointEvery
+        # [start, stop) cycle ranges that must be recorded in detail.
+        self.keep = sorted(keep)
+        # Enabled operations of the cycles of the current iteration, and the
+        # (loop, operations) of the previous one.
+        self.iteration = []
+        self.previousIteration = None
+        # End of the current fast-forward span.
+        self.fastForwardStop = None
+        self.fastForwardedIterations = 0
+
+    def serialize(self) -> dict:
+        record = super().serialize()
+        record["Cycle"] = self.cycle
+        return record
+
+    def nextRecordedCycle(self) -> float:
+        cycle = super().nextRecordedCycle()
+        if self.fastForwardStop is not None:
+            cycle = min(cycle, self.fastForwardStop)
+        return cycle
+
+    def advance(self, maxCycles: int = None):
+        if self.fastForwardStop is not None and self.cycle >= self.fastForwardStop:
+            # Back to full detail.
+            self.fastForwardStop = None
+            self.recordStart = 0
+            self.recordEvery = 1
+            self.recordStop = None
+        super().advance(maxCycles)
+
+    def tick(self):
+        pc = self.PC
+        super().tick()
+        if self.fastForwardStop is None:
+            self.observe(pc)
+
+    def observe(self, pc: int):
+        self.iteration.append((
+            pc,
+            self.ALU0Pipe["predicate"],
+            self.ALU1Pipe["predicate"],
+            self.MultiplierPipe[0]["predicate"],
+            self.MemoryPipe["predicate"],
+            self.BranchPipe["predicate"],
+        ))
+
+        # An iteration ends when a loop branch is taken.
+        if not self.BranchPipe["predicate"] or self.BranchPipe["opcode"] not in ["loop", "hw"]:
+            return
+        if pc >= len(self.program) or self.PC != self.BranchPipe["targetPC"]:
+            return
+
+        iteration = ((self.PC, pc), tuple(self.iteration))
+        self.iteration = []
+        if iteration == self.previousIteration and self.LC > 1:
+            self.fastForward(pc - self.PC + 1, self.LC - 1)
+        self.previousIteration = iteration
+
+    def fastForward(self, length: int, iterations: int):
+        start = self.cycle
+        for keepStart, keepStop in self.keep:
+            if keepStop > start and keepStart < start + iterations * length:
+                iterations = max(0, (keepStart - start) // length)
+                break
+        if iterations == 0:
+            return
+
+        # Record the first cycle of every iteration only.
+        self.fastForwardStop = start + iterations * length
+        self.fastForwardedIterations = self.fastForwardedIterations + iterations
+        if self.trace is not None:
+            self.recordStart = start
+            self.recordEvery = length * self.checkpointEvery
+            self.recordStop = self.fastForwardStop
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import time
+
+# Instrumentation of the simulator, without any cost when it is not used.
+#
+# A Tracer registered with VLIW470.addTracer() is called at every simulated
+# cycle: decoded() once the bundle has been decoded into the pipeline latches
+# (before anything is written), and retired() at the end of the cycle. Tools
+# can record their own per-cycle events from there, without serializing the
+# whole state. The compiled engine (jit.py) runs every cycle through the
+# interpreter as long as a tracer other than the performance counters is
+# registered.
+#
+# PhaseProfiler times the phases of the simulation by wrapping the methods of
+# one processor instance, so tick() itself is left untouched. The trace writer
+# belongs to the caller: its write() is only wrapped while run() runs.
+
+# phase -> method of the processor that implements it
+PHASES = {
+    "decode": "decode",
+    "execute": "execute",
+    "writeback": "writeBack",
+    "serialize": "serialize",
+}
+
+
+class Tracer:
+    def decoded(self, processor):
+        pass
+
+    def retired(self, processor):
+        pass
+
+
+class PhaseProfiler:
+    '''
+        Accumulates the time spent and the number of calls in every phase of
+        processor: decode, execute, writeback, serialize, dump (writing the
+        records to the trace) and other (the rest of run(), like the compiled
+        cycles). callback, if given, is called with every (phase, seconds).
+    '''
+
+    def __init__(self, processor, callback=None):
+        self.callback = callback
+        self.seconds = {phase: 0.0 for phase in list(PHASES) + ["dump", "other"]}
+        self.calls = {phase: 0 for phase in self.seconds}
+
+        for phase, method in PHASES.items():
+            setattr(processor, method, self.timed(phase, getattr(processor, method)))
+        processor.run = self.timedRun(processor, processor.run)
+
+    def timed(self, phase: str, function):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(phase, time.perf_counter() - start)
+        return wrapper
+
+    def timedRun(self, processor, function):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            phases = sum(self.seconds.values())
+            trace = processor.trace
+            if trace is not None:
+                shadowed = "write" in vars(trace)
+                write = trace.write
+                trace.write = self.timed("dump", write)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                if trace is not None:
+                    if shadowed:
+                        trace.write = write
+                    else:
+                        del trace.write
+                self.add("other", time.perf_counter() - start - (sum(self.seconds.values()) - phases))
+        return wrapper
+
+    def add(self, phase: str, seconds: float):
+        self.seconds[phase] = self.seconds[phase] + seconds
+        self.calls[phase] = self.calls[phase] + 1
+        if self.callback is not None:
+            self.callback(phase, seconds)
+
+    def report(self) -> dict:
+        total = sum(self.seconds.values())
+        return {
+            phase: {
+                "seconds": self.seconds[phase],
+                "calls": self.calls[phase],
+                "share": self.seconds[phase] / total if total else 0.0,
+            }
+            for phase in self.seconds
+        }
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+import json
+import time
+import argparse
+
+from vliw470 import VLIW470, DataMemory, decodeProgram
+from hooks import Tracer
+from checkpoint import takeSnapshot, restoreSnapshot
+
+# Incremental re-simulation of the successive versions of a schedule, for
+# search and tuning loops that edit a few bundles at a time.
+#
+# While simulating, the state at the beginning of every cycle multiple of
+# checkpointEvery is kept in memory (see takeSnapshot()), together with the
+# first cycle that fetched each bundle. Everything before the first cycle that
+# fetches the first edited bundle is the same for the new version, so it
+# resumes from the latest checkpoint before that cycle. The checkpoints taken
+# after it are dropped, and replaced while the new version runs.
+
+
+class CheckpointRecorder(Tracer):
+    def __init__(self, simulator: "IncrementalSimulator"):
+        self.simulator = simulator
+
+    def decoded(self, processor):
+        self.simulator.firstFetch.setdefault(processor.PC, processor.cycle)
+
+    def retired(self, processor):
+        # The cycles after the end of the program are the pipeline drain of
+        # run(), which does not resume from there.
+        if processor.cycle % self.simulator.checkpointEvery == 0 and processor.PC < len(processor.program):
+            self.simulator.checkpoints[processor.cycle] = takeSnapshot(processor)
+
+
+class IncrementalSimulator:
+    def __init__(self, memory: dict = {}, checkpointEvery: int = 100, maxCycles: int = None):
+        self.memory = memory if isinstance(memory, DataMemory) else DataMemory(memory)
+        self.checkpointEvery = checkpointEvery
+        self.maxCycles = maxCycles
+
+        # State of the last version simulated.
+        self.program = None
+        self.result = None
+        # cycle -> snapshot at the beginning of that cycle
+        self.checkpoints = {}
+        # PC -> first cycle that fetched it (len(program) for the end of the program)
+        self.firstFetch = {}
+
+    def firstAffectedCycle(self, program: list) -> float:
+        '''
+            @return the first cycle that can differ between the last version
+            and program, or infinity if they simulate the same
+        '''
+        if self.program is None:
+            return 0
+        for pc, (old, new) in enumerate(zip(self.program, program)):
+            if old != new:
+                return self.firstFetch.get(pc, float("inf"))
+        if len(self.program) == len(program):
+            return float("inf")
+        # Only the end of the shorter one moved.
+        return self.firstFetch.get(min(len(self.program), len(program)), float("inf"))
+
+    def run(self, program: list[list[str]]) -> dict:
+        '''
+            Simulate program, reusing what the last version simulated.
+            @return {"cycles", "final", "resumedFrom"}: the number of simulated
+            cycles, the state after the last one and the cycle the simulation
+            resumed from (the cycle count when nothing was simulated again)
+        '''
+        program = decodeProgram(program)
+        affected = self.firstAffectedCycle(program)
+        if affected == float("inf"):
+            self.program = program
+            return dict(self.result, resumedFrom=self.result["cycles"])
+
+        # The latest checkpoint at or before the first affected cycle.
+        resume = max((cycle for cycle in self.checkpoints if cycle <= affected), default=None)
+        self.checkpoints = {cycle: state for cycle, state in self.checkpoints.items() if cycle <= affected}
+        self.firstFetch = {pc: cycle for pc, cycle in self.firstFetch.items() if resume is not None and cycle < resume}
+
+        processor = VLIW470(program, self.memory.snapshot())
+        if resume is not None:
+            restoreSnapshot(processor, self.checkpoints[resume])
+        else:
+            resume = 0
+            self.checkpoints[0] = takeSnapshot(processor)
+        processor.addTracer(CheckpointRecorder(self))
+        processor.run(self.maxCycles)
+
+        self.program = program
+        self.result = {
+            "cycles": processor.cycle,
+            "final": processor.serialize(),
+            "resumedFrom": resume,
+        }
+        return self.result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate successive versions of a schedule, each one resuming from the previous one.")
+    parser.add_argument("programs", nargs="+", help="Program JSON files, simulated in this order.")
+    parser.add_argument("--memory", help="Data memory JSON initialization.")
+    parser.add_argument("--checkpoint-every", dest="checkpointEvery", type=int, default=100, help="Cycles between two in-memory checkpoints.")
+    parser.add_argument("--max-cycles", dest="maxCycles", type=int, help="Stop every simulation after this many cycles.")
+    parser.add_argument("--json", help="Write the final states to this JSON file.")
+    args = parser.parse_args()
+
+    memory = {}
+    if args.memory:
+        with open(args.memory) as f:
+            memory = json.load(f)
+
+    simulator = IncrementalSimulator(memory, args.checkpointEvery, args.maxCycles)
+    finals = []
+    width = max([len("Program")] + [len(path) for path in args.programs])
+    print(f"{'Program':<{width}}  {'Cycles':>8}  {'Resumed':>8}  Seconds")
+    for path in args.programs:
+        with open(path) as f:
+            program = json.load(f)
+        start = time.perf_counter()
+        result = simulator.run(program)
+        print(f"{path:<{width}}  {result['cycles']:>8}  {result['resumedFrom']:>8}  {time.perf_counter() - start:.3f}")
+        finals.append(result["final"])
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(finals, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+
+import functools
+
+from vliw470 import VLIW470, Opcode, Operation, MASK64
+
+# Compiles every loop of a decoded program (the bundles from the target of a
+# loop or loop.pip to the bundle that branches back to it, the outermost of
+# nested loops) into a generated Python function that simulates its cycles in a
+# row, keeping PC, RBB, LC, EC, the predicates and the multiplier pipeline in
+# local variables. The code outside the loops only runs once per loop, which
+# costs less to interpret than to compile, so it is left to the interpreter.
+# The branch targets are relative to the first bundle of the loop, so that
+# identical loops share their compiled code.
+#
+# The predicate checks are inlined in the code of every bundle, and the
+# registers renamed through RBB are looked up in the table of the current RBB
+# (RENAMED[rbb], the local ren). The body of a loop of which only the last
+# bundle branches is also compiled as a whole: once the code reaches its first
+# bundle, whole iterations run back to back, without looking up the code of
+# every bundle and with the multiplier pipeline resolved at compile time, as
+# long as they end before the stop cycle.
+#
+# The generated code does not build the pipeline latches (ALU0Pipe, ...), so
+# every cycle that is recorded, the last cycle of a run and the bundles that
+# write a register twice are left to the interpreter (VLIW470.tick). So are the
+# cycles where RBB is outside [0, MAX_RBB], in which a renamed register can be
+# out of range: there, the interpreter raises the same errors as without
+# compiled code. The state is therefore the same as with the interpreter at
+# every cycle, except that the warnings about a register written twice in a
+# cycle are not printed for the compiled cycles.
+
+ALU_WRITES = [Opcode.ADD, Opcode.ADDI, Opcode.SUB, Opcode.MOV, Opcode.MOVI]
+
+# Largest RBB of the compiled cycles. Up to MAX_RBB + 1 (after a loop.pip),
+# renameRegister() stays in [-96, 95], where a register index works like a list
+# index and readPredicate() adds 96 to the negative ones, as in the interpreter.
+MAX_RBB = 191
+
+
+def renameTable(rbb: int) -> tuple:
+    '''
+        @return renameRegister(idx) at index idx, and the predicate register
+        that readPredicate(idx) reads at index 96 + idx, for RBB = rbb
+    '''
+    registers = [idx if idx < 32 else (idx - rbb + 64 if idx - rbb < 32 else idx - rbb) for idx in range(96)]
+    return tuple(registers + [idx + 96 if idx < 0 else idx for idx in registers])
+
+
+RENAMED = [renameTable(rbb) for rbb in range(MAX_RBB + 2)]
+
+
+def register(idx: int) -> str:
+    # Python expression of renameRegister(idx).
+    if idx < 32:
+        return str(idx)
+    return "ren[{}]".format(idx)
+
+
+def predicate(idx: int) -> str:
+    # Python expression of the predicate register read by readPredicate(idx).
+    if idx < 32:
+        return str(idx)
+    return "ren[{}]".format(96 + idx)
+
+
+def guard(op: Operation) -> str:
+    # Python expression of readPredicate(op.predicate).
+    if op.predicate < 0:
+        return "True"
+    return "(pbits >> {}) & 1 == 1".format(predicate(op.predicate))
+
+
+def writtenPorts(op: Operation) -> set:
+    if op.opcode in ALU_WRITES or op.opcode == Opcode.LD:
+        return {"x{}".format(op.dest)}
+    if op.opcode == Opcode.MOVP:
+        return {"p{}".format(op.dest)}
+    if op.opcode == Opcode.MOVLC:
+        return {"LC"}
+    if op.opcode == Opcode.MOVEC:
+        return {"EC"}
+    if op.opcode == Opcode.MOVRBB:
+        return {"RBB"}
+    if op.opcode == Opcode.LOOP:
+        return {"LC"}
+    if op.opcode == Opcode.LOOPPIP:
+        return {"LC", "EC", "RBB", "p32"}
+    return set()
+
+
+def isCompilable(bundle: tuple) -> bool:
+    written = set()
+    for op in bundle:
+        for idx in [op.predicate, op.dest, op.src1, op.src2]:
+            if idx >= 96:
+                return False # let the interpreter raise the error
+        ports = writtenPorts(op)
+        if written & ports:
+            return False # let the interpreter warn about the double write
+        written = written | ports
+    return True
+
+
+def isRotating(program: tuple) -> bool:
+    # Whether the renaming through RBB matters to the program.
+    for bundle in program:
+        for op in bundle:
+            if op.opcode == Opcode.LOOPPIP or max(op.predicate, op.dest, op.src1, op.src2) >= 32:
+                return True
+    return False
+
+
+def loopBodies(program: tuple) -> dict:
+    '''
+        @return start -> end of the loop bodies compiled as a whole: the
+        bundles start..end, of which only end branches, back to start, and
+        none sets RBB with a mov (RBB is only checked between two iterations)
+    '''
+    bodies = {}
+    for end, bundle in enumerate(program):
+        branch = bundle[4]
+        if branch.opcode not in (Opcode.LOOP, Opcode.LOOPPIP) or not 0 <= branch.imm <= end:
+            continue
+        body = program[branch.imm:end + 1]
+        if not all(isCompilable(b) for b in body) or any(b[4].opcode != Opcode.NOP for b in body[:-1]):
+            continue
+        if any(op.opcode == Opcode.MOVRBB for b in body for op in b):
+            continue
+        bodies.setdefault(branch.imm, end)
+    return bodies
+
+
+def address(op: Operation) -> str:
+    # Python expression of the address of a ld or st.
+    if op.imm == 0:
+        return "R[{}]".format(register(op.src1))
+    return "R[{}] + {}".format(register(op.src1), op.imm)
+
+
+def product(pc: int) -> tuple:
+    # Local variables of the predicate, target and result of the mulu of bundle pc.
+    return ("np{}".format(pc), "nt{}".format(pc), "nv{}".format(pc))
+
+
+def readPorts(op: Operation) -> set:
+    ports = {"p{}".format(op.predicate)} if op.predicate >= 0 else set()
+    if op.opcode in (Opcode.ADD, Opcode.SUB):
+        return ports | {"x{}".format(op.src1), "x{}".format(op.src2)}
+    if op.opcode in (Opcode.ADDI, Opcode.MOV, Opcode.LD):
+        return ports | {"x{}".format(op.src1)}
+    if op.opcode == Opcode.ST:
+        return ports | {"x{}".format(op.src1), "x{}".format(op.dest)}
+    return ports
+
+
+def mayAlias(port: str, written: set) -> bool:
+    # Whether the register or predicate port can be one of written, whatever RBB:
+    # above 64, RBB renames some rotating registers to static ones.
+    if port in written:
+        return True
+    rotating = int(port[1:]) >= 32
+    return any(other[0] == port[0] and other[1:].isdigit() and (int(other[1:]) >= 32) != rotating for other in written)
+
+
+def compileBundle(bundle: tuple, pc: int, counting: bool, advance: bool = True, writeBack: tuple = None) -> list[str]:
+    # Without advance, pc is left as is: the code of the next bundle follows. In
+    # a loop body, writeBack holds the product written back at this cycle (see
+    # compileBody), else the products go through the multiplier latches m0 and m1.
+    if not isCompilable(bundle):
+        return ["break"]
+
+    alu0, alu1, mul, mem, branch = bundle
+    decode = []
+    execute = []
+    # With counting, the performance counters (see counters.py) of bundle pc are updated.
+    taken = ["taken[base + {}] += 1".format(pc)] if counting else []
+    if counting:
+        decode.append("fetched[base + {}] += 1".format(pc))
+
+    ## Decode: the operands are read before anything is written, in the code
+    ## of the execute stage when no unit before can have written them.
+    written = set()
+    for s, op in [(0, alu0), (1, alu1), ("m", mem)]:
+        if op.opcode == Opcode.NOP:
+            continue
+        renamed = "RBB" not in written
+        inline = renamed and not any(mayAlias(port, written) for port in readPorts(op) if port[0] == "x")
+        when = ""
+        if op.predicate >= 0:
+            when = "if {}: ".format(guard(op))
+            if counting:
+                decode.append("if {}: enabled[slots + {}] += 1".format(guard(op), 5 * pc + (3 if s == "m" else s)))
+            if not renamed or mayAlias("p{}".format(op.predicate), written):
+                decode.append("g{} = {}".format(s, guard(op)))
+                when = "if g{}: ".format(s)
+        written = written | writtenPorts(op)
+
+        if op.opcode == Opcode.ADD:
+            value = "(R[{}] + R[{}]) & MASK64".format(register(op.src1), register(op.src2))
+        elif op.opcode == Opcode.SUB:
+            value = "(R[{}] - R[{}]) & MASK64".format(register(op.src1), register(op.src2))
+        elif op.opcode == Opcode.ADDI:
+            value = "(R[{}] + {}) & MASK64".format(register(op.src1), op.imm)
+        elif op.opcode == Opcode.MOV:
+            value = "R[{}]".format(register(op.src1))
+        elif op.opcode == Opcode.MOVI:
+            value = str(op.imm & MASK64)
+        elif op.opcode == Opcode.LD:
+            value = "mread({})".format(address(op))
+        elif op.opcode == Opcode.ST:
+            data = "R[{}]".format(register(op.dest))
+            if inline:
+                execute.append(when + "mwrite({}, {})".format(address(op), data))
+            else:
+                decode.append("a{}, d{} = {}, {}".format(s, s, address(op), data))
+                execute.append(when + "mwrite(a{}, d{})".format(s, s))
+
+        if op.opcode in ALU_WRITES or op.opcode == Opcode.LD:
+            target = register(op.dest)
+            if not renamed:
+                decode.append("t{} = {}".format(s, target))
+                target = "t{}".format(s)
+            if not inline and op.opcode == Opcode.LD:
+                decode.append("a{} = {}".format(s, address(op)))
+                value = "mread(a{})".format(s)
+            elif not inline:
+                decode.append("v{} = {}".format(s, value))
+                value = "v{}".format(s)
+            execute.append(when + "R[{}] = {}".format(target, value))
+        elif op.opcode == Opcode.MOVP:
+            target = predicate(op.dest)
+            if not renamed:
+                decode.append("t{} = {}".format(s, target))
+                target = "t{}".format(s)
+            if op.imm:
+                execute.append(when + "pbits = pbits | (1 << {})".format(target))
+            else:
+                execute.append(when + "pbits = pbits & ~(1 << {})".format(target))
+        elif op.opcode == Opcode.MOVLC:
+            execute.append(when + "lc = {}".format(op.imm))
+        elif op.opcode == Opcode.MOVEC:
+            execute.append(when + "ec = {}".format(op.imm))
+        elif op.opcode == Opcode.MOVRBB:
+            # Out of the table, the next cycle is left to the interpreter before ren is used.
+            table = "RENAMED[{}]".format(op.imm) if 0 <= op.imm <= MAX_RBB else "None"
+            execute.append(when + "rbb, ren = {}, {}".format(op.imm, table))
+
+    if mul.opcode == Opcode.MULU:
+        decode.append("{}, {}, {} = {}, {}, (R[{}] * R[{}]) & MASK64".format(
+            *product(pc), guard(mul), register(mul.dest), register(mul.src1), register(mul.src2)))
+        if counting and mul.predicate >= 0:
+            decode.append("if {}: enabled[slots + {}] += 1".format(product(pc)[0], 5 * pc + 2))
+
+    taking = "True"
+    if branch.opcode != Opcode.NOP and branch.predicate >= 0:
+        taking = guard(branch)
+        if counting:
+            decode.append("if {}: enabled[slots + {}] += 1".format(taking, 5 * pc + 4))
+        if "RBB" in written or mayAlias("p{}".format(branch.predicate), written):
+            decode.append("gb = {}".format(taking))
+            taking = "gb"
+
+    ## Execute: ALUs, memory, then the multiplier write back.
+    if writeBack is None:
+        execute.append("if m1p: R[m1t] = m1v")
+        issued = ", ".join(product(pc)) if mul.opcode == Opcode.MULU else "False, 0, 0"
+        execute.append("m1p, m1t, m1v, m0p, m0t, m0v = m0p, m0t, m0v, " + issued)
+    elif writeBack:
+        execute.append("if {}: R[{}] = {}".format(*writeBack))
+
+    ## Branch unit
+    if advance or branch.opcode != Opcode.NOP:
+        execute.append("pc = {}".format(pc + 1))
+    # RBB is at most MAX_RBB + 1 after loop.pip, which RENAMED still covers.
+    p32 = predicate(32)
+    if branch.opcode == Opcode.LOOP:
+        execute.append("if {} and lc > 0:".format(taking) if taking != "True" else "if lc > 0:")
+        execute.append("    lc = lc - 1")
+        execute.append("    pc = {}".format(branch.imm))
+        execute = execute + ["    " + line for line in taken]
+    elif branch.opcode == Opcode.LOOPPIP:
+        looping = [
+            "if lc > 0:",
+            "    lc = lc - 1",
+            "    rbb = rbb + 1",
+            "    ren = RENAMED[rbb]",
+            "    pbits = pbits | (1 << {})".format(p32),
+            "    pc = {}".format(branch.imm),
+        ] + ["    " + line for line in taken] + [
+            "elif ec > 0:",
+            "    ec = ec - 1",
+            "    rbb = rbb + 1",
+            "    ren = RENAMED[rbb]",
+            "    pbits = pbits & ~(1 << {})".format(p32),
+            "    pc = {}".format(branch.imm),
+        ] + ["    " + line for line in taken] + [
+            "else:",
+            "    pbits = pbits & ~(1 << {})".format(p32),
+        ]
+        if taking == "True":
+            execute = execute + looping
+        else:
+            execute = execute + ["if {}:".format(taking)] + ["    " + line for line in looping]
+
+    return decode + execute
+
+
+def compileBody(program: tuple, start: int, end: int, counting: bool, rotating: bool) -> list[str]:
+    # Whole iterations of the loop body start..end while they fit, else the first bundle alone.
+    length = end - start + 1
+    fits = "cycle + {} <= stop".format(length)
+    if rotating:
+        fits = fits + " and 0 <= rbb <= {}".format(MAX_RBB)
+
+    # The products written back at every cycle of an iteration: those in the
+    # latches m1 and m0 when it starts, then those of the bundles of the body.
+    products = [("m1p", "m1t", "m1v"), ("m0p", "m0t", "m0v")]
+    for pc in range(start, end + 1):
+        products.append(product(pc) if program[pc][2].opcode == Opcode.MULU else ())
+
+    lines = ["if {}:".format(fits), "    while True:"]
+    for pc in range(start, end + 1):
+        code = compileBundle(program[pc], pc, counting, pc == end, products[pc - start])
+        if pc == end:
+            # The latches are only updated at the end of an iteration, before RBB changes.
+            latches = [", ".join(p) if p else "False, 0, 0" for p in products[-2:]]
+            code.insert(code.index("pc = {}".format(pc + 1)), "m1p, m1t, m1v, m0p, m0t, m0v = {}, {}".format(*latches))
+        lines = lines + ["        " + line for line in code]
+    lines = lines + [
+        "        cycle = cycle + {}".format(length),
+        "        if pc != {} or not ({}):".format(start, fits),
+        "            break",
+        "    continue",
+    ]
+    return lines + compileBundle(program[start], start, counting)
+
+
+def dispatch(program: tuple, bodies: dict, lo: int, hi: int, indent: str, counting: bool, rotating: bool) -> list[str]:
+    # Binary search on pc over the bundles [lo, hi).
+    if hi - lo == 1:
+        if lo in bodies:
+            lines = compileBody(program, lo, bodies[lo], counting, rotating)
+        else:
+            lines = compileBundle(program[lo], lo, counting)
+        return [indent + line for line in lines]
+
+    mid = (lo + hi) // 2
+    return [indent + "if pc < {}:".format(mid)] + dispatch(program, bodies, lo, mid, indent + "    ", counting, rotating) + \
+        [indent + "else:"] + dispatch(program, bodies, mid, hi, indent + "    ", counting, rotating)
+
+
+def loopRegions(program: tuple) -> dict:
+    '''
+        @return start -> end of the loops that are compiled: the bundles from
+        the target of a loop or loop.pip to the bundle that branches back to
+        it, except those nested in another one
+    '''
+    loops = []
+    for end, bundle in enumerate(program):
+        branch = bundle[4]
+        if branch.opcode in (Opcode.LOOP, Opcode.LOOPPIP) and 0 <= branch.imm <= end:
+            loops.append((branch.imm, end))
+
+    regions = {}
+    for start, end in loops:
+        if not any(s <= start and end <= e and (s, e) != (start, end) for s, e in loops):
+            regions[start] = end
+    return regions
+
+
+def relocate(program: tuple, start: int, end: int) -> tuple:
+    # Bundles start..end, with the branch targets relative to start.
+    bundles = []
+    for bundle in program[start:end + 1]:
+        branch = bundle[4]
+        if branch.opcode in (Opcode.LOOP, Opcode.LOOPPIP):
+            bundle = bundle[:4] + (branch._replace(imm=branch.imm - start),)
+        bundles.append(bundle)
+    return tuple(bundles)
+
+
+@functools.lru_cache(maxsize=256)
+def compileLoop(program: tuple, counting: bool = False):
+    '''
+        @return execute(cpu, base, stop), which simulates the cycles of cpu
+        while its PC is in the bundles of program (from bundle base of the
+        whole program on, see relocate()), until cycle stop, an RBB out of
+        range or a bundle left to the interpreter, updating cpu.counters if
+        counting
+    '''
+    # pc is relative to base in the generated code.
+    lines = [
+        "def execute(cpu, base, stop):",
+        "    R = cpu.PhysicalRegisterFile",
+        "    mread = cpu.dataMemory.read",
+        "    mwrite = cpu.dataMemory.write",
+        "    pc, cycle, rbb, lc, ec, pbits = cpu.PC - base, cpu.cycle, cpu.RBB, cpu.LC, cpu.EC, cpu.PredicateBits",
+        "    m0, m1 = cpu.MultiplierPipe",
+        "    m0p, m0t, m0v = m0['predicate'], m0['targetReg'], m0['result']",
+        "    m1p, m1t, m1v = m1['predicate'], m1['targetReg'], m1['result']",
+        "    ren = RENAMED[rbb] if 0 <= rbb <= {} else None".format(MAX_RBB),
+    ]
+    if counting:
+        lines.append("    fetched, enabled, taken = cpu.counters.fetched, cpu.counters.enabled, cpu.counters.taken")
+        lines.append("    slots = 5 * base")
+    rotating = isRotating(program)
+    if rotating:
+        lines.append("    while cycle < stop and 0 <= pc < {} and 0 <= rbb <= {}:".format(len(program), MAX_RBB))
+    else:
+        lines.append("    while cycle < stop and 0 <= pc < {}:".format(len(program)))
+    lines = lines + dispatch(program, loopBodies(program), 0, len(program), "        ", counting, rotating)
+    lines = lines + [
+        "        cycle = cycle + 1",
+        "    cpu.PC, cpu.cycle, cpu.RBB, cpu.LC, cpu.EC, cpu.PredicateBits = base + pc, cycle, rbb, lc, ec, pbits",
+        "    cpu.MultiplierPipe = [",
+        "        {'predicate': m0p, 'targetReg': m0t, 'result': m0v},",
+        "        {'predicate': m1p, 'targetReg': m1t, 'result': m1v},",
+        "    ]",
+    ]
+
+    namespace = {"MASK64": MASK64, "RENAMED": RENAMED}
+    exec(compile("\n".join(lines) + "\n", "<vliw470-jit>", "exec"), namespace)
+    return namespace["execute"]
+
+
+class JITVLIW470(VLIW470):
+    def __init__(self, program: list[list[str]], memory=None):
+        super().__init__(program, memory)
+        # Start of the compiled loop of every bundle (None out of the loops),
+        # and their compiled code, by start and whether it updates the
+        # performance counters.
+        self.loops = [None] * len(self.program)
+        self.regions = loopRegions(tuple(self.program))
+        for start, end in sorted(self.regions.items(), reverse=True):
+            self.loops[start:end + 1] = [start] * (end - start + 1)
+        self.compiled = {}
+
+    def nextRecordedCycle(self) -> float:
+        if self.trace is None:
+            return float("inf")
+        if self.cycle <= self.recordStart:
+            return self.recordStart
+
+        periods = (self.cycle - self.recordStart + self.recordEvery - 1) // self.recordEvery
+        cycle = self.recordStart + periods * self.recordEvery
+        if self.recordStop is not None and cycle >= self.recordStop:
+            return float("inf")
+        return cycle
+
+    def advance(self, maxCycles: int = None):
+        stop = min(self.nextRecordedCycle(), self.nextSavedCycle())
+        if maxCycles is not None:
+            stop = min(stop, maxCycles - 1)
+
+        # Only the performance counters are updated by the compiled code, the other tracers see every cycle.
+        counting = self.counters is not None
+        if len(self.tracers) > counting:
+            stop = self.cycle
+
+        start = self.cycle
+        loop = self.loops[self.PC] if self.PC < len(self.program) else None
+        if loop is not None and stop > start:
+            execute = self.compiled.get((loop, counting))
+            if execute is None:
+                execute = compileLoop(relocate(tuple(self.program), loop, self.regions[loop]), counting)
+                self.compiled[(loop, counting)] = execute
+            execute(self, loop, stop)
+
+        if self.cycle == start:
+            self.tick()
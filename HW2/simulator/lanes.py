@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+import json
+import argparse
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from vliw470 import VLIW470, Opcode, Operation, MASK64
+
+# Simulates one program with N data memory initializations at once. Every
+# register and memory word holds one uint64 value per lane (a NumPy array), and
+# each operation is decoded once per cycle for all the lanes.
+#
+# The control state (PC, RBB, LC, EC and the predicates) only depends on the
+# program: it is written by immediates and loop branches, never from a register
+# or memory value. It is therefore the same in every lane and kept once, and
+# the lanes never diverge. Only the data (registers, memory, the values and
+# addresses in the pipelines) has a lane dimension.
+#
+# The lanes are not recorded cycle by cycle: serializeLane(lane) gives the
+# state of one lane, as VLIW470.serialize() would for that memory. To look at
+# the trace of a lane, simulate it alone with vliw470.py.
+
+
+class LaneMemory:
+    '''
+        Word-addressed data memory with one value per lane, split into pages
+        of PAGE_SIZE words that are allocated on first write, like DataMemory.
+        Each page keeps a (word, lane) mask of the initialized or written words.
+    '''
+
+    PAGE_BITS = 10
+    PAGE_SIZE = 1 << PAGE_BITS
+
+    def __init__(self, initFiles: list[dict]):
+        self.lanes = len(initFiles)
+        self.pages = {}
+        self.present = {}
+        for lane, initFile in enumerate(initFiles):
+            for addr, data in initFile.items():
+                addr = int(addr, 16) if addr.startswith("0x") else int(addr)
+                page, present = self._page(addr >> self.PAGE_BITS)
+                page[addr & (self.PAGE_SIZE - 1), lane] = data & MASK64
+                present[addr & (self.PAGE_SIZE - 1), lane] = True
+
+    def _page(self, number: int):
+        if number not in self.pages:
+            self.pages[number] = np.zeros((self.PAGE_SIZE, self.lanes), dtype=np.uint64)
+            self.present[number] = np.zeros((self.PAGE_SIZE, self.lanes), dtype=bool)
+        return self.pages[number], self.present[number]
+
+    def _groups(self, addresses):
+        # (address, lanes) for every distinct address; there is usually only one.
+        first = addresses[0]
+        if (addresses == first).all():
+            return [(int(first), slice(None))]
+        return [(int(addr), addresses == addr) for addr in np.unique(addresses)]
+
+    def read(self, addresses):
+        values = np.zeros(self.lanes, dtype=np.uint64)
+        for addr, lanes in self._groups(addresses):
+            page = self.pages.get(addr >> self.PAGE_BITS)
+            if page is not None:
+                values[lanes] = page[addr & (self.PAGE_SIZE - 1)][lanes]
+        return values
+
+    def write(self, addresses, data):
+        for addr, lanes in self._groups(addresses):
+            page, present = self._page(addr >> self.PAGE_BITS)
+            page[addr & (self.PAGE_SIZE - 1)][lanes] = data[lanes]
+            present[addr & (self.PAGE_SIZE - 1)][lanes] = True
+
+    def dumpLane(self, lane: int) -> dict:
+        # Every initialized or written word of the lane, by increasing address.
+        data = {}
+        for number in sorted(self.pages):
+            base = number << self.PAGE_BITS
+            page = self.pages[number][:, lane]
+            for offset in np.flatnonzero(self.present[number][:, lane]).tolist():
+                data[base + offset] = int(page[offset])
+        return data
+
+
+class LaneVLIW470(VLIW470):
+    def __init__(self, program: list[list[str]], memories: list[dict]):
+        if np is None:
+            raise ImportError("The lane mode needs NumPy (pip install numpy).")
+        assert len(memories) > 0, "At least one lane is needed."
+
+        super().__init__(program)
+        self.lanes = len(memories)
+        self.dataMemory = LaneMemory(memories)
+        self.PhysicalRegisterFile = np.zeros((96, self.lanes), dtype=np.uint64)
+
+    def read(self, idx: int):
+        return self.PhysicalRegisterFile[self.renameRegister(idx)].copy()
+
+    def constant(self, value: int):
+        return np.full(self.lanes, value & MASK64, dtype=np.uint64)
+
+    def address(self, op: Operation):
+        base = self.PhysicalRegisterFile[self.renameRegister(op.src1)]
+        if (op.imm >= 0 and (base > MASK64 - op.imm).any()) or (op.imm < 0 and (base < -op.imm).any()):
+            # Out of the 64-bit range, like the unbounded addresses of VLIW470.
+            return base.astype(object) + op.imm
+        return base + np.uint64(op.imm & MASK64)
+
+    def writeRegister(self, idx: int, value):
+        self.claimPort(idx)
+        self.PhysicalRegisterFile[idx] = value
+
+    def decodeALUInstruction(self, op: Operation) -> dict:
+        if op.opcode == Opcode.ADD:
+            value = self.read(op.src1) + self.read(op.src2)
+        elif op.opcode == Opcode.ADDI:
+            value = self.read(op.src1) + np.uint64(op.imm & MASK64)
+        elif op.opcode == Opcode.SUB:
+            value = self.read(op.src1) - self.read(op.src2)
+        elif op.opcode == Opcode.MOV:
+            value = self.read(op.src1)
+        elif op.opcode == Opcode.MOVI:
+            value = self.constant(op.imm)
+        else:
+            return super().decodeALUInstruction(op)
+
+        return {
+            "predicate": self.readPredicate(op.predicate),
+            "opcode": "alu",
+            "targetReg": self.renameRegister(op.dest),
+            "value": value
+        }
+
+    def decodeMultiplierInstruction(self, op: Operation) -> dict:
+        if op.opcode == Opcode.MULU:
+            return {
+                "predicate": self.readPredicate(op.predicate),
+                "targetReg": self.renameRegister(op.dest),
+                "result": self.read(op.src1) * self.read(op.src2),
+            }
+        return super().decodeMultiplierInstruction(op)
+
+    def decodeLoadStoreInstruction(self, op: Operation) -> dict:
+        if op.opcode == Opcode.LD:
+            return {
+                "predicate": self.readPredicate(op.predicate),
+                "opcode": "load",
+                "address": self.address(op),
+                "data": 0,
+                "loadDestReg": self.renameRegister(op.dest),
+            }
+        elif op.opcode == Opcode.ST:
+            return {
+                "predicate": self.readPredicate(op.predicate),
+                "opcode": "store",
+                "address": self.address(op),
+                "data": self.read(op.dest),
+                "loadDestReg": 0,
+            }
+        return super().decodeLoadStoreInstruction(op)
+
+    def serialize(self) -> dict:
+        return self.serializeLane(0)
+
+    def serializeLane(self, lane: int) -> dict:
+        '''
+            @return the state of one lane, in the format of VLIW470.serialize()
+        '''
+        def latch(pipe: dict) -> dict:
+            return {key: int(value[lane]) if isinstance(value, np.ndarray) else value for key, value in pipe.items()}
+
+        return {
+            "PC": self.PC,
+            "RBB": self.RBB,
+            "LC": self.LC,
+            "EC": self.EC,
+            "PhysicalRegisterFile": self.PhysicalRegisterFile[:, lane].tolist(),
+            "PredicateRegisters": self.PredicateRegisters,
+            "ALU0": latch(self.ALU0Pipe),
+            "ALU1": latch(self.ALU1Pipe),
+            "Branch": self.BranchPipe.copy(),
+            "Memory": latch(self.MemoryPipe),
+            "Multiply": [latch(entry) for entry in self.MultiplierPipe],
+            "MemoryData": self.dataMemory.dumpLane(lane)
+        }
+
+
+def runLanes(program: list[list[str]], memories: list[dict], maxCycles: int = None) -> tuple[int, list[dict]]:
+    '''
+        Simulate a program with every data memory initialization of memories.
+        @return the number of simulated cycles and the final state of every lane
+    '''
+    processor = LaneVLIW470(program, memories)
+    cycles = processor.run(maxCycles)
+    return cycles, [processor.serializeLane(lane) for lane in range(processor.lanes)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate one program with many data memory initializations at once.")
+    parser.add_argument("instructions", type=argparse.FileType("r"), help="The JSON file defining the instruction to be executed")
+    parser.add_argument("memories", nargs="+", help="Data memory JSON initializations, one per lane.")
+    parser.add_argument("--max-cycles", dest="maxCycles", type=int, help="Stop the simulation after this many cycles.")
+    parser.add_argument("--json", help="Write the final state of every lane to this JSON file.")
+    args = parser.parse_args()
+
+    memories = []
+    for path in args.memories:
+        with open(path) as f:
+            memories.append(json.load(f))
+
+    cycles, finals = runLanes(json.load(args.instructions), memories, args.maxCycles)
+
+    print(f"{len(memories)} lanes, {cycles} cycles.")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([{"memory": path, "final": final} for path, final in zip(args.memories, finals)], f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,630 @@
+#!/usr/bin/env python3
+
+import json
+import argparse
+from typing import NamedTuple
+
+from vliw470 import parse, parseImmediate
+
+# Reference scheduler of the HW2 input programs: the dependency analysis, the
+# ASAP schedules with the loop and the loop.pip instructions and their register
+# allocation (alloc_b and alloc_r), as the handout describes them.
+#
+# A program is BB0 (before the loop body), BB1 (the loop body, up to the loop
+# instruction) and BB2 (after it). The dependency graph holds every RAW, WAR
+# and WAW dependency between registers, the ones reaching the next iteration
+# being loop-carried. Only the RAW ones constrain the schedules: the others
+# disappear with the register allocation, and memory operations are
+# independent. Times are bundle addresses; in the loop.pip body, those of the
+# first iteration, before the stages are folded into II bundles.
+
+ALU0, ALU1, MULT, MEM, BRANCH = range(5)
+UNIT_SLOTS = {
+    "alu": (ALU0, ALU1),
+    "mult": (MULT,),
+    "mem": (MEM,),
+    "branch": (BRANCH,),
+}
+UNITS = {
+    "add": "alu",
+    "addi": "alu",
+    "sub": "alu",
+    "mov": "alu",
+    "mulu": "mult",
+    "ld": "mem",
+    "st": "mem",
+    "loop": "branch",
+}
+LATENCIES = {"mulu": 3}
+
+# Static registers are x1-x31, rotating ones x32-x95, and the stage
+# predicates p32-p95.
+FIRST_STATIC = 1
+LAST_STATIC = 31
+FIRST_ROTATING = 32
+LAST_ROTATING = 95
+FIRST_PREDICATE = 32
+LAST_PREDICATE = 95
+
+# Dependency classes of an operand (Table 2 of the handout).
+LOCAL = "local"
+INTERLOOP = "interloop"
+INVARIANT = "invariant"
+POSTLOOP = "postloop"
+
+
+class NotSchedulable(Exception):
+    # The schedule would need more registers or predicates than there are.
+    pass
+
+
+class Instruction(NamedTuple):
+    addr: int
+    opcode: str
+    dest: str = None    # "xN", "LC", "EC" or "pN"
+    sources: tuple = () # registers read, in operand order
+    imm: object = None  # immediate, offset, "true"/"false" or loop target
+
+    @property
+    def unit(self) -> str:
+        return UNITS[self.opcode]
+
+    @property
+    def latency(self) -> int:
+        return LATENCIES.get(self.opcode, 1)
+
+    @property
+    def produces(self) -> bool:
+        return self.dest is not None and self.dest.startswith("x")
+
+
+def decodeInstruction(addr: int, i: str) -> Instruction:
+    decoded = parse(i)
+    opcode: str = decoded["opcode"]
+    ops: list[str] = decoded["operands"]
+
+    assert decoded["predicate"] == -1, "Input programs are not predicated: {}".format(i)
+    assert opcode in UNITS or opcode == "nop", "Undefined instruction: {}".format(i)
+
+    if opcode in ["add", "sub", "mulu"]:
+        return Instruction(addr, opcode, ops[0], (ops[1], ops[2]))
+    elif opcode == "addi":
+        return Instruction(addr, opcode, ops[0], (ops[1],), int(ops[2]))
+    elif opcode == "mov":
+        if ops[0].upper() in ["LC", "EC"]:
+            return Instruction(addr, opcode, ops[0].upper(), imm=int(ops[1]))
+        if ops[1].startswith("x"):
+            return Instruction(addr, opcode, ops[0], (ops[1],))
+        if ops[1] in ["true", "false"]:
+            return Instruction(addr, opcode, ops[0], imm=ops[1])
+        return Instruction(addr, opcode, ops[0], imm=parseImmediate(ops[1]))
+    elif opcode in ["ld", "st"]:
+        imm = ops[1].split("(")[0].strip()
+        imm = parseImmediate(imm) if imm else 0
+        base = ops[1].split("(")[1].strip()[:-1]
+        if opcode == "ld":
+            return Instruction(addr, opcode, ops[0], (base,), imm)
+        return Instruction(addr, opcode, sources=(ops[0], base), imm=imm)
+    elif opcode == "loop":
+        return Instruction(addr, opcode, imm=int(ops[0]))
+    return Instruction(addr, opcode)
+
+
+def formatInstruction(instr: Instruction, dest: str, sources: list[str], predicate: int = None) -> str:
+    if instr.opcode in ["add", "sub", "mulu"]:
+        text = "{} {}, {}, {}".format(instr.opcode, dest, sources[0], sources[1])
+    elif instr.opcode == "addi":
+        text = "addi {}, {}, {}".format(dest, sources[0], instr.imm)
+    elif instr.opcode == "mov":
+        text = "mov {}, {}".format(dest, sources[0] if sources else instr.imm)
+    elif instr.opcode == "ld":
+        text = "ld {}, {}({})".format(dest, instr.imm, sources[0])
+    elif instr.opcode == "st":
+        text = "st {}, {}({})".format(sources[0], instr.imm, sources[1])
+    else:
+        text = "{} {}".format(instr.opcode, instr.imm)
+    if predicate is None:
+        return " " + text
+    return "(p{}) {}".format(predicate, text)
+
+
+class Dependency(NamedTuple):
+    kind: str           # "RAW", "WAR" or "WAW"
+    producer: int       # address of the first instruction in program order
+    consumer: int
+    register: str
+    latency: int        # cycles between the two (0 for WAR and WAW)
+    loopCarried: bool   # from one iteration to the next
+
+
+class Operand(NamedTuple):
+    register: str
+    kind: str = None    # None if no instruction wrote it before
+    producer: int = None
+    initial: int = None # for INTERLOOP, the producer in BB0 (if any)
+
+
+class DependencyGraph:
+    def __init__(self, program: list[str]):
+        self.instructions = [decodeInstruction(addr, i) for addr, i in enumerate(program)]
+
+        loops = [instr.addr for instr in self.instructions if instr.opcode == "loop"]
+        assert len(loops) <= 1, "The program must have at most one loop instruction"
+        # Without a loop, the whole program is BB0.
+        self.hasLoop = len(loops) == 1
+        self.loopAddr = loops[0] if self.hasLoop else len(self.instructions)
+        self.loopStart = self.instructions[self.loopAddr].imm if self.hasLoop else self.loopAddr
+        assert self.loopStart <= self.loopAddr, "The loop must branch backward"
+
+        # addresses of the instructions to schedule (without nops and the loop)
+        self.blocks = [[], [], []]
+        self.block = {}
+        for instr in self.instructions:
+            if instr.opcode in ["nop", "loop"]:
+                continue
+            if instr.addr < self.loopStart:
+                block = 0
+            elif instr.addr < self.loopAddr:
+                block = 1
+            else:
+                block = 2
+            self.blocks[block].append(instr.addr)
+            self.block[instr.addr] = block
+
+        self.dependencies = []
+        # address -> dependencies it is the consumer (predecessors) or the producer (successors) of
+        self.predecessors = {addr: [] for addr in self.block}
+        self.successors = {addr: [] for addr in self.block}
+        self.analyze()
+
+        # address -> Operand of each source
+        self.operands = {addr: self.classify(addr) for addr in self.block}
+
+    def analyze(self):
+        # Program order, with the loop body twice: a dependency reaching the
+        # second copy from the first one is loop-carried. BB2 follows the
+        # last iteration.
+        bb0, bb1, bb2 = self.blocks
+        sequence = [(addr, False) for addr in bb0 + bb1] + [(addr, True) for addr in bb1] + [(addr, False) for addr in bb2]
+
+        lastWriter = {}
+        readers = {}
+        for addr, second in sequence:
+            instr = self.instructions[addr]
+            for register in dict.fromkeys(instr.sources):
+                if register in lastWriter:
+                    self.add("RAW", lastWriter[register], (addr, second), register)
+                readers.setdefault(register, []).append((addr, second))
+            if instr.produces:
+                for reader in readers.get(instr.dest, []):
+                    if reader != (addr, second):
+                        self.add("WAR", reader, (addr, second), instr.dest)
+                if instr.dest in lastWriter:
+                    self.add("WAW", lastWriter[instr.dest], (addr, second), instr.dest)
+                lastWriter[instr.dest] = (addr, second)
+                readers[instr.dest] = []
+
+    def add(self, kind: str, producer: tuple[int, bool], consumer: tuple[int, bool], register: str):
+        (p, pSecond), (c, cSecond) = producer, consumer
+        if cSecond and (pSecond or self.block[p] != 1):
+            return # within the second iteration, or from BB0 to it: already there for the first one
+        latency = self.instructions[p].latency if kind == "RAW" else 0
+        dependency = Dependency(kind, p, c, register, latency, cSecond)
+        self.dependencies.append(dependency)
+        self.predecessors[c].append(dependency)
+        self.successors[p].append(dependency)
+
+    def producers(self, addr: int, register: str) -> list[Dependency]:
+        return [d for d in self.predecessors[addr] if d.kind == "RAW" and d.register == register]
+
+    def classify(self, addr: int) -> list[Operand]:
+        block = self.block[addr]
+        operands = []
+        for register in self.instructions[addr].sources:
+            dependencies = self.producers(addr, register)
+            local = [d.producer for d in dependencies if self.block[d.producer] == block and not d.loopCarried]
+            carried = [d.producer for d in dependencies if d.loopCarried]
+            before = [d.producer for d in dependencies if self.block[d.producer] < block]
+            if local:
+                operands.append(Operand(register, LOCAL, local[0]))
+            elif carried:
+                operands.append(Operand(register, INTERLOOP, carried[0], before[0] if before else None))
+            elif before and self.block[before[0]] == 1:
+                operands.append(Operand(register, POSTLOOP, before[0]))
+            elif before:
+                operands.append(Operand(register, INVARIANT, before[0]))
+            else:
+                operands.append(Operand(register))
+        return operands
+
+    def ready(self, addr: int, times: dict) -> int:
+        '''
+            @return the first time addr can start after its producers of the
+            same iteration (0 without any)
+        '''
+        earliest = 0
+        for d in self.predecessors[addr]:
+            if d.kind == "RAW" and not d.loopCarried:
+                earliest = max(earliest, times[d.producer] + d.latency)
+        return earliest
+
+    def carried(self) -> list[Dependency]:
+        return [d for d in self.dependencies if d.kind == "RAW" and d.loopCarried]
+
+    def table(self) -> list[str]:
+        '''
+            @return the dependency analysis as the lines of a table
+        '''
+        lines = ["{:>4}  {:<24}{:<6}{:<16}{:<20}{:<16}{}".format("Addr", "Instruction", "Dest", "Local", "Interloop", "Invariant", "Post loop")]
+        for instr in self.instructions:
+            columns = {LOCAL: [], INTERLOOP: [], INVARIANT: [], POSTLOOP: []}
+            for operand in self.operands.get(instr.addr, []):
+                if operand.kind == INTERLOOP and operand.initial is not None:
+                    columns[INTERLOOP].append("{}: ({} or {}')".format(operand.register, operand.initial, operand.producer))
+                elif operand.kind == INTERLOOP:
+                    columns[INTERLOOP].append("{}: {}'".format(operand.register, operand.producer))
+                elif operand.kind is not None:
+                    columns[operand.kind].append("{}: {}".format(operand.register, operand.producer))
+            text = formatInstruction(instr, instr.dest, instr.sources).strip()
+            lines.append("{:>4}  {:<24}{:<6}{:<16}{:<20}{:<16}{}".format(instr.addr, text, instr.dest if instr.produces else "-",
+                *(", ".join(columns[kind]) or "-" for kind in [LOCAL, INTERLOOP, INVARIANT, POSTLOOP])))
+        return lines
+
+
+def place(bundles: list, earliest: int, unit: str, item) -> tuple[int, int]:
+    '''
+        Put item in the first free slot of its unit from bundle earliest on.
+        @return (bundle, slot)
+    '''
+    time = earliest
+    while True:
+        while len(bundles) <= time:
+            bundles.append([None] * 5)
+        for slot in UNIT_SLOTS[unit]:
+            if bundles[time][slot] is None:
+                bundles[time][slot] = item
+                return time, slot
+        time = time + 1
+
+
+def scheduleBlock(graph: DependencyGraph, addrs: list[int], bundles: list, start: int, times: dict, slots: dict, ready=None):
+    # ASAP in program order. ready(addr) gives the first time its producers
+    # allow, if their times are not on the scale of the bundles.
+    for addr in addrs:
+        earliest = max(start, ready(addr) if ready is not None else graph.ready(addr, times))
+        times[addr], slots[addr] = place(bundles, earliest, graph.instructions[addr].unit, addr)
+
+
+def scheduleBB2(graph: DependencyGraph, bundles: list, times: dict, slots: dict, iteration: int):
+    '''
+        Schedule BB2 after the last bundle of bundles. iteration: the number
+        of cycles between the beginning of BB1 and that of BB2 (in the times of
+        BB1) in the last iteration.
+    '''
+    start = len(bundles)
+    shift = iteration - start
+
+    def ready(addr: int) -> int:
+        earliest = 0
+        for d in graph.predecessors[addr]:
+            if d.kind == "RAW":
+                latest = times[d.producer] + d.latency
+                earliest = max(earliest, latest if graph.block[d.producer] == 2 else latest - shift)
+        return earliest
+
+    scheduleBlock(graph, graph.blocks[2], bundles, start, times, slots, ready)
+
+
+def interloopMovs(graph: DependencyGraph) -> dict:
+    '''
+        @return producer in BB0 (or the register read, if there is none) ->
+        producer in BB1 of the interloop operands
+    '''
+    pairs = {}
+    for addr in graph.blocks[1]:
+        for operand in graph.operands[addr]:
+            if operand.kind == INTERLOOP:
+                pairs[operand.initial if operand.initial is not None else operand.register] = operand.producer
+    return pairs
+
+
+def nextRegister(counter: list[int]) -> int:
+    if counter[0] > LAST_STATIC:
+        raise NotSchedulable("Not schedulable: more than {} static registers are needed".format(LAST_STATIC - FIRST_STATIC + 1))
+    counter[0] = counter[0] + 1
+    return counter[0] - 1
+
+
+def placeLoop(graph: DependencyGraph, bundles: list, times: dict, slots: dict):
+    # BB1 after BB0 in bundles, then the loop instruction and BB2.
+    bb1 = graph.blocks[1]
+    start = len(bundles)
+    scheduleBlock(graph, bb1, bundles, start, times, slots)
+    # The delay bundles before the first one of the body stay in BB0.
+    loopStart = min((times[addr] for addr in bb1), default=start)
+    loopEnd = max(len(bundles) - 1, loopStart)
+
+    # Equation 2, II being the length of the body.
+    for d in graph.carried():
+        while times[d.producer] + d.latency > times[d.consumer] + loopEnd - loopStart + 1:
+            loopEnd = loopEnd + 1
+
+    # The movs of the values of BB1 into the registers of BB0, in the last
+    # bundle of the body, the loop being pushed down when they do not fit.
+    # Without a producer in BB0, the first iteration reads an unused register,
+    # which the next ones also read: the producer in BB1 may well be
+    # scheduled before the consumer.
+    pairs = interloopMovs(graph)
+    for initial in sorted(pairs, key=lambda key: (times[key], slots[key]) if isinstance(key, int) else (len(bundles), 0)):
+        producer = pairs[initial]
+        while True:
+            while len(bundles) <= loopEnd:
+                bundles.append([None] * 5)
+            free = [slot for slot in UNIT_SLOTS["alu"] if bundles[loopEnd][slot] is None]
+            if free and times[producer] + graph.instructions[producer].latency <= loopEnd:
+                bundles[loopEnd][free[0]] = ("mov", initial, producer)
+                break
+            loopEnd = loopEnd + 1
+    while len(bundles) <= loopEnd:
+        bundles.append([None] * 5)
+    bundles[loopEnd][BRANCH] = ("loop", loopStart)
+
+    scheduleBB2(graph, bundles, times, slots, loopEnd + 1)
+
+
+def scheduleLoop(program: list[str], graph: DependencyGraph = None) -> list[list[str]]:
+    '''
+        ASAP schedule with the loop instruction, allocated with alloc_b.
+        Raises NotSchedulable when the static registers run out.
+        @return the program of bundles
+    '''
+    graph = graph or DependencyGraph(program)
+    bundles = []
+    times = {}
+    slots = {}
+
+    scheduleBlock(graph, graph.blocks[0], bundles, 0, times, slots)
+    if graph.hasLoop:
+        placeLoop(graph, bundles, times, slots)
+
+    # alloc_b: fresh registers for the destinations in scheduling order, the
+    # operands linked to them (to the one of BB0 for the interloop operands
+    # with two producers), then unused registers for the operands without one.
+    order = sorted(graph.block, key=lambda addr: (times[addr], slots[addr]))
+    counter = [FIRST_STATIC]
+    registers = {}
+    for addr in order:
+        if graph.instructions[addr].produces:
+            registers[addr] = "x{}".format(nextRegister(counter))
+
+    unused = {}
+    sources = {}
+    for addr in order:
+        sources[addr] = []
+        for operand in graph.operands[addr]:
+            if operand.kind is None or (operand.kind == INTERLOOP and operand.initial is None):
+                if operand.register not in unused:
+                    unused[operand.register] = "x{}".format(nextRegister(counter))
+                sources[addr].append(unused[operand.register])
+            elif operand.kind == INTERLOOP:
+                sources[addr].append(registers[operand.initial])
+            else:
+                sources[addr].append(registers[operand.producer])
+
+    result = []
+    for bundle in bundles:
+        out = []
+        for item in bundle:
+            if item is None:
+                out.append(" nop")
+            elif isinstance(item, int):
+                instr = graph.instructions[item]
+                out.append(formatInstruction(instr, registers.get(item, instr.dest), sources[item]))
+            elif item[0] == "mov":
+                out.append(" mov {}, {}".format(registers.get(item[1]) or unused[item[1]], registers[item[2]]))
+            else:
+                out.append(" loop {}".format(item[1]))
+        result.append(out)
+    return result
+
+
+def minimumII(graph: DependencyGraph) -> int:
+    # Equation 1: the loop instruction takes the branch unit once.
+    counts = {unit: 0 for unit in UNIT_SLOTS}
+    for addr in graph.blocks[1]:
+        counts[graph.instructions[addr].unit] += 1
+    return max(1, *(-(-count // len(UNIT_SLOTS[unit])) for unit, count in counts.items()))
+
+
+def moduloSchedule(graph: DependencyGraph, ii: int, start: int, times: dict) -> dict:
+    '''
+        Schedule BB1 with the initiation interval ii, a slot taken in a stage
+        being reserved in all the others.
+        @return address -> slot, or None if equation 2 does not hold with ii
+    '''
+    table = [[False] * 5 for _ in range(ii)]
+    slots = {}
+    for addr in graph.blocks[1]:
+        instr = graph.instructions[addr]
+        earliest = max(start, graph.ready(addr, times))
+        for time in range(earliest, earliest + ii):
+            free = [slot for slot in UNIT_SLOTS[instr.unit] if not table[time % ii][slot]]
+            if free:
+                break
+        else:
+            return None
+        table[time % ii][free[0]] = True
+        times[addr], slots[addr] = time, free[0]
+
+        for d in graph.successors[addr]:
+            if d.kind == "RAW" and d.loopCarried and times[addr] + d.latency > times[d.consumer] + ii:
+                return None
+    return slots
+
+
+def schedulePip(program: list[str], graph: DependencyGraph = None) -> list[list[str]]:
+    '''
+        Modulo schedule with the loop.pip instruction and the smallest II
+        that works, allocated with alloc_r.
+        Raises NotSchedulable when the registers or the predicates run out.
+        @return the program of bundles
+    '''
+    graph = graph or DependencyGraph(program)
+    if not graph.hasLoop:
+        return scheduleLoop(program, graph)
+    bb0, bb1, bb2 = graph.blocks
+    bundles = []
+    times = {}
+    slots = {}
+
+    scheduleBlock(graph, bb0, bundles, 0, times, slots)
+    start = len(bundles)
+    ii = minimumII(graph)
+    while True:
+        body = moduloSchedule(graph, ii, start, times)
+        if body is not None:
+            break
+        ii = ii + 1
+    slots.update(body)
+
+    # The delay bundles before the first one of the body stay in BB0, and the
+    # body is folded into a single stage.
+    first = min((times[addr] for addr in bb1), default=start)
+    cycles = {addr: times[addr] - first for addr in bb1}
+    stages = {addr: cycle // ii for addr, cycle in cycles.items()}
+    stageCount = max(stages.values(), default=0) + 1
+    while len(bundles) < first:
+        bundles.append([None] * 5)
+
+    # mov EC and mov p32 in the last bundle before the loop, or a new one.
+    for item in [("EC",), ("p32",)]:
+        free = [slot for slot in UNIT_SLOTS["alu"] if bundles and bundles[-1][slot] is None]
+        if not free:
+            bundles.append([None] * 5)
+            free = [ALU0]
+        bundles[-1][free[0]] = item
+    loopStart = len(bundles)
+    shift = loopStart - first
+    for addr in bb1:
+        times[addr] = times[addr] + shift
+
+    for _ in range(ii):
+        bundles.append([None] * 5)
+    for addr in bb1:
+        bundles[loopStart + cycles[addr] % ii][slots[addr]] = addr
+    bundles[-1][BRANCH] = ("loop.pip", loopStart)
+
+    scheduleBB2(graph, bundles, times, slots, loopStart + stageCount * ii)
+
+    # alloc_r: rotating registers for the destinations of BB1, one every
+    # stageCount + 1 (see lifetime), static ones for the loop invariants, then for the other
+    # destinations of BB0 and BB2 and the operands without a producer.
+    bodyOrder = sorted(bb1, key=lambda addr: (cycles[addr], slots[addr]))
+    order = sorted(bb0, key=lambda addr: (times[addr], slots[addr])) + bodyOrder + sorted(bb2, key=lambda addr: (times[addr], slots[addr]))
+    # A result that is only read after the loop can be written after the last
+    # stage, and must not land on the register of a later iteration then.
+    lifetime = max([stageCount] + [(cycles[addr] + graph.instructions[addr].latency - 1) // ii + 1 for addr in bb1])
+    registers = {}
+    rotating = FIRST_ROTATING
+    for addr in bodyOrder:
+        if graph.instructions[addr].produces:
+            # The value is read as rotating + 0 to rotating + lifetime.
+            if rotating + lifetime > LAST_ROTATING:
+                raise NotSchedulable("Not schedulable: the loop body needs rotating registers past x{}".format(LAST_ROTATING))
+            registers[addr] = rotating
+            rotating = rotating + lifetime + 1
+    if FIRST_PREDICATE + stageCount - 1 > LAST_PREDICATE:
+        raise NotSchedulable("Not schedulable: {} stages need predicates past p{}".format(stageCount, LAST_PREDICATE))
+
+    counter = [FIRST_STATIC]
+    for addr in bodyOrder:
+        for operand in graph.operands[addr]:
+            if operand.kind == INVARIANT and operand.producer not in registers:
+                registers[operand.producer] = nextRegister(counter)
+
+    pairs = interloopMovs(graph)
+    for addr in order:
+        if graph.block[addr] == 1 or addr in registers or not graph.instructions[addr].produces:
+            continue
+        if addr in pairs:
+            # Iteration offset 1, stage offset -St(P).
+            registers[addr] = registers[pairs[addr]] + 1 - stages[pairs[addr]]
+            if registers[addr] < FIRST_ROTATING:
+                raise NotSchedulable("Not schedulable: the initial value of x{} would be written to the static register x{}".format(
+                    registers[pairs[addr]], registers[addr]))
+        else:
+            registers[addr] = nextRegister(counter)
+
+    unused = {}
+    sources = {}
+    for addr in order:
+        sources[addr] = []
+        for operand in graph.operands[addr]:
+            if operand.kind is None:
+                if operand.register not in unused:
+                    unused[operand.register] = nextRegister(counter)
+                register = unused[operand.register]
+            elif graph.block[addr] != 1 and operand.kind == POSTLOOP:
+                # Read after the last stage.
+                register = registers[operand.producer] + stageCount - 1 - stages[operand.producer]
+            elif graph.block[addr] != 1 or operand.kind == INVARIANT:
+                register = registers[operand.producer]
+            elif operand.kind == LOCAL:
+                register = registers[operand.producer] + stages[addr] - stages[operand.producer]
+            else:
+                register = registers[operand.producer] + stages[addr] - stages[operand.producer] + 1
+            sources[addr].append("x{}".format(register))
+
+    result = []
+    for bundle in bundles:
+        out = []
+        for item in bundle:
+            if item is None:
+                out.append(" nop")
+            elif isinstance(item, int):
+                instr = graph.instructions[item]
+                dest = "x{}".format(registers[item]) if item in registers else instr.dest
+                predicate = FIRST_PREDICATE + stages[item] if item in stages else None
+                out.append(formatInstruction(instr, dest, sources[item], predicate))
+            elif item[0] == "EC":
+                out.append(" mov EC, {}".format(stageCount - 1))
+            elif item[0] == "p32":
+                out.append(" mov p{}, true".format(FIRST_PREDICATE))
+            else:
+                out.append(" loop.pip {}".format(item[1]))
+        result.append(out)
+    return result
+
+
+def dumpSchedule(schedule: list[list[str]], path: str):
+    # One bundle per line, as the reference schedules.
+    with open(path, "w") as f:
+        f.write("[\n" + ",\n".join("  " + json.dumps(bundle) for bundle in schedule) + "\n]\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Schedule an HW2 input program with the loop and the loop.pip instructions.")
+    parser.add_argument("input", help="Input program JSON file.")
+    parser.add_argument("loop", nargs="?", help="Write the schedule with the loop instruction to this JSON file.")
+    parser.add_argument("pip", nargs="?", help="Write the schedule with the loop.pip instruction to this JSON file.")
+    parser.add_argument("--table", action="store_true", help="Print the dependency analysis.")
+    args = parser.parse_args()
+
+    with open(args.input) as f:
+        program = json.load(f)
+
+    graph = DependencyGraph(program)
+    if args.table:
+        print("\n".join(graph.table()))
+
+    for path, schedule in [(args.loop, scheduleLoop), (args.pip, schedulePip)]:
+        if path:
+            try:
+                dumpSchedule(schedule(program, graph), path)
+            except NotSchedulable as e:
+                print("{}: {}".format(args.input, e))
+                exit(1)
+
+
+if __name__ == "__main__":
+    main()
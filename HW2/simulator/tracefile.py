@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+
+import io
+import sys
+import gzip
+import json
+import hashlib
+import argparse
+
+# Trace formats produced by the simulator.
+#   json:  a single JSON array, byte-identical to json.dump(state, indent=4).
+#   jsonl: JSON Lines, one compact cycle record per line.
+#   delta: JSON Lines starting with a header line, then a full keyframe every
+#          N cycles and, in between, only the fields that changed.
+FORMATS = ["json", "jsonl", "delta"]
+
+DELTA_MAGIC = "vliw470-delta"
+DELTA_VERSION = 1
+
+# Fields of a cycle record, grouped by how they are delta-encoded. Any other
+# field (PC, RBB, LC, EC, the pipeline latches, ...) is stored whole when it changes.
+ARRAY_FIELDS = ["PhysicalRegisterFile", "PredicateRegisters"]
+MAP_FIELDS = ["MemoryData"]
+
+
+def openOutput(path: str, compress: bool = False):
+    if path == "-":
+        return sys.stdout
+    if compress or path.endswith(".gz"):
+        return io.TextIOWrapper(gzip.open(path, "wb"), encoding="utf-8")
+    return open(path, "w")
+
+
+def openInput(path: str):
+    with open(path, "rb") as f:
+        magic = f.read(2)
+    if magic == b"\x1f\x8b":
+        return io.TextIOWrapper(gzip.open(path, "rb"), encoding="utf-8")
+    return open(path, "r")
+
+
+class TraceWriter:
+    '''
+        Writes every cycle record as soon as it is produced, so the memory
+        used by the simulator does not depend on the number of cycles.
+    '''
+
+    def __init__(self, out):
+        self.out = out
+        self.cycles = 0
+        # The state after the last simulated cycle and the number of simulated
+        # cycles, set by vliw470.run(). cycles only counts the recorded ones.
+        self.final = None
+        self.simulatedCycles = 0
+        # The DataMemory of the recorded processor, also set by run(), from
+        # which the words stored between two records can be taken.
+        self.memory = None
+
+    def write(self, record: dict):
+        self.cycles = self.cycles + 1
+
+    def close(self):
+        if self.out is not sys.stdout:
+            self.out.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RecordedTrace(TraceWriter):
+    '''
+        Keeps every cycle record in memory, for simulations run from Python.
+    '''
+
+    def __init__(self):
+        super().__init__(None)
+        self.records = []
+
+    def write(self, record: dict):
+        self.records.append(record)
+        super().write(record)
+
+    def close(self):
+        pass
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __getitem__(self, cycle: int) -> dict:
+        return self.records[cycle]
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def dump(self, path: str, format: str = "json", compress: bool = False, keyframeInterval: int = 100):
+        with openTraceWriter(path, format, compress, keyframeInterval) as writer:
+            for record in self.records:
+                writer.write(record)
+
+
+class ChecksumTrace(TraceWriter):
+    '''
+        Keeps only a SHA-256 digest of the canonical JSON form of every record.
+    '''
+
+    def __init__(self):
+        super().__init__(None)
+        self.digest = hashlib.sha256()
+
+    def write(self, record: dict):
+        self.digest.update(json.dumps(record, sort_keys=True, separators=(",", ":")).encode())
+        self.digest.update(b"\n")
+        super().write(record)
+
+    def close(self):
+        pass
+
+    def hexdigest(self) -> str:
+        return self.digest.hexdigest()
+
+
+class JSONTraceWriter(TraceWriter):
+    def write(self, record: dict):
+        if self.cycles == 0:
+            self.out.write("[\n    ")
+        else:
+            self.out.write(",\n    ")
+        self.out.write(json.dumps(record, indent=4).replace("\n", "\n    "))
+        super().write(record)
+
+    def close(self):
+        if self.cycles == 0:
+            self.out.write("[]")
+        else:
+            self.out.write("\n]")
+        super().close()
+
+
+class JSONLinesTraceWriter(TraceWriter):
+    def write(self, record: dict):
+        self.out.write(json.dumps(record, separators=(",", ":")))
+        self.out.write("\n")
+        super().write(record)
+
+
+class DeltaTraceWriter(TraceWriter):
+    def __init__(self, out, keyframeInterval: int = 100):
+        assert keyframeInterval > 0, "The keyframe interval must be positive."
+        super().__init__(out)
+        self.keyframeInterval = keyframeInterval
+        self.previous = None
+        self.writeLine({
+            "format": DELTA_MAGIC,
+            "version": DELTA_VERSION,
+            "keyframeInterval": keyframeInterval
+        })
+
+    def writeLine(self, line: dict):
+        self.out.write(json.dumps(line, separators=(",", ":")))
+        self.out.write("\n")
+
+    def write(self, record: dict):
+        stored = self.memory.takeDirty() if self.memory is not None else None
+        if self.previous is None or self.cycles % self.keyframeInterval == 0:
+            self.writeLine({"keyframe": record})
+        else:
+            self.writeLine({"delta": diffRecords(self.previous, record, stored)})
+        self.previous = record
+        super().write(record)
+
+
+def diffRecords(previous: dict, current: dict, stored: list[int] = None) -> dict:
+    '''
+        @return the fields of current that differ from previous. stored, when
+        given, lists the only MemoryData addresses that can differ (the words
+        stored in between), so that the memory is not compared whole.
+    '''
+    delta = {}
+
+    for name, value in current.items():
+        if name not in ARRAY_FIELDS and name not in MAP_FIELDS and previous.get(name) != value:
+            delta[name] = value
+
+    for name in ARRAY_FIELDS:
+        changed = {idx: v for idx, (p, v) in enumerate(zip(previous[name], current[name])) if p != v}
+        if changed:
+            delta[name] = changed
+
+    for name in MAP_FIELDS:
+        prev, cur = previous[name], current[name]
+        if name == "MemoryData" and stored is not None:
+            changed = {k: cur[k] for k in stored if k not in prev or prev[k] != cur[k]}
+            removed = []
+        else:
+            changed = {k: v for k, v in cur.items() if k not in prev or prev[k] != v}
+            removed = [k for k in prev if k not in cur]
+        if changed:
+            delta[name] = changed
+        if removed:
+            delta[name + "Removed"] = removed
+
+    return delta
+
+
+def applyDelta(record: dict, delta: dict) -> dict:
+    # record is in the JSON form (string keys), and is not modified.
+    record = record.copy()
+
+    for name, value in delta.items():
+        if name not in ARRAY_FIELDS and name not in MAP_FIELDS and not name.endswith("Removed"):
+            record[name] = value
+
+    for name in ARRAY_FIELDS:
+        if name in delta:
+            values = record[name].copy()
+            for idx, v in delta[name].items():
+                values[int(idx)] = v
+            record[name] = values
+
+    for name in MAP_FIELDS:
+        if name in delta or name + "Removed" in delta:
+            values = record[name].copy()
+            values.update(delta.get(name, {}))
+            for k in delta.get(name + "Removed", []):
+                values.pop(str(k), None)
+            record[name] = values
+
+    return record
+
+
+def openTraceWriter(path: str, format: str = "json", compress: bool = False, keyframeInterval: int = 100) -> TraceWriter:
+    assert format in FORMATS, "Unknown trace format: {}".format(format)
+
+    out = openOutput(path, compress)
+    if format == "jsonl":
+        return JSONLinesTraceWriter(out)
+    if format == "delta":
+        return DeltaTraceWriter(out, keyframeInterval)
+    return JSONTraceWriter(out)
+
+
+class TraceReader:
+    '''
+        Random access to the full cycle records of any trace written by the
+        simulator (json, jsonl or delta, optionally gzipped).
+
+        reader = TraceReader("result.json")
+        len(reader), reader[cycle], for record in reader: ...
+    '''
+
+    def __init__(self, path: str):
+        self.format = "json"
+        self.keyframeInterval = 1
+        # For json/jsonl, the full records; for delta, the raw keyframe/delta lines.
+        self.records = []
+        self._cached = (-1, None)
+
+        with openInput(path) as f:
+            first = f.read(1)
+            while first.isspace():
+                first = f.read(1)
+
+            if first == "[":
+                self.records = json.loads(first + f.read())
+                return
+
+            lines = [json.loads(first + f.readline())]
+            for line in f:
+                if line.strip():
+                    lines.append(json.loads(line))
+
+        if lines[0].get("format") == DELTA_MAGIC:
+            assert lines[0]["version"] == DELTA_VERSION, "Unsupported delta trace version: {}".format(lines[0]["version"])
+            self.format = "delta"
+            self.keyframeInterval = lines[0]["keyframeInterval"]
+            self.records = lines[1:]
+        else:
+            self.format = "jsonl"
+            self.records = lines
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __getitem__(self, cycle: int) -> dict:
+        if cycle < 0:
+            cycle = cycle + len(self.records)
+        if cycle < 0 or cycle >= len(self.records):
+            raise IndexError("Cycle {} is out of the trace range.".format(cycle))
+
+        if self.format != "delta":
+            return self.records[cycle]
+
+        # Start from the cached cycle when iterating forward, from the keyframe otherwise.
+        cachedCycle, record = self._cached
+        if cycle == cachedCycle:
+            return record
+        if cycle < cachedCycle:
+            cachedCycle = -1
+
+        start = cycle
+        while start > cachedCycle and "keyframe" not in self.records[start]:
+            start = start - 1
+
+        if start > cachedCycle:
+            record = self.records[start]["keyframe"]
+        else:
+            start = cachedCycle
+        for c in range(start + 1, cycle + 1):
+            line = self.records[c]
+            record = line["keyframe"] if "keyframe" in line else applyDelta(record, line["delta"])
+
+        self._cached = (cycle, record)
+        return record
+
+    def __iter__(self):
+        for cycle in range(len(self.records)):
+            yield self[cycle]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a VLIW470 trace between formats.")
+    parser.add_argument("trace", help="The input trace (json, jsonl or delta, optionally gzipped).")
+    parser.add_argument("output", help="The converted trace.")
+    parser.add_argument("--format", choices=FORMATS, default="json", help="Output trace format.")
+    parser.add_argument("--gzip", action="store_true", help="Compress the output with gzip.")
+    parser.add_argument("--keyframe", type=int, default=100, help="Keyframe interval of the delta format.")
+    parser.add_argument("--cycle", type=int, help="Only write the full record of this cycle.")
+    args = parser.parse_args()
+
+    reader = TraceReader(args.trace)
+    with openTraceWriter(args.output, args.format, args.gzip, args.keyframe) as writer:
+        if args.cycle is not None:
+            writer.write(reader[args.cycle])
+        else:
+            for record in reader:
+                writer.write(record)
+
+
+if __name__ == "__main__":
+    main()
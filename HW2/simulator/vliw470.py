@@ -1,109 +1,449 @@
 #!/usr/bin/env python3
 
+import sys
 import json
+import enum
 import argparse
+from array import array
+from typing import NamedTuple
+
+from tracefile import FORMATS, TraceWriter, RecordedTrace, openTraceWriter
+from checkpoint import saveCheckpoint, restoreCheckpoint, checkpointPath
+
+class Opcode(enum.IntEnum):
+    NOP = 0
+    ADD = 1
+    ADDI = 2
+    SUB = 3
+    MOV = 4     # mov xN, xM
+    MOVI = 5    # mov xN, imm
+    MOVP = 6    # mov pN, true/false
+    MOVLC = 7
+    MOVEC = 8
+    MOVRBB = 9
+    MULU = 10
+    LD = 11
+    ST = 12
+    LOOP = 13
+    LOOPPIP = 14
+
+UPDATE_OPCODES = {
+    Opcode.MOVLC: "updateLC",
+    Opcode.MOVEC: "updateEC",
+    Opcode.MOVRBB: "updateRBB",
+}
+
+class Operation(NamedTuple):
+    # Register indices are logical: the renaming through RBB happens every cycle.
+    opcode: Opcode
+    predicate: int = -1 # -1 if the instruction is not predicated
+    dest: int = 0
+    src1: int = 0
+    src2: int = 0
+    imm: int = 0
+
+# Integer write ports of the register files: x0..x95 are 0..95, p0..p95 are
+# 96..191, then LC, EC and RBB.
+PREDICATE_PORT = 96
+LC_PORT = 192
+EC_PORT = 193
+RBB_PORT = 194
+
+def portName(port: int) -> str:
+    if port < PREDICATE_PORT:
+        return "x{}".format(port)
+    if port < LC_PORT:
+        return "p{}".format(port - PREDICATE_PORT)
+    return ["LC", "EC", "RBB"][port - LC_PORT]
+
+MASK64 = 0xFFFFFFFFFFFFFFFF
+
+NOP = Operation(Opcode.NOP)
+NOP_BUNDLE = (NOP, NOP, NOP, NOP, NOP)
+
+def parseImmediate(i: str) -> int:
+    if i.startswith("0x"):
+        return int(i, 16) # at present we only support hex and decimal.
+    return int(i)
+
+def parse(i: str) -> dict:
+    # i could be a format like "(pX) inst dst, src, third"
+    # this function is trying to separate the predication.
+    info = i.split()
+    predicate = -1
+    info[0] = info[0].strip()
+    if info[0].startswith("(") and info[0].endswith(")"):
+        # with predication
+        predicate = int(info[0][2:-1].strip())
+        assert predicate <= 95, "Undefined predicate register: p{}".format(predicate)
+        info.remove(info[0])
+
+    operands: list[str] = []
+
+    for item in info[1:]:
+        item = item.strip()
+        if item.endswith(","):
+            operands.append(item[:-1].strip())
+        else:
+            operands.append(item.strip())
 
-parser = argparse.ArgumentParser()
-parser.add_argument(
-    "instructions", type=argparse.FileType("r"), 
-    help="The JSON file defining the instruction to be executed"
-)
-parser.add_argument(
-    "result", type=argparse.FileType("w"),
-    help="The cycle-accurate simulation result."
-)
-parser.add_argument(
-    "--memory", type=argparse.FileType("r"),
-    help="Optional data memory JSON initialization file."
-)
+    return {
+        "predicate": predicate,
+        "opcode": info[0].strip(),
+        "operands": operands
+    }
 
-arg = parser.parse_args()
+def decodeALUInstruction(i: str) -> Operation:
+    decoded = parse(i)
+    predicate: int = decoded["predicate"]
+    opcode: str = decoded["opcode"]
+    ops: list[str] = decoded["operands"]
 
-instructionMemory: list[list[str]] = json.load(arg.instructions)
+    # Now start the normal instruction decoding.
+    assert opcode in ["add", "addi", "sub", "mov", "nop"], "Undefined instruction: {}".format(i)
 
-class DataMemory:
-    data = {}
+    # classify instruction by its type
+    if opcode in ["add", "addi", "sub"]:
+        # define the source
+        assert ops[0].startswith('x'), "Cannot determine the destination: {}".format(i)
+        dest = int(ops[0][1:])
 
-    def __init__(self, initFile: dict):
-        for addr, data in initFile.items():
-            if addr.startswith("0x"):
-                self.data[int(addr, 16)] = data
+        assert ops[1].startswith('x'), "Cannot determine the source reg: {}".format(i)
+        src1 = int(ops[1][1:])
+
+        if opcode == "addi":
+            return Operation(Opcode.ADDI, predicate, dest, src1, imm=int(ops[2]))
+
+        assert ops[2].startswith('x'), "Cannot determine the 2nd source reg: {}".format(i)
+        src2 = int(ops[2][1:])
+        return Operation(Opcode.ADD if opcode == "add" else Opcode.SUB, predicate, dest, src1, src2)
+
+    elif opcode == "mov":
+        if ops[0].startswith("p"):
+            # it's updating a predicate
+            idx = int(ops[0][1:])
+
+            if ops[1] == "true":
+                return Operation(Opcode.MOVP, predicate, idx, imm=1)
+            elif ops[1] == "false":
+                return Operation(Opcode.MOVP, predicate, idx, imm=0)
             else:
-                self.data[int(addr)] = data
-    
-    def read(self, addr: int) -> int:
-        if self.data.get(addr) is None:
-            return 0
+                assert False, "Cannot determine the source operand: {}".format(i)
+        elif ops[0].upper() in ["LC", "EC", "RBB"]:
+            dest = ops[0].upper()
+            value = int(ops[1])
+            if dest == "RBB":
+                assert value < 64, "The maximum value of RBB is 63. The value you provide causes overflow."
+            return Operation(Opcode["MOV" + dest], predicate, imm=value)
+        elif ops[0].startswith('x'):
+            dst = int(ops[0][1:])
+            if ops[1].startswith('x'):
+                return Operation(Opcode.MOV, predicate, dst, int(ops[1][1:]))
+            else: # It should be an integer
+                return Operation(Opcode.MOVI, predicate, dst, imm=parseImmediate(ops[1]))
         else:
-            return self.data.get(addr)
+            assert False, "Unknown instruction: {}".format(i)
 
-    def write(self, addr: int, data: int) -> int:
-        self.data[addr] = data
+    return NOP
 
-if arg.memory:
-    dataMemory = DataMemory(json.load(arg.memory))
-else:
-    dataMemory = DataMemory({})
+def decodeMultiplierInstruction(i: str) -> Operation:
+    decoded = parse(i)
+    predicate: int = decoded["predicate"]
+    opcode: str = decoded["opcode"]
+    ops: list[str] = decoded["operands"]
 
-state = []
+    assert opcode in ["mulu", "nop"]
 
+    if opcode == "mulu":
+        assert ops[0].startswith('x') and ops[1].startswith('x') and ops[2].startswith('x'), "Undefined instruction: {}".format(i)
+        return Operation(Opcode.MULU, predicate, int(ops[0][1:]), int(ops[1][1:]), int(ops[2][1:]))
 
-class VLIW470:
-    # Visible Architecture State.
-    PC = 0
-    _PC = 0
-    RBB = 0
-    _RBB = 0
-    LC = 0
-    _LC = 0
-    EC = 0
-    _EC = 0
-    PhysicalRegisterFile = [0 for _ in range(96)]
-    _PhysicalRegisterFile = []
-    PredicateRegisters = [False for _ in range(96)]
-    _PredicateRegisters = []
-
-    # Functional pipelines
-    ALU0Pipe = {
-        "predicate": False,
-        "opcode": "alu", # alu, updateLC, updateEC, updateRBB, updatePredicate
-        "targetReg": 0,
-        "value": 0
-    }
+    return NOP
 
-    ALU1Pipe = {
-        "predicate": False,
-        "opcode": "",
-        "targetReg": 0,
-        "value": 0
-    }
+def decodeLoadStoreInstruction(i: str) -> Operation:
+    decoded = parse(i)
+    predicate: int = decoded["predicate"]
+    opcode: str = decoded["opcode"]
+    ops: list[str] = decoded["operands"]
 
-    BranchPipe = {
-        "predicate": False,
-        "opcode": "hw", # lw or loop
-        "targetPC": 0,
-    }
+    assert opcode in ["ld", "st", "nop"]
 
-    MemoryPipe = {
-        "predicate": False,
-        "opcode": "load", # load or store
-        "address": 0,
-        "data": 0,
-        "loadDestReg": 0,
-    }
+    if opcode == "nop":
+        return NOP
+
+    # ops[0]: xNN
+    # ops[1]: imm(xMM)
+    assert ops[0].startswith('x') and "(" in ops[1] and ")" in ops[1], "Undefined instruction: {}".format(i)
+
+    dest = int(ops[0][1:])
+    imm = ops[1].split("(")[0].strip()
+    if len(imm) == 0:
+        imm = 0
+    else:
+        imm = parseImmediate(imm)
+
+    add = int(ops[1].split("(")[1].strip()[1:-1])
+
+    return Operation(Opcode.LD if opcode == "ld" else Opcode.ST, predicate, dest, add, imm=imm)
+
+def decodeBrancInstruction(i: str) -> Operation:
+    decoded = parse(i)
+    predicate: int = decoded["predicate"]
+    opcode: str = decoded["opcode"]
+    ops: list[str] = decoded["operands"]
+
+    assert opcode in ["loop", "loop.pip", "nop"], "Undefined instruction: {}".format(i)
+
+    if opcode == "loop":
+        return Operation(Opcode.LOOP, predicate, imm=int(ops[0]))
+    elif opcode == "loop.pip":
+        return Operation(Opcode.LOOPPIP, predicate, imm=int(ops[0]))
+
+    return NOP
+
+slotDecoders = [
+    decodeALUInstruction,       # ALU0
+    decodeALUInstruction,       # ALU1
+    decodeMultiplierInstruction,# MUL
+    decodeLoadStoreInstruction, # MEM
+    decodeBrancInstruction,     # Branch
+]
+
+def decodeProgram(program: list[list[str]]) -> list[tuple[Operation, ...]]:
+    # One-time pass turning every bundle into operation records, so that
+    # tick() does not need to parse any string.
+    if len(program) > 0 and isinstance(program[0][0], Operation):
+        return program # already decoded
+
+    decoded = []
+    for bundle in program:
+        assert len(bundle) == 5, "Each bundle should always have 5 instructions"
+        decoded.append(tuple(decoder(i) for decoder, i in zip(slotDecoders, bundle)))
+    return decoded
+
+class DataMemory:
+    '''
+        Word-addressed data memory, split into pages of PAGE_SIZE 64-bit words
+        that are allocated on first write. Each page keeps a bitmask of the
+        words that were initialized or written (those appear in MemoryData),
+        and a bitmask of the words written since the last takeDirty().
+        Snapshots share their pages with the memory they were taken from, and
+        a page is only copied when one of them writes to it.
+        The present words of every page are also kept as a dict by increasing
+        address, which a store updates in place, so dump() only has to
+        concatenate them.
+    '''
+
+    PAGE_BITS = 10
+    PAGE_SIZE = 1 << PAGE_BITS
+
+    def __init__(self, initFile: dict = {}):
+        self.pages: dict[int, array] = {}
+        self.present: dict[int, int] = {}
+        self.dirty: dict[int, int] = {}
+        self._shared = set()
+        # page number -> {address: word} of its present words, by increasing address.
+        self._pageDumps: dict[int, dict] = {}
+        self.load(initFile)
+
+    def load(self, initFile: dict):
+        for addr, data in initFile.items():
+            if addr.startswith("0x"):
+                self.write(int(addr, 16), data)
+            else:
+                self.write(int(addr), data)
+
+    def loadBinary(self, path: str, base: int = 0):
+        # The file holds consecutive little-endian 64-bit words, stored from address base.
+        words = array("Q")
+        with open(path, "rb") as f:
+            words.frombytes(f.read())
+        if sys.byteorder != "little":
+            words.byteswap()
+
+        addr = base
+        while addr < base + len(words):
+            offset = addr & (self.PAGE_SIZE - 1)
+            count = min(self.PAGE_SIZE - offset, base + len(words) - addr)
+            page = self._writablePage(addr >> self.PAGE_BITS)
+            page[offset:offset + count] = words[addr - base:addr - base + count]
+            mask = ((1 << count) - 1) << offset
+            self._pageDumps.pop(addr >> self.PAGE_BITS, None)
+            self.present[addr >> self.PAGE_BITS] |= mask
+            self.dirty[addr >> self.PAGE_BITS] = self.dirty.get(addr >> self.PAGE_BITS, 0) | mask
+            addr = addr + count
+
+    def dumpBinary(self, path: str, base: int, count: int):
+        words = array("Q", (self.read(addr) for addr in range(base, base + count)))
+        if sys.byteorder != "little":
+            words.byteswap()
+        with open(path, "wb") as f:
+            f.write(words.tobytes())
+
+    def _writablePage(self, number: int) -> array:
+        page = self.pages.get(number)
+        if page is None:
+            page = array("Q", bytes(8 * self.PAGE_SIZE))
+            self.pages[number] = page
+            self.present[number] = 0
+        elif number in self._shared:
+            page = array("Q", page)
+            self.pages[number] = page
+            self._shared.discard(number)
+        return page
+
+    def read(self, addr: int) -> int:
+        page = self.pages.get(addr >> self.PAGE_BITS)
+        if page is None:
+            return 0
+        return page[addr & (self.PAGE_SIZE - 1)]
+
+    def write(self, addr: int, data: int):
+        number = addr >> self.PAGE_BITS
+        offset = addr & (self.PAGE_SIZE - 1)
+        data = data & MASK64
+        self._writablePage(number)[offset] = data
+        bit = 1 << offset
+        self.dirty[number] = self.dirty.get(number, 0) | bit
+
+        present = self.present[number]
+        self.present[number] = present | bit
+        words = self._pageDumps.get(number)
+        if words is not None:
+            words[addr] = data
+            if present & bit == 0 and present > bit:
+                # A new word below the last one of the page.
+                self._pageDumps[number] = dict(sorted(words.items()))
+
+    def _pageDump(self, number: int) -> dict:
+        words = self._pageDumps.get(number)
+        if words is None:
+            words = {}
+            page = self.pages[number]
+            present = self.present[number]
+            base = number << self.PAGE_BITS
+            if present == (1 << self.PAGE_SIZE) - 1:
+                words.update(zip(range(base, base + self.PAGE_SIZE), page))
+            else:
+                while present:
+                    low = present & -present
+                    offset = low.bit_length() - 1
+                    words[base + offset] = page[offset]
+                    present = present ^ low
+            self._pageDumps[number] = words
+        return words
+
+    def dump(self) -> dict:
+        # Every initialized or written word, by increasing address.
+        data = {}
+        for number in sorted(self.pages):
+            data.update(self._pageDump(number))
+        return data
+
+    @property
+    def data(self) -> dict:
+        return self.dump()
+
+    def snapshot(self) -> "DataMemory":
+        copy = DataMemory()
+        copy.pages = self.pages.copy()
+        copy.present = self.present.copy()
+        copy._shared = set(self.pages)
+        self._shared = set(self.pages)
+        return copy
+
+    def takeDirty(self) -> list[int]:
+        '''
+            @return the addresses written since the last call, by increasing
+            address, which are no longer dirty after it
+        '''
+        addresses = []
+        for number in sorted(self.dirty):
+            mask = self.dirty[number]
+            base = number << self.PAGE_BITS
+            while mask:
+                low = mask & -mask
+                addresses.append(base + low.bit_length() - 1)
+                mask = mask ^ low
+        self.dirty = {}
+        return addresses
 
-    MultiplierPipe = [
-        {
+
+class VLIW470:
+    def __init__(self, program: list[list[str]], memory: DataMemory = None):
+        self.program = decodeProgram(program)
+        self.dataMemory = memory if memory is not None else DataMemory()
+        self.cycle = 0
+
+        # Visible Architecture State.
+        self.PC = 0
+        self.RBB = 0
+        self.LC = 0
+        self.EC = 0
+        # 64-bit registers in a flat buffer, and one bit per predicate register.
+        self.PhysicalRegisterFile = array("Q", bytes(8 * 96))
+        self.PredicateBits = 0
+
+        # Functional pipelines
+        self.ALU0Pipe = {
             "predicate": False,
+            "opcode": "alu", # alu, updateLC, updateEC, updateRBB, updatePredicate
             "targetReg": 0,
-            "result": 0,
-        },
-        {
+            "value": 0
+        }
+
+        self.ALU1Pipe = {
             "predicate": False,
+            "opcode": "alu",
             "targetReg": 0,
-            "result": 0,
+            "value": 0
+        }
+
+        self.BranchPipe = {
+            "predicate": False,
+            "opcode": "hw", # lw or loop
+            "targetPC": 0,
+        }
+
+        self.MemoryPipe = {
+            "predicate": False,
+            "opcode": "load", # load or store
+            "address": 0,
+            "data": 0,
+            "loadDestReg": 0,
         }
-    ]
+
+        self.MultiplierPipe = [
+            {
+                "predicate": False,
+                "targetReg": 0,
+                "result": 0,
+            },
+            {
+                "predicate": False,
+                "targetReg": 0,
+                "result": 0,
+            }
+        ]
+
+        # Cycle records are streamed to this writer as they are produced.
+        # Only the cycles recordStart + k * recordEvery below recordStop are recorded.
+        self.trace = None
+        self.recordEvery = 1
+        self.recordStart = 0
+        self.recordStop = None
+
+        # A checkpoint is saved into saveDir at the beginning of every cycle multiple of saveEvery,
+        # until the end of the program (run() drains the pipeline after it).
+        self.saveEvery = None
+        self.saveDir = "."
+
+        # Tracers (see hooks.py) notified of every simulated cycle, and the
+        # performance counters (see counters.py), one of them when not None.
+        self.tracers = []
+        self.counters = None
+
+        self._debug_currentCycleUpdate = set()
 
     def serialize(self) -> dict:
         return {
@@ -111,36 +451,68 @@ class VLIW470:
             "RBB": self.RBB,
             "LC": self.LC,
             "EC": self.EC,
-            "PhysicalRegisterFile": self.PhysicalRegisterFile.copy(),
-            "PredicateRegisters": self.PredicateRegisters.copy(),
+            "PhysicalRegisterFile": self.PhysicalRegisterFile.tolist(),
+            "PredicateRegisters": self.PredicateRegisters,
             "ALU0": self.ALU0Pipe.copy(),
             "ALU1": self.ALU1Pipe.copy(),
             "Branch": self.BranchPipe.copy(),
             "Memory": self.MemoryPipe.copy(),
             "Multiply": self.MultiplierPipe.copy(),
-            "MemoryData": dataMemory.data.copy()
+            "MemoryData": self.dataMemory.dump()
         }
 
-    _debug_currentCycleUpdate = []
+    def isRecorded(self) -> bool:
+        if self.trace is None or self.cycle < self.recordStart:
+            return False
+        if self.recordStop is not None and self.cycle >= self.recordStop:
+            return False
+        return (self.cycle - self.recordStart) % self.recordEvery == 0
+
+    def nextSavedCycle(self) -> float:
+        if self.saveEvery is None:
+            return float("inf")
+        return (self.cycle + self.saveEvery - 1) // self.saveEvery * self.saveEvery
 
-    def updateRegister(self, name: str, value: int):
-        if name in self._debug_currentCycleUpdate:
-            print("Warning: Multiple instructions are updating the register {}.".format(name))
+    @property
+    def PredicateRegisters(self) -> list[bool]:
+        return [bit == "1" for bit in format(self.PredicateBits, "096b")[::-1]]
+
+    def addTracer(self, tracer):
+        self.tracers.append(tracer)
+
+    def removeTracer(self, tracer):
+        self.tracers.remove(tracer)
+
+    def claimPort(self, port: int):
+        if port in self._debug_currentCycleUpdate:
+            print("Warning: Multiple instructions are updating the register {}.".format(portName(port)))
         else:
-            self._debug_currentCycleUpdate.append(name)
-        
-        if name.startswith("x"):
-            self.PhysicalRegisterFile[int(name[1:])] = value
-        elif name.startswith("p"):
-            self.PredicateRegisters[int(name[1:])] = value != 0
-        elif name == "LC":
-            self.LC = value
-        elif name == "RBB":
-            self.RBB = value
-        elif name == "EC":
-            self.EC = value
+            self._debug_currentCycleUpdate.add(port)
+
+    def writeRegister(self, idx: int, value: int):
+        self.claimPort(idx)
+        self.PhysicalRegisterFile[idx] = value & MASK64
+
+    def writePredicate(self, idx: int, value: int):
+        if idx < 0:
+            idx = idx + 96 # renameRegister() goes negative once RBB exceeds 96, index from the end like a list.
+        self.claimPort(PREDICATE_PORT + idx)
+        if value != 0:
+            self.PredicateBits = self.PredicateBits | (1 << idx)
         else:
-            assert False, "Wrong register name is met: {}".format(name)
+            self.PredicateBits = self.PredicateBits & ~(1 << idx)
+
+    def writeLC(self, value: int):
+        self.claimPort(LC_PORT)
+        self.LC = value
+
+    def writeEC(self, value: int):
+        self.claimPort(EC_PORT)
+        self.EC = value
+
+    def writeRBB(self, value: int):
+        self.claimPort(RBB_PORT)
+        self.RBB = value
 
     def renameRegister(self, idx: int) -> int:
 
@@ -154,70 +526,29 @@ class VLIW470:
         
         return idx
 
-    def parseImmediate(self, i: str) -> int:
-        if i.startswith("0x"):
-            return int(i, 16) # at present we only support hex and decimal.
-        return int(i)
-
-    def parse(self, i: str) -> dict:
-        # i could be a format like "(pX) inst dst, src, third"
-        # this function is trying to separate the predication.
-        info = i.split()
-        predication = True
-        info[0] = info[0].strip()
-        if info[0].startswith("(") and info[0].endswith(")"):
-            # with predication
-            idx = int(info[0][2:-1].strip())
-            assert idx <= 95, "Undefined predicate register: p{}".format(idx)
-            predication = self.PredicateRegisters[self.renameRegister(idx)]
-            info.remove(info[0])
-        
-        operands: list[str] = []
+    def readPredicate(self, idx: int) -> bool:
+        if idx < 0:
+            return True
+        idx = self.renameRegister(idx)
+        if idx < 0:
+            idx = idx + 96
+        return (self.PredicateBits >> idx) & 1 == 1
 
-        for item in info[1:]:
-            item = item.strip()
-            if item.endswith(","):
-                operands.append(item[:-1].strip())
-            else:
-                operands.append(item.strip())
+    def decodeALUInstruction(self, op: Operation) -> dict:
+        opcode = op.opcode
+        predication = self.readPredicate(op.predicate)
 
-        return {
-            "predicate": predication,
-            "opcode": info[0].strip(),
-            "operands": operands
-        }
-
-    def decodeALUInstruction(self, i: str) -> dict:
-        decoded = self.parse(i)
-        predication: bool = decoded["predicate"]
-        opcode: str = decoded["opcode"]
-        ops: list[str] = decoded["operands"]
-        
-        # Now start the normal instruction decoding.
-        assert opcode in ["add", "addi", "sub", "mov", "nop"], "Undefined instruction: {}".format(i)
-        
-        # classify instruction by its type
-        if opcode in ["add", "addi", "sub"]:
-            # define the source
-            assert ops[0].startswith('x'), "Cannot determine the destination: {}".format(i)
-            dest =  self.renameRegister(int(ops[0][1:]))
-
-            assert ops[1].startswith('x'), "Cannot determine the source reg: {}".format(i)
-            src1 = self.renameRegister(int(ops[1][1:]))
-
-            if opcode == "addi":
-                src2 = int(ops[2])
-            else:
-                assert ops[2].startswith('x'), "Cannot determine the 2nd source reg: {}".format(i)
-                src2 = self.renameRegister(int(ops[2][1:]))
+        if opcode in (Opcode.ADD, Opcode.ADDI, Opcode.SUB):
+            dest = self.renameRegister(op.dest)
+            src1 = self.renameRegister(op.src1)
 
             result = 0
-            if opcode == "add":
-                result = self.PhysicalRegisterFile[src1] + self.PhysicalRegisterFile[src2]
-            elif opcode == "addi":
-                result = self.PhysicalRegisterFile[src1] + src2
-            elif opcode == "sub":
-                result = self.PhysicalRegisterFile[src1] - self.PhysicalRegisterFile[src2]
+            if opcode == Opcode.ADD:
+                result = self.PhysicalRegisterFile[src1] + self.PhysicalRegisterFile[self.renameRegister(op.src2)]
+            elif opcode == Opcode.ADDI:
+                result = self.PhysicalRegisterFile[src1] + op.imm
+            elif opcode == Opcode.SUB:
+                result = self.PhysicalRegisterFile[src1] - self.PhysicalRegisterFile[self.renameRegister(op.src2)]
                 if result < 0:
                     result = result + 0x10000000000000000 # 2-complementary
             result = result & 0xFFFFFFFFFFFFFFFF
@@ -228,101 +559,61 @@ class VLIW470:
                 "targetReg": dest,
                 "value": result
             }
-
-        elif opcode == "mov":
-            if ops[0].startswith("p"):
-                # it's updating a predicate
-                idx = self.renameRegister(int(ops[0][1:]))
-
-                if ops[1] == "true":
-                    return {
-                        "predicate": predication,
-                        "opcode": "updatePredicate", # alu, updateLC, updateEC, updateRBB, updatePredicate
-                        "targetReg": idx,
-                        "value": 1
-                    }
-                elif ops[1] == "false":
-                    return {
-                        "predicate": predication,
-                        "opcode": "updatePredicate", # alu, updateLC, updateEC, updateRBB, updatePredicate
-                        "targetReg": idx,
-                        "value": 0
-                    }
-                else:
-                    assert False, "Cannot determine the source operand: {}".format(i)
-            elif ops[0].upper() in ["LC", "EC", "RBB"]:
-                dest = ops[0].upper()
-                value = int(ops[1])
-                if ops[0].upper() == "RBB":
-                    assert value < 64, "The maximum value of RBB is 63. The value you provide causes overflow."
-                return {
-                    "predicate": predication,
-                    "opcode": "update{}".format(dest), # alu, updateLC, updateEC, updateRBB, updatePredicate
-                    "targetReg": 0,
-                    "value": value
-                }
-            elif ops[0].startswith('x'):
-                dst = self.renameRegister(int(ops[0][1:]))
-                if ops[1].startswith('x'):
-                    src = self.renameRegister(int(ops[1][1:]))
-                    return {
-                        "predicate": predication,
-                        "opcode": "alu",
-                        "targetReg": dst,
-                        "value": self.PhysicalRegisterFile[src]
-                    }
-                else: # It should be an integer
-                    return {
-                        "predicate": predication,
-                        "opcode": "alu",
-                        "targetReg": dst,
-                        "value": self.parseImmediate(ops[1])
-                    }
-            else:
-                assert False, "Unknown instruction: {}".format(i)
-        elif opcode == "nop":
+        elif opcode == Opcode.MOVP:
             return {
-                "predicate": False,
-                "opcode": "alu", # alu, updateLC, updateEC, updateRBB, updatePredicate
+                "predicate": predication,
+                "opcode": "updatePredicate", # alu, updateLC, updateEC, updateRBB, updatePredicate
+                "targetReg": self.renameRegister(op.dest),
+                "value": op.imm
+            }
+        elif opcode in (Opcode.MOVLC, Opcode.MOVEC, Opcode.MOVRBB):
+            return {
+                "predicate": predication,
+                "opcode": UPDATE_OPCODES[opcode], # alu, updateLC, updateEC, updateRBB, updatePredicate
                 "targetReg": 0,
-                "value": 0
+                "value": op.imm
             }
-
-    def decodeMultiplierInstruction(self, i: str) -> dict:
-        decoded = self.parse(i)
-        predication: bool = decoded["predicate"]
-        opcode: str = decoded["opcode"]
-        ops: list[str] = decoded["operands"]
-
-        assert opcode in ["mulu", "nop"]
-
-        if opcode == "mulu":
-            assert ops[0].startswith('x') and ops[1].startswith('x') and ops[2].startswith('x'), "Undefined instruction: {}".format(i)
-            dest = self.renameRegister(int(ops[0][1:]))
-            src1 = self.renameRegister(int(ops[1][1:]))
-            src2 = self.renameRegister(int(ops[2][1:]))
+        elif opcode == Opcode.MOV:
             return {
                 "predicate": predication,
-                "targetReg": dest,
-                "result": (self.PhysicalRegisterFile[src1] * self.PhysicalRegisterFile[src2]) & 0xFFFFFFFFFFFFFFFF,
+                "opcode": "alu",
+                "targetReg": self.renameRegister(op.dest),
+                "value": self.PhysicalRegisterFile[self.renameRegister(op.src1)]
             }
-        else:
+        elif opcode == Opcode.MOVI:
             return {
-                "predicate": False,
-                "targetReg": 0,
-                "result": 0,
+                "predicate": predication,
+                "opcode": "alu",
+                "targetReg": self.renameRegister(op.dest),
+                "value": op.imm
             }
 
+        return {
+            "predicate": False,
+            "opcode": "alu", # alu, updateLC, updateEC, updateRBB, updatePredicate
+            "targetReg": 0,
+            "value": 0
+        }
 
-    def decodeLoadStoreInstruction(self, i: str) -> dict:
-        decoded = self.parse(i)
-        predication: bool = decoded["predicate"]
-        opcode: str = decoded["opcode"]
-        ops: list[str] = decoded["operands"]
+    def decodeMultiplierInstruction(self, op: Operation) -> dict:
+        if op.opcode == Opcode.MULU:
+            dest = self.renameRegister(op.dest)
+            src1 = self.renameRegister(op.src1)
+            src2 = self.renameRegister(op.src2)
+            return {
+                "predicate": self.readPredicate(op.predicate),
+                "targetReg": dest,
+                "result": (self.PhysicalRegisterFile[src1] * self.PhysicalRegisterFile[src2]) & 0xFFFFFFFFFFFFFFFF,
+            }
 
-        assert opcode in ["ld", "st", "nop"]
+        return {
+            "predicate": False,
+            "targetReg": 0,
+            "result": 0,
+        }
 
-        if opcode == "nop":
+    def decodeLoadStoreInstruction(self, op: Operation) -> dict:
+        if op.opcode == Opcode.NOP:
             return {
                 "predicate": False,
                 "opcode": "load", # load or store
@@ -331,60 +622,38 @@ class VLIW470:
                 "loadDestReg": 0,
             }
 
-        # ops[0]: xNN
-        # ops[1]: imm(xMM)
-        assert ops[0].startswith('x') and "(" in ops[1] and ")" in ops[1], "Undefined instruction: {}".format(i)
+        dest = self.renameRegister(op.dest)
+        addr = self.PhysicalRegisterFile[self.renameRegister(op.src1)] + op.imm
 
-        dest = self.renameRegister(int(ops[0][1:]))
-        imm = ops[1].split("(")[0].strip()
-        if len(imm) == 0:
-            imm = 0
-        elif imm.startswith("0x"):
-            imm = int(imm, 16)
-        else:
-            imm = int(imm)
-
-        add = ops[1].split("(")[1].strip()[1:-1]
-        addr = self.PhysicalRegisterFile[self.renameRegister(int(add))] + imm
-
-        if opcode == "ld":
+        if op.opcode == Opcode.LD:
             return {
-                "predicate": predication,
+                "predicate": self.readPredicate(op.predicate),
                 "opcode": "load", # load or store
                 "address": addr,
                 "data": 0,
                 "loadDestReg": dest,
             }
-        elif opcode == "st":
-            return {
-                "predicate": predication,
-                "opcode": "store", # load or store
-                "address": addr,
-                "data": self.PhysicalRegisterFile[dest],
-                "loadDestReg": 0,
-            }
-            
-
 
-    def decodeBrancInstruction(self, i: str) -> dict:
-        decoded = self.parse(i)
-        predication: bool = decoded["predicate"]
-        opcode: str = decoded["opcode"]
-        ops: list[str] = decoded["operands"]
-
-        assert opcode in ["loop", "loop.pip", "nop"], "Undefined instruction: {}".format(i)
+        return {
+            "predicate": self.readPredicate(op.predicate),
+            "opcode": "store", # load or store
+            "address": addr,
+            "data": self.PhysicalRegisterFile[dest],
+            "loadDestReg": 0,
+        }
 
-        if opcode == "loop":
+    def decodeBrancInstruction(self, op: Operation) -> dict:
+        if op.opcode == Opcode.LOOP:
             return {
-                "predicate": predication,
+                "predicate": self.readPredicate(op.predicate),
                 "opcode": "loop", # lw or loop
-                "targetPC": int(ops[0]),
+                "targetPC": op.imm,
             }
-        elif opcode == "loop.pip":
+        elif op.opcode == Opcode.LOOPPIP:
             return {
-                "predicate": predication,
+                "predicate": self.readPredicate(op.predicate),
                 "opcode": "hw", # lw or loop
-                "targetPC": int(ops[0]),
+                "targetPC": op.imm,
             }
 
         return {
@@ -394,14 +663,29 @@ class VLIW470:
         }
 
     def tick(self):
+        if self.saveEvery is not None and self.cycle % self.saveEvery == 0 and self.PC < len(self.program):
+            saveCheckpoint(self, checkpointPath(self.saveDir, self.cycle))
+
+        self.decode()
+        for tracer in self.tracers:
+            tracer.decoded(self)
+
+        # record the state
+        if self.isRecorded():
+            self.trace.write(self.serialize())
+
+        self.execute()
+        self.writeBack()
+        for tracer in self.tracers:
+            tracer.retired(self)
+
+    def decode(self):
         ## PC Propagate
-        if self.PC >= len(instructionMemory):
-            inst = ["nop", "nop", "nop", "nop", "nop"]
+        if self.PC >= len(self.program):
+            inst = NOP_BUNDLE
         else:
-            inst = instructionMemory[self.PC]
-        
-        assert len(inst) == 5, "Each bundle should always have 5 instructions"
-    
+            inst = self.program[self.PC]
+
         # Branch Unit will be immediately updated, because its' combinational logic.
         #### inst[0] -> ALU0
         self.ALU0Pipe = self.decodeALUInstruction(inst[0])
@@ -414,9 +698,7 @@ class VLIW470:
         #### inst[4] -> Branch
         self.BranchPipe = self.decodeBrancInstruction(inst[4])
 
-        # record the state
-        state.append(self.serialize())
-
+    def execute(self):
         # Now start latch other data structures.
         ## Execution Stage
         self._debug_currentCycleUpdate.clear()
@@ -427,44 +709,45 @@ class VLIW470:
                 idx = aluPipe["targetReg"]
                 value = aluPipe["value"]
                 if aluPipe["opcode"] == "alu":
-                    self.updateRegister("x{}".format(idx), value)
+                    self.writeRegister(idx, value)
                 elif aluPipe["opcode"] == "updateLC":
-                    self.updateRegister("LC", value)
+                    self.writeLC(value)
                 elif aluPipe["opcode"] == "updateEC":
-                    self.updateRegister("EC", value)
+                    self.writeEC(value)
                 elif aluPipe["opcode"] == "updateRBB":
-                    self.updateRegister("RBB", value)
+                    self.writeRBB(value)
                 elif aluPipe["opcode"] == "updatePredicate":
-                    self.updateRegister("p{}".format(idx), value)
+                    self.writePredicate(idx, value)
                 else:
                     assert False, "Wrong opcode is provided: {}".format(aluPipe["opcode"])
         
         #### Memory
         if self.MemoryPipe["predicate"]:
             if self.MemoryPipe["opcode"] == "load":
-                self.updateRegister(
-                    "x{}".format(self.MemoryPipe["loadDestReg"]),
-                    dataMemory.read(self.MemoryPipe["address"])
+                self.writeRegister(
+                    self.MemoryPipe["loadDestReg"],
+                    self.dataMemory.read(self.MemoryPipe["address"])
                 )
             elif self.MemoryPipe["opcode"] == "store":
-                dataMemory.write(
+                self.dataMemory.write(
                     self.MemoryPipe["address"],
                     self.MemoryPipe["data"]
                 )
             else:
                 assert False, "Wrong opcode"
 
+    def writeBack(self):
         #### Multiplier: the most complex one.
         ##### Always pop the last one.
         if self.MultiplierPipe[2]["predicate"]:
-            self.updateRegister(
-                "x{}".format(self.MultiplierPipe[2]["targetReg"]),
+            self.writeRegister(
+                self.MultiplierPipe[2]["targetReg"],
                 self.MultiplierPipe[2]["result"]
             )
         self.MultiplierPipe.pop()
 
         #### Branch Unit
-        if self.PC >= len(instructionMemory):
+        if self.PC >= len(self.program):
             self.PC = self.PC
         else:
             self.PC = self.PC + 1
@@ -472,44 +755,234 @@ class VLIW470:
         if self.BranchPipe["predicate"]:
             if self.BranchPipe["opcode"] == "loop":
                 if self.LC > 0:
-                    self.updateRegister("LC", self.LC - 1)
+                    self.writeLC(self.LC - 1)
                     self.PC  = self.BranchPipe["targetPC"]
             elif self.BranchPipe["opcode"] == "hw":
                 if self.LC > 0:
-                    self.updateRegister("LC", self.LC - 1)
-                    self.updateRegister("RBB", self.RBB + 1)
-                    self.updateRegister("p{}".format(self.renameRegister(32)), 1)
+                    self.writeLC(self.LC - 1)
+                    self.writeRBB(self.RBB + 1)
+                    self.writePredicate(self.renameRegister(32), 1)
                     self.PC = self.BranchPipe["targetPC"]
                 elif self.EC > 0:
-                    self.updateRegister("EC", self.EC - 1)
-                    self.updateRegister("RBB", self.RBB + 1)
-                    self.updateRegister("p{}".format(self.renameRegister(32)), 0)
+                    self.writeEC(self.EC - 1)
+                    self.writeRBB(self.RBB + 1)
+                    self.writePredicate(self.renameRegister(32), 0)
                     self.PC = self.BranchPipe["targetPC"]
                 else:
-                    self.updateRegister("p{}".format(self.renameRegister(32)), 0)
-
-        
-
+                    self.writePredicate(self.renameRegister(32), 0)
 
-def main():
-    processor = VLIW470()
-
-    # In the main loop, let's see what happens
-    while True:
-        processor.tick()
+        self.cycle = self.cycle + 1
 
-        if processor.PC >= len(instructionMemory):
-            # ok, now it's possible to see a stop. do two more cycles.
-            processor.tick()
-            processor.tick()
-            break
         
-    # Finally, dump the state to the file
-    json.dump(state, arg.result, indent=4)
 
 
+    def advance(self, maxCycles: int = None):
+        # Simulate at least one cycle. Faster engines override this.
+        self.tick()
+
+    def run(self, maxCycles: int = None) -> int:
+        '''
+            Simulate until the program ends, or for at most maxCycles cycles.
+            @return the number of simulated cycles
+        '''
+        while maxCycles is None or self.cycle < maxCycles:
+            self.advance(maxCycles)
+
+            if self.PC >= len(self.program):
+                # ok, now it's possible to see a stop. do two more cycles.
+                for _ in range(2):
+                    if maxCycles is not None and self.cycle >= maxCycles:
+                        break
+                    self.tick()
+                break
+
+        return self.cycle
+
+
+def run(program: list[list[str]], memory: dict = {}, maxCycles: int = None, trace: TraceWriter = None,
+        finalOnly: bool = False, every: int = 1, start: int = 0, stop: int = None, jit: bool = False,
+        fastForward: bool = False, keep: list[tuple[int, int]] = [], checkpointEvery: int = 1,
+        saveEvery: int = None, saveDir: str = ".", restore: str = None, counters: bool = False,
+        profile: bool = False) -> TraceWriter:
+    '''
+        Simulate a program (a list of bundles) with the given data memory
+        initialization (the content of memory.json, or a DataMemory).
+        The cycles start, start + every, ... below stop are recorded into trace,
+        an in-memory RecordedTrace by default. With finalOnly, no cycle is
+        recorded at all and serialize() only runs once, at the end.
+        With jit, the cycles that are not recorded run as compiled Python code.
+        With fastForward, every cycle is recorded but the steady-state loop
+        iterations, of which only the first cycle is recorded, except in the
+        [start, stop) cycle ranges of keep (see fastforward.py). checkpointEvery
+        records the first cycle of one steady-state iteration out of that many.
+        A checkpoint of the whole state is saved into saveDir every saveEvery
+        cycles. With restore, the simulation resumes from that checkpoint
+        instead of starting from memory. With counters, the performance
+        counters report (see counters.py) is stored in trace.counters. With
+        profile, the time spent in every phase (see hooks.py) is stored in
+        trace.profile.
+        @return the trace, whose final attribute holds the state after the last cycle
+    '''
+    assert every > 0, "The sampling period must be positive."
+    assert not fastForward or (every == 1 and start == 0 and stop is None), "Fast-forward cannot be combined with sampling."
+
+    if trace is None:
+        trace = RecordedTrace()
+    if not isinstance(memory, DataMemory):
+        memory = DataMemory(memory)
+
+    if fastForward:
+        from fastforward import FastForwardVLIW470
+        processor = FastForwardVLIW470(program, memory, keep, checkpointEvery)
+    elif jit:
+        from jit import JITVLIW470
+        processor = JITVLIW470(program, memory)
+    else:
+        processor = VLIW470(program, memory)
+    if restore is not None:
+        restoreCheckpoint(processor, restore)
+    if counters:
+        from counters import Counters
+        processor.counters = Counters(processor.program)
+        processor.addTracer(processor.counters)
+    processor.saveEvery = saveEvery
+    processor.saveDir = saveDir
+    if not finalOnly:
+        processor.trace = trace
+        trace.memory = processor.dataMemory
+        processor.recordEvery = every
+        processor.recordStart = start
+        processor.recordStop = stop
+    if profile:
+        from hooks import PhaseProfiler
+        profiler = PhaseProfiler(processor)
+    startCycle = processor.cycle
+    processor.run(maxCycles)
+    trace.final = processor.serialize()
+    trace.simulatedCycles = processor.cycle
+    if counters:
+        processor.counters.cycles = processor.cycle - startCycle
+        trace.counters = processor.counters.report()
+    if profile:
+        trace.profile = profiler.report()
+    return trace
 
 
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "instructions", type=argparse.FileType("r"), 
+        help="The JSON file defining the instruction to be executed"
+    )
+    parser.add_argument(
+        "result", type=str,
+        help="The cycle-accurate simulation result."
+    )
+    parser.add_argument(
+        "--format", choices=FORMATS, default="json",
+        help="Trace format: a JSON array (default), JSON Lines with one cycle per line, or keyframes and deltas."
+    )
+    parser.add_argument(
+        "--gzip", action="store_true",
+        help="Compress the trace with gzip (implied when the result ends with .gz)."
+    )
+    parser.add_argument(
+        "--keyframe", type=int, default=100,
+        help="Cycles between two full records in the delta trace format."
+    )
+    parser.add_argument(
+        "--memory", type=argparse.FileType("r"),
+        help="Optional data memory JSON initialization file."
+    )
+    parser.add_argument(
+        "--memory-binary", dest="memoryBinary", type=str,
+        help="Optional data memory initialization file of little-endian 64-bit words."
+    )
+    parser.add_argument(
+        "--memory-base", dest="memoryBase", type=lambda x: int(x, 0), default=0,
+        help="Address of the first word of --memory-binary."
+    )
+    parser.add_argument(
+        "--max-cycles", dest="maxCycles", type=int,
+        help="Stop the simulation after this many cycles."
+    )
+    parser.add_argument(
+        "--final-only", dest="finalOnly", action="store_true",
+        help="Only write the state after the last cycle."
+    )
+    parser.add_argument(
+        "--jit", action="store_true",
+        help="Run the cycles that are not written as compiled Python code."
+    )
+    parser.add_argument(
+        "--fast-forward", dest="fastForward", action="store_true",
+        help="Only write the first cycle of the steady-state loop iterations, and run the others compiled."
+    )
+    parser.add_argument(
+        "--keep", type=str, action="append", default=[],
+        help="With --fast-forward, write every cycle in the range START:STOP. Can be repeated."
+    )
+    parser.add_argument(
+        "--checkpoint-every", dest="checkpointEvery", type=int, default=1,
+        help="With --fast-forward, only write the first cycle of one steady-state iteration out of that many."
+    )
+    parser.add_argument(
+        "--save-every", dest="saveEvery", type=int,
+        help="Save a checkpoint of the whole state every N cycles (see checkpoint.py)."
+    )
+    parser.add_argument(
+        "--save-dir", dest="saveDir", type=str, default=".",
+        help="Directory of the checkpoints saved with --save-every."
+    )
+    parser.add_argument(
+        "--restore", type=str,
+        help="Resume the simulation from this checkpoint; the memory initialization is then ignored."
+    )
+    parser.add_argument(
+        "--stats", type=str,
+        help="Write the performance counters (cycles, IPC, slot utilization, ...) to this JSON file."
+    )
+    parser.add_argument(
+        "--profile", type=str,
+        help="Write the time spent decoding, executing, writing back, serializing and writing the trace to this JSON file."
+    )
+    parser.add_argument(
+        "--every", type=int, default=1,
+        help="Only write every Nth cycle."
+    )
+    parser.add_argument(
+        "--cycles", type=str, default=":",
+        help="Only write the cycles in the range START:STOP (STOP excluded)."
+    )
+
+    arg = parser.parse_args()
+    instructionMemory: list[list[str]] = json.load(arg.instructions)
+
+    memory = DataMemory()
+    if arg.memoryBinary:
+        memory.loadBinary(arg.memoryBinary, arg.memoryBase)
+    if arg.memory:
+        memory.load(json.load(arg.memory))
+
+    start, _, stop = arg.cycles.partition(":")
+    start = int(start) if start else 0
+    stop = int(stop) if stop else None
+
+    with openTraceWriter(arg.result, arg.format, arg.gzip, arg.keyframe) as writer:
+        keep = [tuple(int(c) for c in r.split(":")) for r in arg.keep]
+        trace = run(instructionMemory, memory, arg.maxCycles, writer, arg.finalOnly, arg.every, start, stop, arg.jit,
+            arg.fastForward, keep, arg.checkpointEvery, arg.saveEvery, arg.saveDir, arg.restore, arg.stats is not None,
+            arg.profile is not None)
+        if arg.finalOnly:
+            writer.write(writer.final)
+
+    if arg.stats:
+        with open(arg.stats, "w") as f:
+            json.dump(trace.counters, f, indent=4)
+    if arg.profile:
+        with open(arg.profile, "w") as f:
+            json.dump(trace.profile, f, indent=4)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import glob
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from compare import ReferenceIndex, DEFAULT_MAX_CYCLES, RED, GREEN, RESET
+
+# Python counterpart of testall.sh: checks the loop and loop.pip schedules of
+# every test against all of its simple_ref*/pip_ref* alternatives in one pool
+# of worker processes, then prints a summary table and optionally writes the
+# results as JSON.
+
+ANSI = re.compile(r"\x1b\[[0-9;]*m")
+
+# schedule kind -> (produced schedule, reference alternatives)
+KINDS = {
+    "loop": ("simple.json", "simple_ref*.json"),
+    "pip": ("pip.json", "pip_ref*.json"),
+}
+
+
+def findTests(roots: list[str]) -> list[str]:
+    tests = []
+    for root in roots:
+        for name in sorted(os.listdir(root)):
+            if os.path.isdir(os.path.join(root, name)):
+                tests.append(os.path.join(root, name))
+    return tests
+
+
+def readDescription(test: str) -> str:
+    try:
+        with open(os.path.join(test, "desc.txt")) as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def checkSchedule(test: str, schedule: str, references: str, semantic: tuple[list[dict], int] = None) -> dict:
+    result = {
+        "passed": False,
+        "reference": None,
+        "message": ""
+    }
+
+    try:
+        with open(os.path.join(test, schedule)) as f:
+            res = json.load(f)
+    except (OSError, ValueError) as e:
+        result["message"] = str(e)
+        return result
+
+    index = ReferenceIndex()
+    for ref in sorted(glob.glob(os.path.join(test, references))):
+        with open(ref) as f:
+            index.add(os.path.basename(ref), json.load(f))
+
+    if semantic is not None:
+        name, out = index.matchSemantics(res, *semantic)
+    else:
+        name, out = index.match(res)
+    result["passed"] = name is not None
+    result["reference"] = name
+    if name is None:
+        result["message"] = ANSI.sub("", out)
+    return result
+
+
+def runTest(job: tuple[str, tuple[list[dict], int]]) -> dict:
+    test, semantic = job
+    result = {
+        "test": test,
+        "description": readDescription(test),
+    }
+    for kind, (schedule, references) in KINDS.items():
+        result[kind] = checkSchedule(test, schedule, references, semantic)
+    result["passed"] = all(result[kind]["passed"] for kind in KINDS)
+    return result
+
+
+def printSummary(results: list[dict]):
+    width = max([len("Test")] + [len(r["test"]) for r in results])
+    print(f"{'Test':<{width}}  loop    pip     Detail")
+    for r in results:
+        status = ""
+        for kind in KINDS:
+            if r[kind]["passed"]:
+                status = status + f"{GREEN}PASSED{RESET}  "
+            else:
+                status = status + f"{RED}FAILED{RESET}  "
+        detail = next((r[kind]["message"] for kind in KINDS if r[kind]["message"]), "")
+        print(f"{r['test']:<{width}}  {status}{detail}")
+
+    for kind in KINDS:
+        passed = sum(1 for r in results if r[kind]["passed"])
+        print(f"passed {kind}: {passed}/{len(results)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the schedules of all the given tests in parallel.")
+    parser.add_argument("roots", nargs="*", default=["given_tests"], help="Directories holding one folder per test.")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count(), help="Number of worker processes.")
+    parser.add_argument("--json", help="Write the results to this JSON file.")
+    parser.add_argument("--semantic", action="store_true", help="Also accept schedules that simulate like a reference (see compare.py).")
+    parser.add_argument("--memory", nargs="+", default=[], help="Data memory initializations of the semantic mode.")
+    parser.add_argument("--max-cycles", dest="maxCycles", type=int, default=DEFAULT_MAX_CYCLES, help="Cycle limit of every simulation in the semantic mode.")
+    args = parser.parse_args()
+
+    semantic = None
+    if args.semantic:
+        memories = []
+        for path in args.memory:
+            with open(path) as f:
+                memories.append(json.load(f))
+        semantic = (memories or [{}], args.maxCycles)
+
+    jobs = [(test, semantic) for test in findTests(args.roots)]
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        results = list(pool.map(runTest, jobs, chunksize=max(1, len(jobs) // (4 * args.jobs))))
+
+    printSummary(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "passed": sum(1 for r in results if r["passed"]),
+                "total": len(results),
+                "tests": results
+            }, f, indent=4)
+
+    if not all(r["passed"] for r in results):
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
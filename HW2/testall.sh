@@ -10,30 +10,25 @@ do
     loopPassed=false
     loopColor=$RED
 
-    for simple_ref in ${tnum}/simple_ref*.json
-    do
-        out="$(python compare.py --loop ${tnum}/simple.json --refLoop ${simple_ref})"
-        passed=$(echo "$out" | head -n 1)
+    # All the reference alternatives are matched in one run.
+    out="$(python compare.py --loop ${tnum}/simple.json --refLoop ${tnum}/simple_ref*.json)"
+    passed=$(echo "$out" | head -n 1)
 
-        if [[ "$passed" == *"PASSED"* ]]; then
-            loopPassed=true
-            loopColor=$GREEN
-        fi
-    done
+    if [[ "$passed" == *"PASSED"* ]]; then
+        loopPassed=true
+        loopColor=$GREEN
+    fi
 
     pipPassed=false
     pipColor=$RED
 
-    for pip_ref in ${tnum}/pip_ref*.json
-    do
-        out="$(python compare.py --pip ${tnum}/pip.json  --refPip ${pip_ref})"
-        passed=$(echo "$out" | head -n 1)
+    out="$(python compare.py --pip ${tnum}/pip.json  --refPip ${tnum}/pip_ref*.json)"
+    passed=$(echo "$out" | head -n 1)
 
-        if [[ "$passed" == *"PASSED"* ]]; then
-            pipPassed=true
-            pipColor=$GREEN
-        fi
-    done
+    if [[ "$passed" == *"PASSED"* ]]; then
+        pipPassed=true
+        pipColor=$GREEN
+    fi
 
     cat ${tnum}/desc.txt
     printf "passed loop:  ${loopColor}${loopPassed}${RESET} passed pip: ${pipColor}${pipPassed}${RESET}\n\n"
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+
+# Benchmarks of the HW2 simulator and of the HW1 and HW2 comparators.
+#
+# The inputs are generated from a fixed seed: synthetic HW2 programs
+# (straight-line code, loop and loop.pip kernels, a memory stream) and HW1-style
+# traces. Every case then runs in its own Python process, which keeps the peak
+# RSS of each case apart and lets HW1 and HW2 modules with the same names
+# (compare, tracefile) be imported. The results are written as JSON, and can be
+# checked against a baseline produced the same way (on the same machine).
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HW1 = os.path.join(ROOT, "HW1")
+HW2 = os.path.join(ROOT, "HW2")
+SIMULATOR = os.path.join(HW2, "simulator")
+
+# Metrics where higher is better, and where lower is better.
+RATES = ["cyclesPerSecond", "recordsPerSecond"]
+COSTS = ["peakRSS", "traceBytes"]
+
+SEED = 470
+
+
+## HW2 program generators
+
+def straightLineProgram(bundles: int, rng: random.Random) -> list[list[str]]:
+    program = []
+    for _ in range(bundles):
+        regs = rng.sample(range(1, 32), 9)
+        program.append([
+            " addi x{}, x{}, {}".format(regs[0], regs[1], rng.randint(-64, 64)),
+            rng.choice([" add x{}, x{}, x{}", " sub x{}, x{}, x{}"]).format(regs[2], regs[3], regs[4]),
+            " mulu x{}, x{}, x{}".format(regs[5], regs[6], regs[5]),
+            rng.choice([" ld x{}, {}(x0)", " st x{}, {}(x0)"]).format(regs[7], rng.randint(0, 4095)),
+            " nop",
+        ])
+    return program
+
+
+def loopProgram(lc: int) -> list[list[str]]:
+    return [
+        [" mov LC, {}".format(lc), " mov x5, 0", " nop", " nop", " nop"],
+        [" addi x5, x5, 1", " nop", " nop", " ld x1, 0(x5)", " nop"],
+        [" addi x2, x1, 1", " nop", " mulu x3, x1, x1", " nop", " nop"],
+        [" nop", " nop", " nop", " st x2, 4096(x5)", " nop"],
+        [" nop", " nop", " nop", " st x3, 8192(x5)", " loop 1"],
+    ]
+
+
+def loopPipProgram(lc: int, loops: int) -> list[list[str]]:
+    # RBB is reset before every loop, so it never exceeds LC + EC.
+    program = []
+    for _ in range(loops):
+        start = len(program) + 2
+        program = program + [
+            [" mov LC, {}".format(lc), " mov EC, 1", " nop", " nop", " nop"],
+            [" mov p32, true", " mov RBB, 0", " nop", " nop", " nop"],
+            [" addi x5, x5, 1", " nop", " nop", "(p32) ld x32, 0(x5)", " nop"],
+            ["(p32) addi x35, x32, 1", " nop", " nop", "(p32) ld x38, 4096(x5)", " nop"],
+            [" nop", " nop", "(p32) mulu x41, x38, x38", "(p32) st x35, 8192(x5)", " nop"],
+            [" nop", " nop", " nop", "(p33) st x42, 12288(x5)", " loop.pip {}".format(start)],
+        ]
+    return program
+
+
+def memoryStreamProgram(words: int) -> list[list[str]]:
+    return [
+        [" mov LC, {}".format(words - 1), " mov x5, 0", " nop", " nop", " nop"],
+        [" addi x5, x5, 1", " nop", " nop", " ld x1, 0(x5)", " nop"],
+        [" add x2, x1, x5", " nop", " nop", " st x1, {}(x5)".format(words), " nop"],
+        [" nop", " nop", " nop", " st x2, {}(x5)".format(2 * words), " loop 1"],
+    ]
+
+
+def memoryStream(words: int, rng: random.Random) -> dict:
+    return {str(addr): rng.getrandbits(64) for addr in range(words)}
+
+
+## HW1 trace generator
+
+def hw1Record(cycle: int, rng: random.Random) -> dict:
+    activeList = [{
+        "Done": rng.random() < 0.5,
+        "Exception": False,
+        "LogicalDestination": rng.randint(0, 31),
+        "OldDestination": rng.randint(0, 63),
+        "PC": cycle + idx,
+    } for idx in range(rng.randint(0, 32))]
+    integerQueue = [{
+        "DestRegister": rng.randint(32, 63),
+        "OpAIsReady": True,
+        "OpARegTag": 0,
+        "OpAValue": rng.getrandbits(32),
+        "OpBIsReady": False,
+        "OpBRegTag": rng.randint(0, 63),
+        "OpBValue": 0,
+        "OpCode": rng.choice(["add", "addi", "sub", "mulu", "divu", "remu"]),
+        "PC": cycle + idx,
+    } for idx in range(rng.randint(0, 32))]
+    return {
+        "ActiveList": activeList,
+        "BusyBitTable": [rng.random() < 0.25 for _ in range(64)],
+        "DecodedPCs": [cycle + idx for idx in range(rng.randint(0, 4))],
+        "Exception": False,
+        "ExceptionPC": 0,
+        "FreeList": rng.sample(range(32, 64), rng.randint(0, 32)),
+        "IntegerQueue": integerQueue,
+        "PC": cycle * 4,
+        "PhysicalRegisterFile": [rng.getrandbits(32) for _ in range(64)],
+        "RegisterMapTable": list(range(32)),
+    }
+
+
+def hw1Trace(cycles: int, rng: random.Random) -> list[dict]:
+    return [hw1Record(cycle, rng) for cycle in range(cycles)]
+
+
+## Cases
+
+def defineCases(scale: float) -> dict:
+    '''
+        @return name -> (kind, parameters) of every benchmark case, and the
+        size of every generated program
+    '''
+    def n(count: int) -> int:
+        return max(1, int(count * scale))
+
+    return {
+        "hw2-straight-json": ("simulate", {"program": "straight", "format": "json"}),
+        "hw2-straight-delta": ("simulate", {"program": "straight", "format": "delta"}),
+        "hw2-loop": ("simulate", {"program": "loop", "finalOnly": True}),
+        "hw2-loop-jit": ("simulate", {"program": "loop", "finalOnly": True, "jit": True}),
+        "hw2-pip": ("simulate", {"program": "pip", "finalOnly": True}),
+        "hw2-pip-jit": ("simulate", {"program": "pip", "finalOnly": True, "jit": True}),
+        "hw2-stream": ("simulate", {"program": "stream", "finalOnly": True}),
+        "hw2-stream-json": ("simulate", {"program": "streamTrace", "format": "json"}),
+        "hw2-stream-delta": ("simulate", {"program": "streamTrace", "format": "delta"}),
+        "hw1-compare": ("hw1compare", {"cycles": n(2000)}),
+        "hw1-compare-digests": ("hw1compare", {"cycles": n(2000), "digests": True}),
+        "hw2-compare": ("hw2compare", {"bundles": n(50000)}),
+    }, {
+        "straight": n(1000),
+        "loop": n(20000),
+        "pip": n(40),
+        "stream": n(20000),
+        # Every cycle of this one is written, with the whole memory in the json format.
+        "streamTrace": n(200),
+    }
+
+
+def generateInputs(workdir: str, sizes: dict):
+    rng = random.Random(SEED)
+    programs = {
+        "straight": (straightLineProgram(sizes["straight"], rng), {}),
+        "loop": (loopProgram(sizes["loop"]), {}),
+        "pip": (loopPipProgram(100, sizes["pip"]), {}),
+        "stream": (memoryStreamProgram(sizes["stream"]), memoryStream(sizes["stream"], rng)),
+        "streamTrace": (memoryStreamProgram(sizes["streamTrace"]), memoryStream(sizes["streamTrace"], rng)),
+    }
+    for name, (program, memory) in programs.items():
+        with open(os.path.join(workdir, name + ".json"), "w") as f:
+            json.dump(program, f)
+        with open(os.path.join(workdir, name + ".memory.json"), "w") as f:
+            json.dump(memory, f)
+
+
+def peakRSS() -> int:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def runSimulate(workdir: str, params: dict) -> dict:
+    sys.path.insert(0, SIMULATOR)
+    from vliw470 import run, DataMemory
+    from tracefile import openTraceWriter
+
+    with open(os.path.join(workdir, params["program"] + ".json")) as f:
+        program = json.load(f)
+    with open(os.path.join(workdir, params["program"] + ".memory.json")) as f:
+        memory = DataMemory(json.load(f))
+
+    output = os.path.join(workdir, params["name"] + ".out")
+    start = time.perf_counter()
+    with openTraceWriter(output, params.get("format", "json")) as writer:
+        trace = run(program, memory, trace=writer, finalOnly=params.get("finalOnly", False), jit=params.get("jit", False))
+        if params.get("finalOnly", False):
+            writer.write(trace.final)
+    seconds = time.perf_counter() - start
+
+    return {
+        "seconds": seconds,
+        "cycles": trace.simulatedCycles,
+        "cyclesPerSecond": trace.simulatedCycles / seconds,
+        "traceBytes": os.path.getsize(output),
+    }
+
+
+def runHW1Compare(workdir: str, params: dict) -> dict:
+    rng = random.Random(SEED)
+    trace = hw1Trace(params["cycles"], rng)
+    paths = [os.path.join(workdir, params["name"] + suffix) for suffix in [".input.json", ".reference.json"]]
+    for path in paths:
+        with open(path, "w") as f:
+            json.dump(trace, f, indent=2)
+    del trace
+
+    sys.path.insert(0, HW1)
+    from compare import compareFiles, writeDigests
+
+    if params.get("digests", False):
+        writeDigests(paths[1])
+
+    start = time.perf_counter()
+    passed = compareFiles(paths[0], paths[1])
+    seconds = time.perf_counter() - start
+    assert passed, "The HW1 comparator rejected identical traces."
+
+    return {
+        "seconds": seconds,
+        "records": params["cycles"],
+        "recordsPerSecond": params["cycles"] / seconds,
+        "traceBytes": os.path.getsize(paths[0]),
+    }
+
+
+def runHW2Compare(workdir: str, params: dict) -> dict:
+    rng = random.Random(SEED)
+    schedule = straightLineProgram(params["bundles"], rng)
+    # The reference swaps the ALU slots of every other bundle, which is accepted.
+    reference = [[b[1], b[0]] + b[2:] if idx % 2 else list(b) for idx, b in enumerate(schedule)]
+
+    sys.path.insert(0, HW2)
+    from compare import compare
+
+    start = time.perf_counter()
+    out = compare(schedule, reference)
+    seconds = time.perf_counter() - start
+    assert "PASSED" in out, "The HW2 comparator rejected an equivalent schedule."
+
+    return {
+        "seconds": seconds,
+        "records": params["bundles"],
+        "recordsPerSecond": params["bundles"] / seconds,
+    }
+
+
+KINDS = {
+    "simulate": runSimulate,
+    "hw1compare": runHW1Compare,
+    "hw2compare": runHW2Compare,
+}
+
+
+def runCase(kind: str, workdir: str, params: dict) -> dict:
+    # Runs in the child process.
+    result = KINDS[kind](workdir, params)
+    result["peakRSS"] = peakRSS()
+    return result
+
+
+def runInChild(name: str, kind: str, params: dict, workdir: str) -> dict:
+    params = dict(params, name=name)
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--case", kind, json.dumps(params), workdir],
+        capture_output=True, text=True
+    )
+    if out.returncode != 0:
+        return {"error": out.stderr.strip().splitlines()[-1] if out.stderr.strip() else "exit code {}".format(out.returncode)}
+    # The result is the last line, after what the simulator printed.
+    return json.loads(out.stdout.splitlines()[-1])
+
+
+def checkRegressions(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for name, base in baseline["cases"].items():
+        current = results["cases"].get(name)
+        if current is None or "error" in current:
+            regressions.append(f"{name}: missing or failed")
+            continue
+        for metric in RATES:
+            if metric in base and current[metric] < base[metric] * (1 - tolerance):
+                regressions.append(f"{name}: {metric} {current[metric]:.0f} < {base[metric]:.0f}")
+        for metric in COSTS:
+            if metric in base and current[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{name}: {metric} {current[metric]} > {base[metric]}")
+    return regressions
+
+
+def printResults(results: dict):
+    width = max(len(name) for name in results["cases"])
+    print(f"{'Case':<{width}}  {'Seconds':>8}  {'Rate (/s)':>12}  {'Peak RSS':>10}  {'Trace bytes':>12}")
+    for name, r in results["cases"].items():
+        if "error" in r:
+            print(f"{name:<{width}}  {r['error']}")
+            continue
+        rate = r.get("cyclesPerSecond", r.get("recordsPerSecond"))
+        print(f"{name:<{width}}  {r['seconds']:>8.3f}  {rate:>12.0f}  {r['peakRSS'] // 1024:>8}KB  {r.get('traceBytes', '-'):>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the HW2 simulator and the HW1 and HW2 comparators.")
+    parser.add_argument("--output", "-o", default="results.json", help="Write the results to this JSON file.")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply the size of every generated input.")
+    parser.add_argument("--only", action="append", help="Only run this case. Can be repeated.")
+    parser.add_argument("--baseline", help="Check the results against this JSON file of earlier results.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression against the baseline.")
+    parser.add_argument("--update-baseline", dest="updateBaseline", action="store_true", help="Write the results to --baseline instead of checking them.")
+    parser.add_argument("--case", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        kind, params, workdir = args.case
+        print(json.dumps(runCase(kind, workdir, json.loads(params))))
+        return
+
+    cases, sizes = defineCases(args.scale)
+    if args.only:
+        cases = {name: cases[name] for name in args.only}
+
+    results = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "scale": args.scale,
+        "cases": {},
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        generateInputs(workdir, sizes)
+        for name, (kind, params) in cases.items():
+            results["cases"][name] = runInChild(name, kind, params, workdir)
+
+    printResults(results)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4)
+
+    if args.baseline and args.updateBaseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=4)
+    elif args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["scale"] != args.scale:
+            print(f"The baseline was measured with --scale {baseline['scale']}.")
+            exit(2)
+        regressions = checkRegressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            exit(1)
+        print("No regression against the baseline.")
+
+    if any("error" in r for r in results["cases"].values()):
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()